@@ -0,0 +1,294 @@
+import os
+import sys
+import argparse
+import contextlib
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import InputParsingScript
+import SyntheticExportGenerator
+
+# -------------------------------
+# Benchmarks
+# -------------------------------
+
+# Times every stage of the analysis on a synthetic export written by SyntheticExportGenerator.py, and compares the results with a saved baseline.
+# A stage that got slower or needs more memory than its baseline by more than the threshold makes the run fail, so regressions show up
+# before they are merged. Baselines are only comparable on the machine and Python version they were saved on, so every machine keeps its own
+# baseline, which is not committed. The first run on a machine saves its results as the baseline
+
+# Baseline file, next to this script
+baselineFilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# Stages in the order they are run. Every stage works on the output of the stages before it
+STAGENAMES = ('parse', 'stopwords', 'wordcount', 'histogram', 'plot', 'full')
+# Resolutions of the activity cube histograms made by the histogram stage
+HISTOGRAMRESOLUTIONS = ('hour', 'weekday', 'dayofyear', 'week', 'month', 'date')
+# Version of the baseline file format
+BASELINEVERSION = 1
+# Differences smaller than this many seconds are timer noise, and never count as a regression
+MINIMUMREGRESSIONSECONDS = 0.02
+
+
+# Holds the synthetic export and the objects the stages hand on to each other
+class BenchmarkRun:
+    def __init__(self, workDir, inputFilePath):
+        self.workDir = workDir
+        self.inputFilePath = inputFilePath
+        self.groupChat = None
+        self.contacts = {}
+        self.activityCube = None
+
+    # Runs the analysis in files mode, so the stages can be timed one at a time, and writes the output to a fresh folder
+    def UseFilesMode(self):
+        InputParsingScript.pipelineMode = 'files'
+        InputParsingScript.outputDir = os.path.join(self.workDir, 'output')
+
+    # Splits the export into the split_msg and timestamps files of every contact
+    def Parse(self):
+        self.UseFilesMode()
+        shutil.rmtree(InputParsingScript.outputDir, ignore_errors=True)
+        self.groupChat = InputParsingScript.GlobalStats('benchmark')
+        self.groupChat.SetFilePaths(self.inputFilePath)
+        (self.contacts, self.groupChat.chatAge) = self.groupChat.SplitMessageNametagTimestamp()
+        for contactName, contact in self.contacts.items():
+            contact.SetFilePaths(*self.groupChat.ContactFilePaths(contactName))
+
+    # Writes the without_stop_words file of every contact. The tokenizer is loaded beforehand, and the words it remembers are forgotten,
+    # so every run tokenizes the chat from scratch
+    def RemoveStopWords(self):
+        InputParsingScript.IndivStats.pieceDecisions.clear()
+        for contact in self.contacts.values():
+            contact.wordCount = contact.RemoveStopWords()
+
+    # Counts the words of every contact from its without_stop_words file
+    def CountWords(self):
+        for contact in self.contacts.values():
+            contact.FindWordCountFromFile()
+
+    # Builds the activity cube from the message store of the parsed chat, and makes every histogram of the group and of every contact from it
+    def MakeHistograms(self):
+        self.groupChat.contacts = self.contacts
+        self.activityCube = self.groupChat.BuildActivityCube()
+        for senderName in [None] + list(self.contacts):
+            for resolution in HISTOGRAMRESOLUTIONS:
+                self.activityCube.Histogram(resolution, senderName)
+
+    # Draws the yearly frequency plot of every contact and of the group with a new renderer, so setting up its figure is timed as well
+    def Plot(self):
+        renderer = InputParsingScript.FrequencyPlotRenderer()
+        for contactName in self.contacts:
+            renderer.Draw(self.activityCube.Histogram('dayofyear', contactName)[1], self.contacts[contactName].frequencyPlotOutputFilePath)
+        renderer.Draw(self.activityCube.Histogram('dayofyear')[1], self.groupChat.globalFrequencyPlotOutputFilePath)
+
+    # Runs the whole analysis of the export with the default settings, without the message store cache or a checkpoint to start from
+    def Full(self):
+        InputParsingScript.pipelineMode = 'memory'
+        InputParsingScript.useMessageStoreCache = False
+        InputParsingScript.useIncrementalCheckpoint = False
+        InputParsingScript.outputDir = os.path.join(self.workDir, 'full_output')
+        shutil.rmtree(InputParsingScript.outputDir, ignore_errors=True)
+        InputParsingScript.IndivStats.pieceDecisions.clear()
+        groupChat = InputParsingScript.GlobalStats('benchmark')
+        groupChat.SetFilePaths(self.inputFilePath)
+        groupChat.Calculations()
+
+    def RunStage(self, stageName):
+        {'parse': self.Parse, 'stopwords': self.RemoveStopWords, 'wordcount': self.CountWords, 'histogram': self.MakeHistograms,
+         'plot': self.Plot, 'full': self.Full}[stageName]()
+
+
+# Runs a stage repeat times and returns the shortest wall time. The analysis prints a lot, which is left out
+def TimeStage(run, stageName, repeat):
+    wallTimes = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull:
+            startTime = time.perf_counter()
+            run.RunStage(stageName)
+            wallTimes.append(time.perf_counter() - startTime)
+        devnull.close()
+    return min(wallTimes)
+
+
+# Runs a stage once more while tracing memory allocations, and returns the most memory it held at once in MB.
+# Allocations made by NumPy are traced as well
+def PeakMemoryOfStage(run, stageName):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull:
+        tracemalloc.start()
+        try:
+            run.RunStage(stageName)
+            peakBytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    devnull.close()
+    return peakBytes / 1e6
+
+
+# Returns the time taken from starting a new Python process to having the timestamp of the first line of the export parsed
+def ColdStartTime(inputFilePath):
+    code = ('import time; startTime = time.perf_counter(); import InputParsingScript; groupChat = InputParsingScript.GlobalStats("benchmark"); '
+            'groupChat.inputFilePath = {!r}; groupChat.timestampLayout = groupChat.DetectTimestampLayout(); '
+            'fin = open(groupChat.inputFilePath, encoding="utf8"); groupChat.ParseLineDate(fin.readline()); '
+            'print(time.perf_counter() - startTime)').format(inputFilePath)
+    output = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(InputParsingScript.__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output)
+
+
+# Checks that the fast tokenizer engine leaves exactly the same words as the TweetTokenizer on every line of the export.
+# Returns the lines where they differ
+def TokenizerMismatches(inputFilePath):
+    contact = InputParsingScript.IndivStats('benchmark')
+    contact.LoadTokenizer()
+    with open(inputFilePath, mode='r', encoding='utf8') as fin:
+        lines = fin.readlines()
+    tokenizerEngine = InputParsingScript.tokenizerEngine
+    try:
+        InputParsingScript.tokenizerEngine = 'nltk'
+        nltkResults = [contact.RemoveStopWordsFromLine(line) for line in lines]
+        InputParsingScript.tokenizerEngine = 'fast'
+        InputParsingScript.IndivStats.pieceDecisions.clear()
+        fastResults = [contact.RemoveStopWordsFromLine(line) for line in lines]
+    finally:
+        InputParsingScript.tokenizerEngine = tokenizerEngine
+    return [line for (line, nltkResult, fastResult) in zip(lines, nltkResults, fastResults) if nltkResult != fastResult]
+
+
+# Compares the results with the baseline. Returns a list of the regressions found
+def FindRegressions(results, baseline, threshold):
+    regressions = []
+    for stageName, result in results['stages'].items():
+        baselineResult = baseline['stages'].get(stageName)
+        if baselineResult is None:
+            continue
+        for (metric, unit) in (('seconds', 's'), ('peakMB', 'MB')):
+            if metric not in result or metric not in baselineResult:
+                continue
+            if metric == 'seconds' and result[metric] - baselineResult[metric] < MINIMUMREGRESSIONSECONDS:
+                continue
+            if result[metric] > baselineResult[metric] * (1 + threshold):
+                regressions.append('{} {}: {:.3f} {} against {:.3f} {} in the baseline'.format(stageName, metric, result[metric], unit,
+                                                                                             baselineResult[metric], unit))
+    return regressions
+
+
+def PrintResults(results, baseline):
+    print('\n{:<10} {:>9} {:>12} {:>8} {:>9} {:>14}'.format('stage', 'seconds', 'lines/s', 'MB/s', 'peak MB', 'vs baseline'))
+    for stageName, result in results['stages'].items():
+        change = ''
+        if baseline is not None and stageName in baseline['stages']:
+            change = '{:+.0%}'.format(result['seconds'] / baseline['stages'][stageName]['seconds'] - 1)
+        print('{:<10} {:>9.3f} {:>12} {:>8} {:>9} {:>14}'.format(
+            stageName, result['seconds'], '{:.0f}'.format(result['linesPerSecond']) if 'linesPerSecond' in result else '',
+            '{:.2f}'.format(result['megabytesPerSecond']) if 'megabytesPerSecond' in result else '',
+            '{:.1f}'.format(result['peakMB']) if 'peakMB' in result else '', change))
+
+
+def ParseArguments(arguments = None):
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of the chat analysis on a synthetic export, and compares them with the baseline.')
+    parser.add_argument('--members', type=int, default=8, help='number of people in the synthetic chat (default: 8)')
+    parser.add_argument('--messages', type=int, default=20000, help='number of messages in the synthetic chat (default: 20000)')
+    parser.add_argument('--layout', choices=(InputParsingScript.LAYOUTDAYFIRST, InputParsingScript.LAYOUTAMPM, InputParsingScript.LAYOUTMONTHFIRST),
+                        default=InputParsingScript.LAYOUTDAYFIRST, help='date layout of the synthetic chat (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic chat (default: 0)')
+    parser.add_argument('--stages', default=','.join(STAGENAMES), help='comma separated stages to run (default: all of {})'.format(','.join(STAGENAMES)))
+    parser.add_argument('--repeat', type=int, default=3, help='number of times every stage is timed, the fastest time counts (default: 3)')
+    parser.add_argument('--threshold', type=float, default=0.25, help='fraction by which a stage may be slower or use more memory than its baseline (default: 0.25)')
+    parser.add_argument('--baseline', default=baselineFilePath, help='baseline file (default: benchmark_baseline.json next to this script)')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline instead of comparing with it')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory of the stages')
+    parser.add_argument('--no-checks', action='store_true', help='skip the tokenizer conformance check and the cold start time')
+    options = parser.parse_args(arguments)
+    options.stages = [stageName for stageName in options.stages.split(',') if stageName]
+    for stageName in options.stages:
+        if stageName not in STAGENAMES:
+            parser.error('unknown stage {}'.format(stageName))
+    if options.repeat < 1:
+        parser.error('--repeat has to be at least 1')
+    return options
+
+
+def Main(arguments = None):
+    options = ParseArguments(arguments)
+    # Every stage depends on those before it, so they are all run in order, but only the selected ones are timed
+    lastStage = max(STAGENAMES.index(stageName) for stageName in options.stages) if options.stages else -1
+    workDir = tempfile.mkdtemp(prefix='whatsapp_benchmark_')
+    try:
+        inputFilePath = os.path.join(workDir, 'benchmark.txt')
+        (lineCount, byteCount) = SyntheticExportGenerator.GenerateExport(inputFilePath, options.members, options.messages, options.layout, options.seed)
+        settings = {'members': options.members, 'messages': options.messages, 'layout': options.layout, 'seed': options.seed}
+        print('Synthetic export: {} lines, {:.2f} MB'.format(lineCount, byteCount / 1e6))
+        results = {'version': BASELINEVERSION, 'settings': settings, 'machine': platform.platform(), 'python': platform.python_version(), 'stages': {}}
+
+        run = BenchmarkRun(workDir, inputFilePath)
+        # The tokenizer and matplotlib are loaded once, before anything is timed
+        InputParsingScript.IndivStats('benchmark').LoadTokenizer()
+        import matplotlib.figure, matplotlib.backends.backend_agg
+        for stageName in STAGENAMES[:lastStage + 1]:
+            if stageName not in options.stages:
+                with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull:
+                    run.RunStage(stageName)
+                devnull.close()
+                continue
+            print('Running stage: {}'.format(stageName))
+            result = {'seconds': TimeStage(run, stageName, options.repeat)}
+            result['linesPerSecond'] = lineCount / result['seconds']
+            result['megabytesPerSecond'] = byteCount / 1e6 / result['seconds']
+            if not options.no_memory:
+                result['peakMB'] = PeakMemoryOfStage(run, stageName)
+            results['stages'][stageName] = result
+
+        failed = False
+        if not options.no_checks:
+            print('Running stage: coldstart')
+            results['stages']['coldstart'] = {'seconds': min(ColdStartTime(inputFilePath) for _ in range(options.repeat))}
+            mismatches = TokenizerMismatches(inputFilePath)
+            if mismatches:
+                failed = True
+                print('Tokenizer conformance FAILED on {} lines, for example {!r}'.format(len(mismatches), mismatches[0]))
+            else:
+                print('Tokenizer conformance passed: the fast and nltk tokenizer engines agree on all {} lines'.format(lineCount))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    # Without a baseline, the results of this run become the baseline of the machine
+    if not options.save_baseline and not os.path.exists(options.baseline):
+        print('\nThere is no baseline at {}, so the results of this run are saved as the baseline'.format(options.baseline))
+        options.save_baseline = True
+    if options.save_baseline:
+        with open(options.baseline, mode='w', encoding='utf8') as fout:
+            json.dump(results, fout, indent=2)
+            fout.write('\n')
+        PrintResults(results, None)
+        print('\nBaseline saved to {}'.format(options.baseline))
+        return 1 if failed else 0
+
+    baseline = None
+    if os.path.exists(options.baseline):
+        with open(options.baseline, mode='r', encoding='utf8') as fin:
+            baseline = json.load(fin)
+        if baseline.get('version') != BASELINEVERSION or baseline.get('settings') != settings:
+            print('\nThe baseline {} was made with other settings, so it is not compared'.format(options.baseline))
+            baseline = None
+        elif baseline.get('machine') != results['machine'] or baseline.get('python') != results['python']:
+            print('\nThe baseline {} was made on {} with Python {}, so it is not compared. Use --save-baseline to replace it'.format(
+                options.baseline, baseline.get('machine'), baseline.get('python')))
+            baseline = None
+    PrintResults(results, baseline)
+    if baseline is not None:
+        regressions = FindRegressions(results, baseline, options.threshold)
+        if regressions:
+            failed = True
+            print('\nRegressions of more than {:.0%}:'.format(options.threshold))
+            for regression in regressions:
+                print(regression)
+        else:
+            print('\nNo stage regressed by more than {:.0%}'.format(options.threshold))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
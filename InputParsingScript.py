@@ -1,15 +1,35 @@
 import os
-from collections import Counter
-import nltk
-nltk.download('punkt')
-from nltk.corpus import stopwords
-from nltk.tokenize import TweetTokenizer
+import sys
+import argparse
+import traceback
+import concurrent.futures
+import array
+import hashlib
+import mmap
+import pickle
+import heapq
+import functools
+import json
+import threading
+import socketserver
+import http.server
+import urllib.parse
+import stat
+import signal
+import tempfile
+import sqlite3
+import unicodedata
+import zipfile
+import shutil
+import io
+from collections import Counter, OrderedDict
 import string
+import re
+import time
 import datetime
-import dateutil.parser
 import operator
 import numpy as np
-import matplotlib.pyplot as plt
+# NLTK, dateutil and matplotlib take most of the start up time, so they are only imported when they are first needed. See LoadTokenizer, DateutilParse and FrequencyPlotRenderer
 
 
 # -------------------------------
@@ -36,6 +56,27 @@ frequencyPlotFolderName = 'frequency_plot'
 # file names: file names are given with extensions
 globalAnalysisOutputFileName = 'Overall Chat Statistics.txt'
 globalBarGraphFileName = 'bar_graph_day_of_year.png'
+# Heatmap of the replies between the people of a chat, see InteractionMatrix
+interactionHeatmapFileName = 'interaction_heatmap.png'
+# Message store: cache of the parsed chat, see MessageStore
+messageStoreFileName = 'message_store.npz'
+# Checkpoint: parser state and statistics of the chat at the end of its last complete line, see GlobalStats.SaveCheckpoint
+checkpointFileName = 'checkpoint.pickle'
+# Run report: time, memory and work of every stage of the analysis of the chat, see RunReport
+runReportFileName = 'run_report.json'
+# Profile of the stage given by profileStage, written next to the run report. The .txt file lists the functions that took the most time
+profileFileName = 'profile_{}.prof'
+profileSummaryFileName = 'profile_{}.txt'
+# Full-text search index of all analysed chats, stored in the output folder
+searchIndexFileName = 'search_index.sqlite'
+# Export merged from several exports of the same chat, stored in the output folder of the chat
+mergedExportFileName = 'merged_export.txt'
+# Chat text read from a zipped export, stored in the output folder of the chat and named after the zip file
+zipExportTextFileName = '{}.txt'
+# Result store holding the output files of all chats when outputBackend is 'sqlite'
+resultStoreFileName = 'results.sqlite'
+# English stop words shipped with the script, used when the NLTK stopwords corpus is not installed
+bundledStopWordsFilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'english_stop_words.txt')
 
 # -------------------------------
 # Script parameters
@@ -43,6 +84,91 @@ globalBarGraphFileName = 'bar_graph_day_of_year.png'
 
 floatDigitsAfterDecimal = 2
 
+# Timestamp parser engine. 'fast' detects the date layout of a chat once and then parses every line with a precompiled regex,
+# only falling back to dateutil for lines the regex rejects. 'dateutil' parses every line with dateutil like before
+timestampParserEngine = 'fast'
+# Number of lines read from the start of a chat to detect which date layout it uses
+timestampLayoutSampleLines = 200
+
+# Tokenizer engine. 'fast' splits most lines with a precompiled regex and remembers what happened to every distinct word, only
+# using the TweetTokenizer for lines the regex cannot handle exactly. 'nltk' tokenizes every line with the TweetTokenizer and nltk.word_tokenize
+tokenizerEngine = 'fast'
+
+# Pipeline mode. 'memory' streams every parsed message straight into the statistics of its sender in a single pass over the chat.
+# 'files' first writes the split_msg and timestamps files, and then reads them back to analyse each contact
+pipelineMode = 'memory'
+# In memory mode, the split_msg, timestamps and without_stop_words files are only written if this is set. Useful for debugging
+writeIntermediateFiles = False
+# In memory mode, every parsed chat is saved as a message store in its output folder. If the input file has not changed
+# since then, the chat is loaded from the message store instead of being parsed again
+useMessageStoreCache = True
+# In memory mode, a checkpoint of the parser and of the statistics of every contact is saved after each chat is parsed.
+# If the next input file starts with exactly the same bytes, only the lines added after the checkpoint are parsed
+useIncrementalCheckpoint = True
+# Number of input files analysed at the same time, each in its own process. Set with --jobs
+jobs = 1
+# Number of worker processes that parse parts of one large input file at the same time, in memory mode. Set with --parser-jobs
+parserJobs = 1
+# Input files smaller than this many bytes are always parsed in one process, as starting the workers would take longer
+parallelParseMinimumBytes = 32 * 1024 * 1024
+# Number of contacts of a chat analysed at the same time, each in a worker process. Set with --contact-jobs
+contactJobs = 1
+# Maximum address space of a contact worker process in MB, 0 for no limit. Set with --contact-memory-limit. A contact whose analysis runs out of memory in a worker
+# is analysed again in the main process. Only supported on systems with the resource module
+contactWorkerMemoryLimitMB = 0
+# Word counting engine. 'exact' counts every distinct word of a contact and of the group chat. 'heavyhitters' only keeps the counts of the most used
+# words, using at most twice heavyHitterCapacity counters per contact and for the group, so the top words are found in bounded memory on huge chats.
+# Their counts are then estimates, and the output states how much higher than the true count they can be
+wordCountEngine = 'exact'
+# Number of words whose counts are kept by the heavyhitters engine. The error of every count is at most the number of words counted divided by this plus one
+heavyHitterCapacity = 10000
+# Numbers of words in the phrases whose top 5 are found for every contact and for the group, like (2, 3) for two and three word phrases. Empty for none.
+# Phrases are made of consecutive words of a line once the stop words are removed. Set with --ngrams
+ngramSizes = ()
+# Number of phrases of each size whose counts are kept per contact and for the group, see HeavyHitterCounter. The phrase counts are always estimates,
+# and never use more than twice this many counters, however long the chat is
+ngramCapacity = 2000
+# Frequency plots are only drawn if this is set. Turned off with --no-plots
+drawPlots = True
+# File format of the frequency plots, 'png' or 'svg'. SVG files are quicker to write, and plotDpi does not change them
+plotFormat = 'png'
+# Resolution of the PNG frequency plots in dots per inch. Lower values are quicker to draw
+plotDpi = 200
+# Number of worker processes that draw the frequency plots of a chat once its analysis is done. Set with --plot-jobs
+plotJobs = 1
+# Writes a run report (output/<chat>/run_report.json) with the wall and CPU time, bytes, lines and messages processed, peak memory and files written
+# by every stage of the analysis, for the chat and for each of its contacts. Set with --run-report
+writeRunReport = False
+# Name of a stage of INSTRUMENTEDSTAGES that is profiled with cProfile while the run report is made, or None. Set with --profile-stage
+profileStage = None
+# Most intermediate files kept open at once while a chat is parsed. Every sender has up to three intermediate files, and those that were used least recently
+# are closed and opened again for appending when needed, so chats with any number of senders stay within the open file limit of the system
+maximumOpenOutputFiles = 256
+# Lines of text held in memory for the intermediate files before all of them are written out
+outputBufferLines = 1 << 18
+# Number of worker processes that analyse the chats sent to the analysis service. Set with --service-jobs
+serviceJobs = 1
+# Most chats the analysis service takes at once, counting those being analysed. Further requests are turned away until one is done. Set with --service-queue
+serviceQueueSize = 16
+# Largest export in MB that can be uploaded to the analysis service
+serviceMaxUploadMB = 256
+# Adds every message of every analysed chat, with its chat, sender and timestamp, to a full-text search index (output/search_index.sqlite).
+# Chats whose input file has not changed since they were indexed are skipped. Set with --search-index
+buildSearchIndex = False
+# Input files whose names only differ by a copy number, like "WhatsApp Chat with Family.txt" and "WhatsApp Chat with Family (1).txt", are taken to be
+# exports of the same chat, for example by different members. They are merged into one export without the messages they have in common,
+# which is then analysed as a single chat. Set with --merge
+mergeExports = False
+# Where the individual analysis, overall statistics, frequency plots and run report of every chat go. 'folders' (default) writes them as files
+# in the output folder of the chat. 'sqlite' keeps all of them in one database (output/results.sqlite), written once per chat in one transaction,
+# from which the folders can be exported with --export-folders. Set with --output-backend
+outputBackend = 'folders'
+# Finds who replies to whom and how fast, and adds the number of replies between every two people and their reply times to the overall chat statistics,
+# with a heatmap of the replies (output/<chat>/interaction_heatmap.png). Set with --interactions
+analyseInteractions = False
+# A message is only counted as a reply to the message before it if that was sent at most this many minutes earlier. Set with --reply-window
+replyWindowMinutes = 24 * 60
+
 # -------------------------------
 # Predefined constants
 # -------------------------------
@@ -52,14 +178,138 @@ NULLDATETIME = datetime.datetime(1019,12,14,22,17)
 TIMESTAMPFORMAT = "%Y-%m-%d %H:%M"
 FORBIDDENFILECHARACTERS = '\\/?*"<>|'
 
+# Date layouts recognised by ValidateLineDate
+# DD/MM/YYYY, HH:MM - (comma at index 10)
+LAYOUTDAYFIRST = 'DD/MM/YYYY'
+# M/D/YY, H:MM am - (12 hour clock)
+LAYOUTAMPM = 'M/D/YY am/pm'
+# MM/DD/YY, HH:MM - (24 hour clock)
+LAYOUTMONTHFIRST = 'MM/DD/YY'
+# Precompiled timestamp patterns used by the fast parser engine, one for each date layout.
+# Only ASCII digits are accepted, anything unusual is left to the dateutil path
+TIMESTAMPREGEX = {
+    LAYOUTDAYFIRST: re.compile(r'([0-9]{2})/([0-9]{2})/([0-9]{4}), ([0-9]{2}):([0-9]{2}) - '),
+    LAYOUTAMPM: re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{2}), ([0-9]{1,2}):([0-9]{2}) ([ap])m -'),
+    LAYOUTMONTHFIRST: re.compile(r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{2}), ([0-9]{1,2}):([0-9]{2}) -'),
+}
+# Lines as they are split up in text mode, where \r\n, \r and \n all end a line and are translated to \n
+TEXTMODELINEREGEX = re.compile(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+# ValidateLineDate and FastValidateLineDate only look at the first 20 characters of a line, which always fit in 80 bytes of UTF-8
+LINEHEADCHARACTERS = 20
+LINEHEADBYTES = 80
+# dateutil places two digit years within 50 years of the current year. This table maps YY to the same full year
+CURRENTYEAR = time.localtime().tm_year
+TWODIGITYEARS = []
+for twoDigitYear in range(100):
+    fullYear = CURRENTYEAR // 100 * 100 + twoDigitYear
+    if fullYear >= CURRENTYEAR + 50:
+        fullYear -= 100
+    elif fullYear < CURRENTYEAR - 50:
+        fullYear += 100
+    TWODIGITYEARS.append(fullYear)
+TWODIGITYEARS = tuple(TWODIGITYEARS)
+
+# Script parameters that are handed to worker processes, so they analyse chats with the same settings as the main process
+SETTINGNAMES = ('floatDigitsAfterDecimal', 'timestampParserEngine', 'timestampLayoutSampleLines', 'tokenizerEngine', 'pipelineMode', 'writeIntermediateFiles',
+                'useMessageStoreCache', 'useIncrementalCheckpoint', 'parserJobs', 'parallelParseMinimumBytes', 'contactJobs', 'contactWorkerMemoryLimitMB', 'wordCountEngine', 'heavyHitterCapacity',
+                'ngramSizes', 'ngramCapacity',
+                'drawPlots', 'plotFormat', 'plotDpi', 'plotJobs', 'writeRunReport', 'profileStage', 'maximumOpenOutputFiles', 'outputBufferLines', 'buildSearchIndex',
+                'mergeExports', 'outputBackend', 'analyseInteractions', 'replyWindowMinutes', 'inputDir', 'outputDir')
+
+# The TweetTokenizer never makes a token that spans whitespace, except for ellipsis dots like ". .", phone numbers like "555 1234"
+# and emoji joined by a zero width joiner. Lines where that could happen, or where an HTML entity could turn into whitespace,
+# are tokenized as a whole by the fast tokenizer engine. \x1c to \x1f are whitespace for str.split but not for the TweetTokenizer
+WHOLELINETOKENIZATIONREGEX = re.compile(r'&|[\x1c-\x1f\u200d]|\.\s+\.|[0-9][*\-.)]* [ *\-.)]*\(?[0-9]')
+# Maximum number of distinct pieces of lines remembered by the fast tokenizer engine
+PIECEDECISIONCACHESIZE = 1 << 20
+# Lines buffered for one intermediate file before they are written to it
+OUTPUTFILEBUFFERLINES = 1024
+
+# Sender name used for the lines at the start of a part of the input file that are parsed before any timestamp is found.
+# They belong to whoever sent the last message of the part before it. A name can never contain a line break, so it cannot clash with a real sender
+CHUNKHEADSENDER = '\n'
+
+# Message store: flags of a stored message
+# Set if the message is counted as a valid message, meaning it was not a media, deleted or invite message
+STOREMESSAGECOUNTED = 1
+# Set if nothing was written after the sender name, so the stored text only has the continuation lines of the message
+STOREMESSAGEEMPTY = 2
+# Version of the message store format. Stores saved with another version are parsed again
+STOREVERSION = 2
+# Version of the checkpoint format. Checkpoints saved with another version are ignored
+CHECKPOINTVERSION = 3
+# Stages of the analysis recorded in the run report. The contact stages run once per contact, the others once per chat.
+# IndividualCalculations includes the three stages a contact goes through in files mode
+CHATSTAGES = ('SplitMessageNametagTimestamp', 'ParallelSplitMessageNametagTimestamp', 'UpdateSearchIndex', 'CountMedia', 'AnalyseInteractions', 'WriteOverallGroupChatOutput')
+CONTACTSTAGES = ('IndividualCalculations', 'RemoveStopWords', 'FindWordCountFromFile', 'FrequencyPlotFromFile')
+INSTRUMENTEDSTAGES = CHATSTAGES + CONTACTSTAGES
+RUNREPORTVERSION = 1
+# Version of the search index schema. Indexes made with another version are built again
+SEARCHINDEXVERSION = 1
+# Seconds a process waits for another one to finish writing to the search index or the result store, like when several chats are analysed with --jobs
+SQLITEBUSYSECONDS = 600
+# Version of the result store schema. Result stores made with another version are emptied
+RESULTSTOREVERSION = 1
+# Copy number at the end of the name of an input file, without its extension, that is left out of the chat name when exports are merged
+EXPORTCOPYNUMBERREGEX = re.compile(r'\s*\(\d+\)$')
+# Timestamps of merged exports are written in the DD/MM/YYYY layout, whatever the layouts of the exports were
+MERGEDEXPORTTIMESTAMPFORMAT = '%d/%m/%Y, %H:%M - '
+# Invisible characters WhatsApp writes into some messages, which are left out when messages of different exports are compared
+INVISIBLEMESSAGECHARACTERS = dict.fromkeys(map(ord, '\u200e\u200f\ufeff'))
+# Name of the chat text in zipped exports. Zip files without it are read from their largest .txt file
+ZIPCHATMEMBERNAME = '_chat.txt'
+# First line of a message with an attached file, in exports with media: "<attached: NAME>" on iOS, and "NAME (file attached)" on Android, where the words in
+# brackets depend on the language of the phone
+MEDIAATTACHMENTREGEX = re.compile(r'[\u200e\u200f]*(?:<attached: ([^>]+)>|(.+?\.\w{1,5}) \()')
+MEDIAOMITTEDMESSAGE = '<Media omitted>'
+# Percentiles of the reply times written to the overall chat statistics
+REPLYTIMEPERCENTILES = (50, 90)
+# Most people shown in the interaction heatmap. In larger chats, those who sent and got the most replies are shown
+INTERACTIONHEATMAPSENDERS = 30
+
+EPOCHDATETIME = datetime.datetime(1970, 1, 1)
+ONEMINUTE = datetime.timedelta(minutes=1)
+# Day of a leap year before the first day of each month, used to find the day of year of a timestamp
+LEAPYEARMONTHSTARTS = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335])
+# Names of the weekdays of ActivityCube.Histogram('weekday'), which starts on Monday
+WEEKDAYNAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
 # -------------------------------
-# Pre-processing
+# Lazily imported modules
 # -------------------------------
 
-if not (os.path.exists(inputDir)):
-    os.makedirs(inputDir)
-if not (os.path.exists(outputDir)):
-    os.makedirs(outputDir)
+# Parses a timestamp with dateutil, which is imported the first time a timestamp has to be parsed with it
+def DateutilParse(timestr, **kwargs):
+    import dateutil.parser
+    return dateutil.parser.parse(timestr, **kwargs)
+
+
+# -------------------------------
+# Instrumentation
+# -------------------------------
+
+# Makes a method a stage of the run report, see RunReport. While no report is being made the method is called straight away,
+# so the stages cost nothing more than an attribute lookup when writeRunReport is off
+def InstrumentedStage(method):
+    stageName = method.__name__
+    @functools.wraps(method)
+    def RunInstrumentedStage(self, *args, **kwargs):
+        if runReport.records is None:
+            return method(self, *args, **kwargs)
+        return runReport.RunStage(stageName, self, method, args, kwargs)
+    return RunInstrumentedStage
+
+
+# Returns the most memory this process has held so far in MB, or None on systems without the resource module
+def PeakMemoryMB():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives the peak in kilobytes, macOS in bytes
+    return round(peakMemory / (1024 * 1024 if sys.platform == 'darwin' else 1024), floatDigitsAfterDecimal)
+
 
 # ===============================
 # Class definitions
@@ -67,6 +317,9 @@ if not (os.path.exists(outputDir)):
 
 # Class contains common methods used by both the below classes. Functions such as ValidatePath and ValidateIO are shared as both classes have need of file validation
 class CommonValidationMethods:
+    # No instance attributes, so the __slots__ of the classes below are not undone by a __dict__
+    __slots__ = ()
+
     # Check if a directory exists, if not, create it
     def ValidatePath(self, path):
         if not (os.path.exists(path)):
@@ -95,6 +348,16 @@ class CommonValidationMethods:
         self.ValidatePath(os.path.split(outputFilePath)[0])
         return True
 
+    # Variation of ValidateIO for an output file with results, which has no folder when it is kept in the result store
+    def ValidateResultIO(self, inputFilePath, outputFilePath):
+        if not resultStore.Captures():
+            return self.ValidateIO(inputFilePath, outputFilePath)
+        (inputFileDirectory, inputFileName) = os.path.split(inputFilePath)
+        if inputFileDirectory and not os.path.exists(inputFileDirectory):
+            print('Path {} is empty. Analysis aborted'.format(inputFileDirectory))
+            return False
+        return True
+
     # Variation of ValidateIO used if output folder instead of output file is specified
     def ValidateIOf(self,inputFilePath, outputFolderPath):
         (inputFileHead, inputFileName) = os.path.split(inputFilePath)
@@ -110,6 +373,12 @@ class CommonValidationMethods:
 # Class used for maintaining overall statistics of a group chat. IndivStat objects are created through this class which handle individual stat data
 # GlobalStats inherits all the methods from CommonValidationMethods class.
 class GlobalStats(CommonValidationMethods):
+    __slots__ = ('name', 'contacts', 'chatAge', 'inputFilePath', 'outputFolderPath', 'splitMessageOutputFolderPath', 'timestampOutputFolderPath',
+                 'withoutStopWordsOutputFolderPath', 'individualAnalysisOutputFolderPath', 'globalAnalysisOutputFilePath', 'frequencyPlotOutputFolderPath',
+                 'globalFrequencyPlotOutputFilePath', 'messageStoreFilePath', 'checkpointFilePath', 'checkpointState', 'parserState', 'messageStore',
+                 'activityCube', 'timestampLayout', 'topWords', 'topWordsError', 'topPhrases', 'mergeTotals',
+                 'mediaFiles', 'mediaStatistics', 'interactions', 'interactionHeatmapOutputFilePath')
+
     def __init__(self, name):
         self.name = name
         self.contacts = {}
@@ -123,55 +392,574 @@ class GlobalStats(CommonValidationMethods):
         self.globalAnalysisOutputFilePath = 'null'
         self.frequencyPlotOutputFolderPath = 'null'
         self.globalFrequencyPlotOutputFilePath = ' null'
+        self.messageStoreFilePath = 'null'
+        self.checkpointFilePath = 'null'
+        # Byte offset and pickled state taken by SplitMessageNametagTimestamp for the next checkpoint
+        self.checkpointState = None
+        # State of the parser at the end of the last SplitMessageNametagTimestamp
+        self.parserState = None
+        # MessageStore of the chat, filled by the parser in both pipeline modes
+        self.messageStore = None
+        # ActivityCube of the chat, built once the chat has been parsed
+        self.activityCube = None
+        # Date layout detected by DetectTimestampLayout, used by the fast timestamp parser engine
+        self.timestampLayout = None
+        # Top 5 words of the chat and how much too high their counts can be, and the top 5 phrases of each of the ngramSizes, found by WriteOverallGroupChatOutput
+        self.topWords = []
+        self.topWordsError = 0
+        self.topPhrases = {}
+        # Totals of the ExportMerger that made the input file, if it was merged from several exports
+        self.mergeTotals = None
+        # Sizes of the media files of a zipped export by file name, and the media sent by every contact found by CountMedia. None for plain text exports
+        self.mediaFiles = None
+        self.mediaStatistics = None
+        # InteractionMatrix of the chat found by AnalyseInteractions, None unless analyseInteractions is set
+        self.interactions = None
+        self.interactionHeatmapOutputFilePath = 'null'
 
     def SetFilePaths(self, inputFilePath):
         self.inputFilePath = inputFilePath
         self.outputFolderPath = outputDir +'/{}'.format(self.name)
         # Definition of local file directories, these are unique for a particular group chat
         self.splitMessageOutputFolderPath = outputDir + '/{}/{}'.format(self.name, splitMsgFolderName)
-        self.ValidatePath(self.splitMessageOutputFolderPath)
-
         self.timestampOutputFolderPath = outputDir + '/{}/{}'.format(self.name, timestampFolderName)
-        self.ValidatePath(self.timestampOutputFolderPath)
-
         self.withoutStopWordsOutputFolderPath = outputDir + '/{}/{}'.format(self.name, withoutStopWordsFolderName)
-        self.ValidatePath(self.withoutStopWordsOutputFolderPath)
+        # The intermediate folders are only needed if the intermediate files are written
+        if self.WritesIntermediateFiles():
+            self.ValidatePath(self.splitMessageOutputFolderPath)
+            self.ValidatePath(self.timestampOutputFolderPath)
+            self.ValidatePath(self.withoutStopWordsOutputFolderPath)
 
         self.individualAnalysisOutputFolderPath = outputDir + '/{}/{}'.format(self.name, analysisFolderName)
-        self.ValidatePath(self.individualAnalysisOutputFolderPath)
+        # Results kept in the result store have no folders
+        if not resultStore.Captures():
+            self.ValidatePath(self.individualAnalysisOutputFolderPath)
 
         self.globalAnalysisOutputFilePath = outputDir + '/{}/{}'.format(self.name, globalAnalysisOutputFileName)
 
         self.frequencyPlotOutputFolderPath = outputDir + '/{}/{}'.format(self.name, frequencyPlotFolderName)
-        self.ValidatePath(self.frequencyPlotOutputFolderPath)
+        if not resultStore.Captures():
+            self.ValidatePath(self.frequencyPlotOutputFolderPath)
+
+        # The extension of the plot follows plotFormat
+        self.globalFrequencyPlotOutputFilePath = outputDir + '/{}/{}.{}'.format(self.name, os.path.splitext(globalBarGraphFileName)[0], plotFormat)
+        self.interactionHeatmapOutputFilePath = outputDir + '/{}/{}.{}'.format(self.name, os.path.splitext(interactionHeatmapFileName)[0], plotFormat)
 
-        self.globalFrequencyPlotOutputFilePath = outputDir + '/{}/{}'.format(self.name, globalBarGraphFileName)
+        self.messageStoreFilePath = outputDir + '/{}/{}'.format(self.name, messageStoreFileName)
+        self.checkpointFilePath = outputDir + '/{}/{}'.format(self.name, checkpointFileName)
         
+    # Analyses the chat, and writes its run report if one is wanted. With the sqlite output backend, all results of the chat are then saved to the result store at once
     def Calculations(self):
+        resultStore.StartChat()
+        if not writeRunReport:
+            self.AnalyseChat()
+        else:
+            runReport.Start()
+            startWallTime = time.perf_counter()
+            startCpuTime = time.process_time()
+            try:
+                self.AnalyseChat()
+            finally:
+                (records, profile) = runReport.Finish()
+            self.WriteRunReport(records, profile, time.perf_counter() - startWallTime, time.process_time() - startCpuTime)
+        resultStore.SaveChat(self.name, self.Statistics())
+
+    def AnalyseChat(self):
         # Processing Steps
         # The Contacts is a dictionary of all IndivStats mapped to their name
-        # Split Messages folder and Timestamp folder are created by this operation
-        self.contacts, self.chatAge = self.SplitMessageNametagTimestamp()
+        # In files mode, Split Messages folder and Timestamp folder are created by this operation.
+        # In memory mode, the statistics of each contact are also calculated by this operation
+        self.contacts, self.chatAge = self.ParseOrLoadChat()
+        if buildSearchIndex:
+            self.UpdateSearchIndex()
+        if self.mediaFiles is not None:
+            self.CountMedia()
+        if analyseInteractions:
+            self.AnalyseInteractions()
 
         # chatAge has to be greater than or equal to 1
         if self.chatAge < 1:
             self.chatAge = 1
 
+        # With several plot jobs, the plots of the contacts and of the group are queued and drawn together once the analysis is done.
+        # Contacts analysed in worker processes draw their own plots
+        # A contact stage that is profiled has to run in this process, so the contacts are then analysed one after the other
+        contactWorkers = contactJobs
+        if contactJobs > 1 and writeRunReport and profileStage in CONTACTSTAGES:
+            print('Profiling {}: the contacts are analysed in this process'.format(profileStage))
+            contactWorkers = 1
+        batchPlots = plotJobs > 1 and contactWorkers == 1
+        if batchPlots:
+            frequencyPlotRenderer.StartBatch()
+
         # Analysis Steps
         # loops through each individual contact name in the group
         for contactName in self.contacts:
             
             # Setting the output file paths, so the object can access its respective output files easily
-            splitMessageOutputFilePath = '{}/{}.txt'.format(self.splitMessageOutputFolderPath, contactName)
-            timestampOutputFilePath = '{}/{}.txt'.format(self.timestampOutputFolderPath, contactName)
-            withoutStopWordsOutputFilePath = '{}/{}.txt'.format(self.withoutStopWordsOutputFolderPath, contactName)
-            individualAnalysisOutputFilePath = '{}/{}.txt'.format(self.individualAnalysisOutputFolderPath, contactName)
-            frequencyPlotOutputFilePath = '{}/{}.png'.format(self.frequencyPlotOutputFolderPath, contactName)
-            self.contacts[contactName].SetFilePaths(splitMessageOutputFilePath, timestampOutputFilePath, withoutStopWordsOutputFilePath, individualAnalysisOutputFilePath, frequencyPlotOutputFilePath)
+            self.contacts[contactName].SetFilePaths(*self.ContactFilePaths(contactName))
 
             # Calculations performed on the object, its Individual Analysis is performed and all relevant files are created
-            self.contacts[contactName].IndividualCalculations()
+            if contactWorkers == 1:
+                self.contacts[contactName].IndividualCalculations()
+        if contactWorkers > 1:
+            self.ParallelIndividualCalculations()
+
+        # The group counts of messages over time are taken from the activity cube
+        if self.activityCube is None:
+            self.activityCube = self.BuildActivityCube()
         self.WriteOverallGroupChatOutput()
+        if batchPlots:
+            frequencyPlotRenderer.FinishBatch()
+
+    # Performs the Individual Analysis of every contact in worker processes. Every contact writes its own output files,
+    # so only the statistics needed by WriteOverallGroupChatOutput are sent back and stored in the contact objects
+    def ParallelIndividualCalculations(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=contactJobs, initializer=InitialiseContactWorker, initargs=(CurrentSettings(),)) as executor:
+            futures = {contactName: executor.submit(AnalyseContact, contact) for contactName, contact in self.contacts.items()}
+            for contactName, future in futures.items():
+                try:
+                    (results, records, resultFiles) = future.result()
+                    self.contacts[contactName].SetResults(*results)
+                    runReport.AddRecords(records)
+                    resultStore.AddResults(resultFiles)
+                # Running out of memory in a worker does not always raise a MemoryError, for example when a library fails to load.
+                # So the contact is analysed again in this process after any failure. Errors that are not caused by the worker show up again here
+                except Exception as error:
+                    print('Analysis of contact {} failed in a worker process ({!r}). Analysing it again'.format(contactName, error))
+                    self.contacts[contactName].IndividualCalculations()
+
+    # Builds the ActivityCube of the parsed chat from its message store
+    def BuildActivityCube(self):
+        return ActivityCube().BuildFromMessageStore(self.messageStore)
+
+    # Returns the output file paths of a contact in this group chat, in the order IndivStats.SetFilePaths takes them
+    def ContactFilePaths(self, contactName):
+        splitMessageOutputFilePath = '{}/{}.txt'.format(self.splitMessageOutputFolderPath, contactName)
+        timestampOutputFilePath = '{}/{}.txt'.format(self.timestampOutputFolderPath, contactName)
+        withoutStopWordsOutputFilePath = '{}/{}.txt'.format(self.withoutStopWordsOutputFolderPath, contactName)
+        individualAnalysisOutputFilePath = '{}/{}.txt'.format(self.individualAnalysisOutputFolderPath, contactName)
+        frequencyPlotOutputFilePath = '{}/{}.{}'.format(self.frequencyPlotOutputFolderPath, contactName, plotFormat)
+        return (splitMessageOutputFilePath, timestampOutputFilePath, withoutStopWordsOutputFilePath, individualAnalysisOutputFilePath, frequencyPlotOutputFilePath)
+
+    # Files mode always needs the split_msg and timestamps files. Memory mode only writes them when asked to
+    def WritesIntermediateFiles(self):
+        return pipelineMode == 'files' or writeIntermediateFiles
+
+    # The message store cache and checkpoints are used in memory mode. Intermediate files can only be written while the whole chat is parsed,
+    # so both are skipped if they are wanted
+    def UsesMessageStoreCache(self):
+        return useMessageStoreCache and pipelineMode == 'memory' and not writeIntermediateFiles
+
+    def UsesIncrementalCheckpoint(self):
+        return useIncrementalCheckpoint and pipelineMode == 'memory' and not writeIntermediateFiles
+
+    # Finds the contacts and the number of days of the chat, doing as little work as the saved message store and checkpoint allow:
+    # a message store of exactly the same input file means the chat is not parsed at all, a valid checkpoint means only the lines added
+    # since then are parsed, and otherwise the whole chat is parsed. Nothing is saved again when the input file has not changed
+    def ParseOrLoadChat(self):
+        if not (self.UsesMessageStoreCache() or self.UsesIncrementalCheckpoint()):
+            return self.ParseChat()
+
+        # The hash of the whole file and of the part covered by the checkpoint are found in one pass
+        checkpoint = self.LoadCheckpoint() if self.UsesIncrementalCheckpoint() else None
+        (prefixHash, inputHash) = self.InputFileHash(checkpoint['byteOffset'] if checkpoint is not None else 0)
+        if checkpoint is not None and checkpoint['prefixHash'] != prefixHash:
+            print('Input file {} does not start like it did at its checkpoint. The whole chat will be parsed again'.format(self.inputFilePath))
+            checkpoint = None
+
+        store = MessageStore().Load(self.messageStoreFilePath) if self.UsesMessageStoreCache() else None
+        if store is not None and store.inputHash == inputHash:
+            # A checkpoint taken at the end of the same file already has the statistics of every contact
+            return self.LoadMessageStore(store, checkpoint if checkpoint is not None and checkpoint['prefixHash'] == inputHash else None)
+
+        # The checkpoint is only used when the file grew after it
+        (contacts, noOfDaysOfChat) = self.ParseChat(checkpoint)
+
+        if self.UsesMessageStoreCache():
+            self.messageStore.inputHash = inputHash
+            self.messageStore.Save(self.messageStoreFilePath)
+        # A checkpoint at the same byte offset as the one loaded would be the same checkpoint
+        if self.UsesIncrementalCheckpoint() and (checkpoint is None or self.checkpointState[0] != checkpoint['byteOffset']):
+            self.SaveCheckpoint(inputHash)
+        return contacts, noOfDaysOfChat
+
+    # Parses the chat from the start, or from the checkpoint if one is given. Large input files are split up between worker processes in memory mode,
+    # unless SplitMessageNametagTimestamp is profiled, which has to parse the whole file in this process
+    def ParseChat(self, checkpoint = None):
+        startOffset = checkpoint['byteOffset'] if checkpoint is not None else 0
+        if (parserJobs > 1 and pipelineMode == 'memory' and not writeIntermediateFiles and not (writeRunReport and profileStage == 'SplitMessageNametagTimestamp')
+                and os.path.getsize(self.inputFilePath) - startOffset >= parallelParseMinimumBytes):
+            return self.ParallelSplitMessageNametagTimestamp(checkpoint)
+        return self.SplitMessageNametagTimestamp(checkpoint)
+
+    # Parses the chat like SplitMessageNametagTimestamp does, but splits the input file into parts that end on a line break, and parses the parts in worker processes.
+    # Each part is parsed without knowing who sent the message it starts in, so the lines before its first timestamp are counted under CHUNKHEADSENDER.
+    # The parts are then merged in order: those lines go to the sender of the last message of the part before, if it was still open, and the chat totals
+    # and timestamps of the parts are combined. Contacts, word counts and the message store come out exactly the same as when parsing in one process
+    @InstrumentedStage
+    def ParallelSplitMessageNametagTimestamp(self, checkpoint = None):
+        if not self.ValidateIOf(self.inputFilePath, self.outputFolderPath):
+            return
+        if timestampParserEngine == 'fast' and self.timestampLayout is None:
+            self.timestampLayout = self.DetectTimestampLayout()
+
+        if checkpoint is not None:
+            (contacts, store, parserState) = self.RestoreCheckpoint(checkpoint)
+            startOffset = checkpoint['byteOffset']
+            print('Resuming from checkpoint at byte {}'.format(startOffset))
+        else:
+            (contacts, store, parserState) = ({}, MessageStore(), (0, 0, 0, False, 'null', False, NULLDATETIME, NULLDATETIME))
+            startOffset = 0
+        (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName, startTimeStampHasBeenFound, startTimeStamp, endTimeStamp) = parserState
+        (linesBefore, messagesBefore) = (totalMsg, validMsg)
+
+        # The workers parse up to the last line break. An unfinished last line is parsed afterwards, so a checkpoint can still be taken before it
+        endOffset = self.LastLineBoundary()
+        chunkOffsets = self.ChunkOffsets(startOffset, endOffset, parserJobs)
+        print('Processing: {} in {} parts'.format(self.inputFilePath, len(chunkOffsets) - 1))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=parserJobs, initializer=ApplySettings, initargs=(CurrentSettings(),)) as executor:
+            futures = [executor.submit(ParseInputFileChunk, self.name, self.inputFilePath, self.timestampLayout, chunkStart, chunkEnd)
+                       for (chunkStart, chunkEnd) in zip(chunkOffsets[:-1], chunkOffsets[1:])]
+            chunkResults = [future.result() for future in futures]
+
+        for (contactStates, storeState, chunkParserState) in chunkResults:
+            (chunkTotalMsg, chunkValidDates, chunkValidMsg, chunkIsContinuation, chunkLastMsgSenderName,
+             chunkStartTimeStampHasBeenFound, chunkStartTimeStamp, chunkEndTimeStamp) = chunkParserState
+            chunkStore = MessageStore()
+            chunkStore.SetState(storeState)
+            # The first contact and the first stored message of every part are always CHUNKHEADSENDER.
+            # Its lines continue the last message before the part, if that message was still open
+            (headName, headWordCount, headTotalMessages, headAllWordCounts, headFreqDistTableYearly, headNgramCounts) = contactStates[0]
+            if isContinuation:
+                contacts[lastMsgSenderName].MergeStatistics(headWordCount, headTotalMessages, headAllWordCounts, headFreqDistTableYearly, headNgramCounts)
+                store.ExtendLastMessage(chunkStore.offsets[0] + chunkStore.lengths[0])
+            for (name, wordCount, totalMessages, allWordCounts, freqDistTableYearly, ngramCounts) in contactStates[1:]:
+                if name not in contacts:
+                    contacts[name] = IndivStats(name, 0, 0, 0)
+                    contacts[name].SetFilePaths(*self.ContactFilePaths(name))
+                    contacts[name].StartStreaming()
+                contacts[name].MergeStatistics(wordCount, totalMessages, allWordCounts, freqDistTableYearly, ngramCounts)
+            store.AppendStore(chunkStore, 1)
+
+            totalMsg += chunkTotalMsg
+            validDates += chunkValidDates
+            validMsg += chunkValidMsg
+            # Without a timestamp, the whole part continued the message before it, and the parser state carries on unchanged
+            if chunkValidDates > 0:
+                isContinuation = chunkIsContinuation
+                if chunkLastMsgSenderName != CHUNKHEADSENDER:
+                    lastMsgSenderName = chunkLastMsgSenderName
+            if not startTimeStampHasBeenFound and chunkStartTimeStampHasBeenFound:
+                startTimeStampHasBeenFound = True
+                startTimeStamp = chunkStartTimeStamp
+            if chunkTotalMsg > 0:
+                endTimeStamp = chunkEndTimeStamp
+        runReport.Count(bytesProcessed=endOffset - startOffset, linesProcessed=totalMsg - linesBefore, messagesProcessed=validMsg - messagesBefore)
+
+        # The rest of the file is parsed here, which also takes the checkpoint and prints the chat totals
+        parserState = (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName, startTimeStampHasBeenFound, startTimeStamp, endTimeStamp)
+        return self.SplitMessageNametagTimestamp(resumeState=(contacts, store, parserState, endOffset))
+
+    # Splits the bytes from startOffset to endOffset into at most the given number of parts of about the same size.
+    # Every part ends right after a line break. Returns the byte offsets where the parts start, followed by endOffset
+    def ChunkOffsets(self, startOffset, endOffset, parts):
+        chunkOffsets = [startOffset]
+        with open(self.inputFilePath, mode='rb') as f:
+            for part in range(1, parts):
+                f.seek(max(startOffset + (endOffset - startOffset) * part // parts, chunkOffsets[-1]))
+                f.readline()
+                if f.tell() >= endOffset:
+                    break
+                if f.tell() > chunkOffsets[-1]:
+                    chunkOffsets.append(f.tell())
+        chunkOffsets.append(endOffset)
+        return chunkOffsets
+
+    # Parses the lines between two byte offsets of the input file, for ParallelSplitMessageNametagTimestamp.
+    # Returns the statistics of every contact, the message store and the parser state at the end of the part, as plain Python objects
+    def ParseChunk(self, startOffset, endOffset):
+        head = IndivStats(CHUNKHEADSENDER, 0, 0, 0)
+        head.StartStreaming()
+        store = MessageStore()
+        store.AddMessage(CHUNKHEADSENDER, NULLDATETIME, startOffset, startOffset, 0)
+        parserState = (0, 0, 0, True, CHUNKHEADSENDER, False, NULLDATETIME, NULLDATETIME)
+        (contacts, noOfDaysOfChat) = self.SplitMessageNametagTimestamp(resumeState=({CHUNKHEADSENDER: head}, store, parserState, startOffset),
+                                                                       endOffset=endOffset, printProgress=False)
+        contactStates = [(name, contact.wordCount, contact.totalMessages, contact.allWordCounts, contact.freqDistTableYearly, contact.ngramCounts)
+                         for name, contact in contacts.items()]
+        return contactStates, self.messageStore.GetState(), self.parserState
+
+    # Returns a hash of the first prefixLength bytes of the input file, and a hash of the whole input file
+    def InputFileHash(self, prefixLength = 0):
+        inputHash = hashlib.blake2b(digest_size=20)
+        with open(self.inputFilePath, mode='rb') as f:
+            remainingPrefix = prefixLength
+            while remainingPrefix > 0:
+                block = f.read(min(remainingPrefix, 1 << 20))
+                if not block:
+                    break
+                inputHash.update(block)
+                remainingPrefix -= len(block)
+            prefixHash = inputHash.hexdigest()
+            block = f.read(1 << 20)
+            while block:
+                inputHash.update(block)
+                block = f.read(1 << 20)
+        return prefixHash, inputHash.hexdigest()
+
+    # Returns the byte offset right after the last \n in the input file. A checkpoint is only ever taken there,
+    # because the line after it may still grow and a \r before it may turn into \r\n once more messages are exported
+    def LastLineBoundary(self):
+        with open(self.inputFilePath, mode='rb') as f:
+            blockEnd = f.seek(0, os.SEEK_END)
+            while blockEnd > 0:
+                blockStart = max(0, blockEnd - (1 << 16))
+                f.seek(blockStart)
+                newlineIndex = f.read(blockEnd - blockStart).rfind(b'\n')
+                if newlineIndex != -1:
+                    return blockStart + newlineIndex + 1
+                blockEnd = blockStart
+        return 0
+
+    # Pickles everything SplitMessageNametagTimestamp needs to carry on parsing from byteOffset
+    def TakeCheckpoint(self, byteOffset, contacts, store, parserState):
+        contactStates = [(name, contact.wordCount, contact.totalMessages, contact.allWordCounts, contact.freqDistTableYearly, contact.ngramCounts)
+                         for name, contact in contacts.items()]
+        self.checkpointState = (byteOffset, pickle.dumps((contactStates, store.GetState(), parserState), protocol=pickle.HIGHEST_PROTOCOL))
+
+    # Restores the contacts, message store and parser state pickled by TakeCheckpoint
+    def RestoreCheckpoint(self, checkpoint):
+        (contactStates, storeState, parserState) = pickle.loads(checkpoint['state'])
+        contacts = {}
+        for (name, wordCount, totalMessages, allWordCounts, freqDistTableYearly, ngramCounts) in contactStates:
+            contacts[name] = IndivStats(name, 0, totalMessages, wordCount)
+            contacts[name].allWordCounts = allWordCounts
+            contacts[name].freqDistTableYearly = freqDistTableYearly
+            contacts[name].ngramCounts = ngramCounts
+            contacts[name].SetFilePaths(*self.ContactFilePaths(name))
+            contacts[name].StartStreaming()
+        store = MessageStore()
+        store.SetState(storeState)
+        return contacts, store, parserState
+
+    # Saves the checkpoint taken by the last SplitMessageNametagTimestamp, together with a hash of the input file up to it
+    def SaveCheckpoint(self, inputHash):
+        (byteOffset, state) = self.checkpointState
+        if byteOffset == os.path.getsize(self.inputFilePath):
+            prefixHash = inputHash
+        else:
+            (prefixHash, inputHash) = self.InputFileHash(byteOffset)
+        temporaryPath = self.checkpointFilePath + '.tmp'
+        with open(temporaryPath, mode='wb') as f:
+            pickle.dump({'version': CHECKPOINTVERSION, 'wordCountEngine': wordCountEngine, 'ngramSizes': ngramSizes, 'ngramCapacity': ngramCapacity,
+                         'byteOffset': byteOffset, 'prefixHash': prefixHash, 'state': state}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryPath, self.checkpointFilePath)
+
+    # Loads the checkpoint of the chat. Returns None if there is no usable checkpoint, or if the input file is now shorter than it
+    def LoadCheckpoint(self):
+        if not os.path.exists(self.checkpointFilePath):
+            return None
+        try:
+            with open(self.checkpointFilePath, mode='rb') as f:
+                checkpoint = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            print('Checkpoint {} could not be read. The whole chat will be parsed again'.format(self.checkpointFilePath))
+            return None
+        if not isinstance(checkpoint, dict) or checkpoint.get('version') != CHECKPOINTVERSION:
+            return None
+        # The word counts of the contacts are only of use to the engine that counted them
+        if checkpoint.get('wordCountEngine', 'exact') != wordCountEngine:
+            return None
+        if checkpoint.get('ngramSizes', ()) != ngramSizes or (ngramSizes and checkpoint.get('ngramCapacity') != ngramCapacity):
+            return None
+        if os.path.getsize(self.inputFilePath) < checkpoint['byteOffset']:
+            return None
+        return checkpoint
+
+    # Rebuilds the contacts of the chat from its message store instead of parsing the input file. If a checkpoint taken at the end of the same file is given,
+    # the statistics of the contacts are restored from it. Otherwise the text of every stored message is read back from the input file and passed to its sender,
+    # just like SplitMessageNametagTimestamp does in memory mode
+    def LoadMessageStore(self, store, checkpoint = None):
+        print('Loading parsed chat from {}'.format(self.messageStoreFilePath))
+        self.activityCube = ActivityCube().BuildFromMessageStore(store)
+        if checkpoint is not None:
+            contacts = self.RestoreCheckpoint(checkpoint)[0]
+        else:
+            contacts = self.ReadStoredMessages(store)
+        for name in contacts:
+            contacts[name].FinishStreaming()
+        print('Loading finished. {} lines parsed. {} valid timestamps discovered. {} valid messages found.'.format(
+            store.totalLines, store.validDates, store.validMessages))
+        self.messageStore = store
+        return contacts, (store.endTimeStamp - store.startTimeStamp).days + 1
+
+    # Counts the words of every message in the message store for its sender, reading the text back from the input file. Returns the contacts
+    def ReadStoredMessages(self, store):
+        contacts = {}
+        for name in store.senderNames:
+            contacts[name] = IndivStats(name, 0, 0, 0)
+            contacts[name].SetFilePaths(*self.ContactFilePaths(name))
+            contacts[name].StartStreaming()
+
+        with open(self.inputFilePath, mode='rb') as f:
+            # An empty file cannot be memory mapped, but then there are no messages to read either
+            inputBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if len(store) else b''
+            senderNames = store.senderNames
+            for (senderId, offset, length, flags) in zip(store.senders.tolist(), store.offsets.tolist(), store.lengths.tolist(), store.flags.tolist()):
+                contact = contacts[senderNames[senderId]]
+                lines = self.SplitTextModeLines(inputBytes[offset:offset + length].decode('utf8'))
+                message = '' if flags & STOREMESSAGEEMPTY else lines.pop(0)
+                # Like IndivStats.AddMessage, except that the frequencies of all messages are counted at once below
+                if flags & STOREMESSAGECOUNTED:
+                    contact.totalMessages += 1
+                    contact.AddMessageLine(message)
+                for line in lines:
+                    contact.AddMessageLine(line)
+            if len(store):
+                inputBytes.close()
+
+        # The frequencies of each contact are taken from the activity cube of the stored timestamps
+        for name in contacts:
+            contacts[name].freqDistTableYearly = self.activityCube.Histogram('dayofyear', name)[1]
+        return contacts
+
+    # Splits text read in binary mode into lines, with the line endings translated like in text mode
+    def SplitTextModeLines(self, text):
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = text.split('\n')
+        lastLine = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if lastLine:
+            lines.append(lastLine)
+        return lines
+
+    # Adds the messages of the parsed chat to the search index in the output folder, replacing those indexed from an older export of the chat.
+    # Nothing is done if the index already has the chat from the same input file
+    @InstrumentedStage
+    def UpdateSearchIndex(self):
+        store = self.messageStore
+        inputHash = store.inputHash if store.inputHash != 'null' else self.InputFileHash()[1]
+        searchIndex = SearchIndex('{}/{}'.format(outputDir, searchIndexFileName)).Open()
+        try:
+            indexedMessages = searchIndex.IndexChat(self.name, inputHash, self.SearchIndexMessages(store))
+        finally:
+            searchIndex.Close()
+        if indexedMessages is None:
+            print('Search index already has {}'.format(self.name))
+            return
+        runReport.Count(messagesProcessed=indexedMessages)
+        print('{} messages added to search index {}/{}'.format(indexedMessages, outputDir, searchIndexFileName))
+
+    # Yields the sender, timestamp and text of every message in the message store, with its continuation lines.
+    # The text is read back from the input file, with line endings translated like in text mode
+    def SearchIndexMessages(self, store):
+        if not len(store):
+            return
+        senderNames = store.senderNames
+        (lastMinutes, lastTimestamp) = (None, '')
+        with open(self.inputFilePath, mode='rb') as f:
+            inputBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for (senderId, minutes, offset, length) in zip(store.senders.tolist(), store.timestamps.tolist(), store.offsets.tolist(), store.lengths.tolist()):
+                    # Messages are often sent in the same minute, so the formatted timestamp is reused
+                    if minutes != lastMinutes:
+                        lastMinutes = minutes
+                        lastTimestamp = store.DateTime(minutes).strftime(TIMESTAMPFORMAT)
+                    text = ''.join(self.SplitTextModeLines(inputBytes[offset:offset + length].decode('utf8')))
+                    yield (senderNames[senderId], lastTimestamp, text[:-1] if text.endswith('\n') else text)
+            finally:
+                inputBytes.close()
+
+    # Counts the media files sent by every contact of a zipped export, and their size, from the names of the files attached to their messages
+    # and the sizes in the zip directory, so no media file is ever read. Media omitted messages are counted as well.
+    # Files in the zip that no message refers to are counted as unattributed. The chat is not parsed again: only the first line of every message
+    # in the message store is read back from the input file
+    @InstrumentedStage
+    def CountMedia(self):
+        senders = {name: {'files': 0, 'bytes': 0, 'omitted': 0} for name in self.contacts}
+        attributedFiles = set()
+        for (name, firstLine) in self.StoredFirstLines(self.messageStore):
+            if firstLine == MEDIAOMITTEDMESSAGE:
+                senders.setdefault(name, {'files': 0, 'bytes': 0, 'omitted': 0})['omitted'] += 1
+                continue
+            attachment = MEDIAATTACHMENTREGEX.match(firstLine)
+            if attachment is None:
+                continue
+            fileName = (attachment.group(1) or attachment.group(2)).translate(INVISIBLEMESSAGECHARACTERS).strip()
+            if fileName in self.mediaFiles and fileName not in attributedFiles:
+                attributedFiles.add(fileName)
+                media = senders.setdefault(name, {'files': 0, 'bytes': 0, 'omitted': 0})
+                media['files'] += 1
+                media['bytes'] += self.mediaFiles[fileName]
+        self.mediaStatistics = {'senders': senders, 'unattributedFiles': len(self.mediaFiles) - len(attributedFiles),
+                                'unattributedBytes': sum(size for fileName, size in self.mediaFiles.items() if fileName not in attributedFiles)}
+        runReport.Count(messagesProcessed=len(self.messageStore))
+
+    # Yields the sender name and the first line of the text of every message in the message store, without its line break.
+    # Only the first line of each message is read from the input file
+    def StoredFirstLines(self, store):
+        if not len(store):
+            return
+        senderNames = store.senderNames
+        with open(self.inputFilePath, mode='rb') as f:
+            inputBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for (senderId, offset, length, flags) in zip(store.senders.tolist(), store.offsets.tolist(), store.lengths.tolist(), store.flags.tolist()):
+                    # Nothing was written after the sender name, so the first line is empty
+                    if flags & STOREMESSAGEEMPTY:
+                        yield (senderNames[senderId], '')
+                        continue
+                    line = TEXTMODELINEREGEX.match(inputBytes, offset, offset + length)
+                    yield (senderNames[senderId], line.group().rstrip(b'\r\n').decode('utf8') if line else '')
+            finally:
+                inputBytes.close()
+
+    # Finds who replies to whom and how fast from the senders and timestamps of the messages in the message store, in the order they were sent
+    @InstrumentedStage
+    def AnalyseInteractions(self):
+        self.interactions = InteractionMatrix().BuildFromMessageStore(self.messageStore)
+        runReport.Count(messagesProcessed=len(self.messageStore))
+
+    # Yields the timestamp, sender name and text of every message of the input file in the order of the file. The text is what comes after the sender name,
+    # with the continuation lines of the message, just like SplitMessageNametagTimestamp reads it. A message with nothing after the sender name starts
+    # with an empty line instead, which leaves its statistics the same. Lines with a timestamp but no sender name, like members
+    # leaving, are yielded with None as the name and the whole line as the text. Lines before the first timestamp are skipped
+    def ParsedMessages(self):
+        if timestampParserEngine == 'fast' and self.timestampLayout is None:
+            self.timestampLayout = self.DetectTimestampLayout()
+        with open(self.inputFilePath, mode='rb') as f:
+            if not os.path.getsize(self.inputFilePath):
+                return
+            inputBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                senderNames = {}
+                previousLineHead = None
+                # Timestamp, name and lines of the message that is being read
+                message = None
+                isContinuation = False
+                for (lineOffset, lineEnd, lineBreakLength, lineHead) in self.ScanLines(inputBytes):
+                    if lineHead != previousLineHead:
+                        previousLineHead = lineHead
+                        (isDateValid, currentMsgDateTime, timestamplength) = self.ParseLineDate(lineHead)
+                    if isDateValid:
+                        if message is not None:
+                            yield (message[0], message[1], ''.join(message[2]))
+                        (isNameValid, name, text, messageOffset) = self.ScanLineName(inputBytes, lineOffset, lineEnd, lineBreakLength, lineHead, timestamplength,
+                                                                                     senderNames)
+                        if isNameValid:
+                            message = (currentMsgDateTime, name, [text or '\n'])
+                        else:
+                            message = (currentMsgDateTime, None, [self.LineText(inputBytes, lineOffset, lineEnd, lineBreakLength)])
+                        isContinuation = isNameValid
+                    elif isContinuation:
+                        message[2].append(self.LineText(inputBytes, lineOffset, lineEnd, lineBreakLength))
+                if message is not None:
+                    yield (message[0], message[1], ''.join(message[2]))
+            finally:
+                inputBytes.close()
 
     # ===============================
     # Utility functions
@@ -217,7 +1005,7 @@ class GlobalStats(CommonValidationMethods):
             if (flag == True):
                 try:
                     # parse function reads the timestamp in string form and converts it into a datetime data type
-                    rcrdDateTime = dateutil.parser.parse(linestr[0:17], dayfirst=True)
+                    rcrdDateTime = DateutilParse(linestr[0:17], dayfirst=True)
                     timestamplength = 20
                 # If the timestamp could not be parsed, the parser throws a ValueError exception
                 except ValueError:
@@ -233,7 +1021,7 @@ class GlobalStats(CommonValidationMethods):
             linestr = linestr[:hyphenIndex]
             try:
                 # parse function reads the timestamp in string form and converts it into a datetime data type
-                rcrdDateTime = dateutil.parser.parse(linestr, dayfirst=False)
+                rcrdDateTime = DateutilParse(linestr, dayfirst=False)
                 timestamplength = hyphenIndex + 2
             # If the timestamp could not be parsed, the parser throws a ValueError exception
             except ValueError:
@@ -278,7 +1066,7 @@ class GlobalStats(CommonValidationMethods):
             if (flag == True):
                 try:
                     # parse function reads the timestamp in string form and converts it into a datetime data type
-                    rcrdDateTime = dateutil.parser.parse(linestr, dayfirst=False)
+                    rcrdDateTime = DateutilParse(linestr, dayfirst=False)
                     timestamplength = 18
                     # Time stamp length reduces from 18 to 17 to 16 if date and month are single digit
                     if rcrdDateTime.day < 10:
@@ -291,21 +1079,106 @@ class GlobalStats(CommonValidationMethods):
             # Returns whether timestamp is valid along with timestamp
             return (flag, rcrdDateTime, timestamplength)
     
+    # Samples the start of the chat and returns the date layout written by most of its valid timestamps, or None if no timestamp was found.
+    # Every sampled line is checked by FastValidateLineDate in the layout it looks like, so dateutil is only imported for lines it cannot decide
+    def DetectTimestampLayout(self):
+        layoutCounts = Counter()
+        timestampLayout = self.timestampLayout
+        try:
+            with open(self.inputFilePath, mode='r', encoding='utf8') as f:
+                for lineNumber, line in enumerate(f):
+                    if lineNumber >= timestampLayoutSampleLines:
+                        break
+                    for layout in (LAYOUTDAYFIRST, LAYOUTAMPM, LAYOUTMONTHFIRST):
+                        if TIMESTAMPREGEX[layout].match(line):
+                            self.timestampLayout = layout
+                            result = self.FastValidateLineDate(line)
+                            if (result if result is not None else self.ValidateLineDate(line))[0]:
+                                layoutCounts[layout] += 1
+                            break
+        finally:
+            self.timestampLayout = timestampLayout
+        if not layoutCounts:
+            return None
+        return layoutCounts.most_common(1)[0][0]
+
+    # Fast version of ValidateLineDate for lines written in the detected date layout of the chat.
+    # The timestamp is matched by a precompiled regex and converted with integer arithmetic.
+    # Returns None whenever the line could not be decided here, in which case ValidateLineDate has to check it.
+    # Anything returned by this function is identical to what ValidateLineDate returns for the same line
+    def FastValidateLineDate(self, linestr):
+        layout = self.timestampLayout
+        if layout is None:
+            return None
+        match = TIMESTAMPREGEX[layout].match(linestr)
+        if match is None:
+            return None
+        if layout == LAYOUTDAYFIRST:
+            (day, month, year, hour, minute) = match.groups()
+            try:
+                rcrdDateTime = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute))
+            except ValueError:
+                return None
+            return (True, rcrdDateTime, 20)
+
+        # The other two layouts are two digit years, written month first
+        if layout == LAYOUTAMPM:
+            (month, day, year, hour, minute, meridiem) = match.groups()
+            hour = int(hour)
+            if hour < 1 or hour > 12:
+                return None
+            if hour == 12:
+                hour = 0
+            if meridiem == 'p':
+                hour += 12
+        else:
+            (month, day, year, hour, minute) = match.groups()
+            hour = int(hour)
+        try:
+            rcrdDateTime = datetime.datetime(TWODIGITYEARS[int(year)], int(month), int(day), hour, int(minute))
+        except ValueError:
+            return None
+
+        # ValidateLineDate tells these two layouts apart by where the 'm' of am/pm would be, and finds the timestamp length differently for each.
+        # Short timestamps and sender names starting with 'm' can end up in either check, so the same check is made here
+        hyphenIndex = match.end() - 1
+        if len(linestr) >= 18 and (linestr[16] == 'm' or linestr[17] == 'm'):
+            # The timestamp length is found from the hyphen
+            if hyphenIndex >= 20:
+                return None
+            return (True, rcrdDateTime, hyphenIndex + 2)
+        # The hyphen has to be found between index 14 and 16, and the timestamp length is found from the day and month
+        if len(linestr) < 16:
+            return (False, NULLDATETIME, 0)
+        if hyphenIndex < 14 or hyphenIndex > 16:
+            # A later hyphen in the sender name can still be picked up by ValidateLineDate, otherwise the line is rejected
+            if hyphenIndex < 14 and '-' in linestr[14:17]:
+                return None
+            return (False, NULLDATETIME, 0)
+        timestamplength = 18
+        if rcrdDateTime.day < 10:
+            timestamplength -= 1
+        if rcrdDateTime.month < 10:
+            timestamplength -= 1
+        return (True, rcrdDateTime, timestamplength)
+
+    # Validates the timestamp of a line using the selected parser engine
+    def ParseLineDate(self, linestr):
+        if timestampParserEngine == 'fast':
+            result = self.FastValidateLineDate(linestr)
+            if result is not None:
+                return result
+        return self.ValidateLineDate(linestr)
+
     # Check whether the message was sent by someone. Meaning it is of the format "person_name: Message".
     def ValidateLineName(self,linestr, timestamplength):
         # The characters that correspond to the timestamp are omitted
         linestr = linestr[timestamplength:]
-        name_length = 0
-        flag = False
-        # Searches for a semicolon to indicate where the message starts
-        while (name_length < len(linestr)):
-            if (linestr[name_length] == ':'):
-                flag = True
-                break
-            name_length += 1
-        if (flag == False):
+        # Searches for a colon to indicate where the message starts
+        name_length = linestr.find(':')
+        if (name_length == -1):
             return (False, 'null', 'null')
-        if (flag == True):
+        else:
             # this means that a name was found. Now we have to check whether it is a false name due to misinterpretation
             name = linestr[:name_length]
             # misinterpretation in group creation
@@ -315,11 +1188,8 @@ class GlobalStats(CommonValidationMethods):
             if (' changed the subject from "' in name):
                 return (False, 'null', 'null')
 
-            # if the name contains characters than cannot be on a word file, this function removes them
-            name = self.RemoveCharacters(name, FORBIDDENFILECHARACTERS)
-            
             # Returns whether name was detected, the name and the rest of the string
-            return (True, linestr[:name_length], linestr[name_length + 2:])
+            return (True, name, linestr[name_length + 2:])
 
 
     # Function replaces all occurences of the input characters with a whitespace
@@ -342,12 +1212,104 @@ class GlobalStats(CommonValidationMethods):
             return True
         return False
 
-    # Reads a group, and creates a text file for each person who sent messages in the group
-    def SplitMessageNametagTimestamp(self):
-        # splitmsgfout is a dictionary of all splitmsg output file pointers mapped to the name of the message
+    # Finds the lines of the memory mapped input file from lineOffset up to endOffset (or the end of the file), without decoding them.
+    # Yields the byte offsets of the start and the end of every line, how many bytes of \r or \r\n at its end are translated to \n in text mode,
+    # and the start of the line found by LineHead
+    def ScanLines(self, inputBytes, lineOffset = 0, endOffset = None):
+        if endOffset is None:
+            endOffset = len(inputBytes)
+        # Exports without any \r are split on \n alone
+        hasCarriageReturns = inputBytes.find(b'\r', lineOffset, endOffset) != -1
+        while lineOffset < endOffset:
+            lineEnd = inputBytes.find(b'\n', lineOffset) + 1 or len(inputBytes)
+            if hasCarriageReturns and inputBytes.find(b'\r', lineOffset, lineEnd) != -1:
+                rawLine = inputBytes[lineOffset:lineEnd]
+                if rawLine.endswith(b'\r\n') and rawLine.count(b'\r') == 1:
+                    yield (lineOffset, lineEnd, 2, self.LineHead(inputBytes, lineOffset, lineEnd, 2))
+                else:
+                    # A lone \r also ends a line in text mode, so the line is split up further
+                    for subLine in TEXTMODELINEREGEX.finditer(rawLine):
+                        if subLine.group().endswith(b'\r\n'):
+                            subLineBreakLength = 2
+                        elif subLine.group().endswith(b'\r'):
+                            subLineBreakLength = 1
+                        else:
+                            subLineBreakLength = 0
+                        (subLineOffset, subLineEnd) = (lineOffset + subLine.start(), lineOffset + subLine.end())
+                        yield (subLineOffset, subLineEnd, subLineBreakLength, self.LineHead(inputBytes, subLineOffset, subLineEnd, subLineBreakLength))
+            else:
+                # Same as LineHead, for a line without a \r
+                lineHead = inputBytes[lineOffset:lineOffset + LINEHEADCHARACTERS if lineEnd - lineOffset > LINEHEADCHARACTERS else lineEnd]
+                if lineHead.isascii():
+                    yield (lineOffset, lineEnd, 0, lineHead.decode('ascii'))
+                else:
+                    yield (lineOffset, lineEnd, 0, inputBytes[lineOffset:min(lineEnd, lineOffset + LINEHEADBYTES)].decode('utf8', 'ignore'))
+            lineOffset = lineEnd
+
+    # Decodes the text of a line, or of the end of a line, found by ScanLines. The text is exactly what reading the file in text mode would give
+    def LineText(self, inputBytes, start, end, lineBreakLength):
+        if lineBreakLength:
+            return inputBytes[start:end - lineBreakLength].decode('utf8') + '\n'
+        return inputBytes[start:end].decode('utf8')
+
+    # Decodes just enough of the start of a line found by ScanLines to validate its timestamp, see LINEHEADBYTES.
+    # A character cut in two at the end of the bytes always comes after the first 20 characters, so it is left out
+    def LineHead(self, inputBytes, start, end, lineBreakLength):
+        # Most lines start with 20 ASCII characters
+        if end - start > LINEHEADCHARACTERS + lineBreakLength:
+            lineHead = inputBytes[start:start + LINEHEADCHARACTERS]
+            if lineHead.isascii():
+                return lineHead.decode('ascii')
+        if lineBreakLength and end - start <= LINEHEADBYTES:
+            return self.LineText(inputBytes, start, end, lineBreakLength)
+        return inputBytes[start:min(end, start + LINEHEADBYTES)].decode('utf8', 'ignore')
+
+    # Does the same as ValidateLineName for a line found by ScanLines, on its bytes. Only the message is decoded, and every distinct name is decoded
+    # and checked once, as senderNames maps the bytes of every name found so far to the name, or to False if it is not the name of a sender.
+    # The timestamp takes up the first timestamplength characters of lineHead.
+    # Returns whether a name was found, the name, the message and the byte offset of the message
+    def ScanLineName(self, inputBytes, start, end, lineBreakLength, lineHead, timestamplength, senderNames):
+        nameOffset = start + (timestamplength if lineHead.isascii() else len(lineHead[:timestamplength].encode('utf8')))
+        # A : byte is never part of a longer UTF-8 character
+        colonOffset = inputBytes.find(b':', nameOffset, end)
+        if colonOffset == -1:
+            return (False, 'null', 'null', end)
+        nameBytes = inputBytes[nameOffset:colonOffset]
+        name = senderNames.get(nameBytes)
+        if name is None:
+            # Every message of a sender refers to the same interned name, which is also the key of the sender in the contacts and the message store
+            name = sys.intern(nameBytes.decode('utf8'))
+            # misinterpretation in group creation or group subject change
+            if ' created group "' in name or ' changed the subject from "' in name:
+                name = False
+            senderNames[nameBytes] = name
+        if name is False:
+            return (False, 'null', 'null', end)
+        # Like ValidateLineName, the character after the colon is skipped. It is usually a space
+        messageOffset = colonOffset + 1
+        messageEnd = end - lineBreakLength
+        if messageOffset >= messageEnd:
+            return (True, name, '', end)
+        leadByte = inputBytes[messageOffset]
+        messageOffset += 1 if leadByte < 0xc0 else 2 if leadByte < 0xe0 else 3 if leadByte < 0xf0 else 4
+        if lineBreakLength:
+            return (True, name, inputBytes[messageOffset:messageEnd].decode('utf8') + '\n', messageOffset)
+        return (True, name, inputBytes[messageOffset:end].decode('utf8'), messageOffset)
+
+    # Reads a group, and creates a text file for each person who sent messages in the group.
+    # In memory mode, every message is passed straight to the IndivStats object of its sender instead, and the text files are only written if writeIntermediateFiles is set.
+    # Memory mode also records every message in a MessageStore, which is kept in self.messageStore.
+    # If a checkpoint is given, parsing carries on from the end of the checkpoint instead of the start of the file.
+    # resumeState does the same with contacts, a message store and a parser state that are already in memory, see ParallelSplitMessageNametagTimestamp,
+    # and endOffset stops parsing at that byte offset. The parser state at the end is kept in self.parserState
+    @InstrumentedStage
+    def SplitMessageNametagTimestamp(self, checkpoint = None, resumeState = None, endOffset = None, printProgress = True):
+        # splitmsgfout is a dictionary of all splitmsg output file paths mapped to the name of the message
         splitmsgfout = {}
-        # timestampfout is a dictionary of all timestamp output file pointers mapped to the name of the message
+        # timestampfout is a dictionary of all timestamp output file paths mapped to the name of the message
         timestampfout = {}
+        # The intermediate files of all senders are written through one set of buffered writers, which keeps a bounded number of them open
+        writers = OutputFileWriters(maximumOpenOutputFiles, outputBufferLines)
         # contacts is a dictionary of all the class objects of IndivStats for the particular chat
         contacts = {}
 
@@ -355,13 +1317,28 @@ class GlobalStats(CommonValidationMethods):
         startTimeStamp = NULLDATETIME
         endTimeStamp = NULLDATETIME
 
-        if not self.ValidateIOf(self.inputFilePath, self.splitMessageOutputFolderPath):
+        writeFiles = self.WritesIntermediateFiles()
+        streamToContacts = pipelineMode == 'memory'
+
+        if writeFiles:
+            if not self.ValidateIOf(self.inputFilePath, self.splitMessageOutputFolderPath):
+                return
+            self.ValidatePath(self.timestampOutputFolderPath)
+        elif not self.ValidateIOf(self.inputFilePath, self.outputFolderPath):
             return
-        self.ValidatePath(self.timestampOutputFolderPath)
 
-        # input text file will be opened
-        f = open(self.inputFilePath, mode='r', encoding='utf8')
-        print('Processing: {}'.format(self.inputFilePath))
+        # The date layout is detected once, so that the fast parser engine can handle most lines without dateutil
+        if timestampParserEngine == 'fast' and self.timestampLayout is None:
+            self.timestampLayout = self.DetectTimestampLayout()
+
+        # Every message is recorded with its byte offset in the input file, so the input file is memory mapped and scanned as bytes.
+        # Only the parts of a line that are needed are decoded, and the file never has to fit in memory
+        store = MessageStore()
+        f = open(self.inputFilePath, mode='rb')
+        # An empty file cannot be memory mapped, but then there are no lines to read either
+        inputBytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.inputFilePath) else b''
+        if printProgress:
+            print('Processing: {}'.format(self.inputFilePath))
 
         # Total lines parsed
         totalMsg = 0
@@ -369,20 +1346,46 @@ class GlobalStats(CommonValidationMethods):
         validDates = 0
         # Of which how many had been actually sent by a person
         validMsg = 0
-        line = f.readline()
         # variable that checks whether the current message is a continuation of a previous message
         isContinuation = False
         lastMsgSenderName = 'null'
-        while (line):
+        lastFormattedDateTime = NULLDATETIME
+        lastFormattedTimestamp = ''
+
+        startOffset = 0
+        if checkpoint is not None:
+            (contacts, store, parserState) = self.RestoreCheckpoint(checkpoint)
+            (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName, startTimeStampHasBeenFound, startTimeStamp, endTimeStamp) = parserState
+            startOffset = checkpoint['byteOffset']
+            print('Resuming from checkpoint at byte {}'.format(startOffset))
+        elif resumeState is not None:
+            (contacts, store, parserState, startOffset) = resumeState
+            (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName, startTimeStampHasBeenFound, startTimeStamp, endTimeStamp) = parserState
+        (linesBefore, messagesBefore) = (totalMsg, validMsg)
+        # The next checkpoint is taken at the start of the last line that ends with a \n. Parts of a file parsed by a worker process never take one
+        checkpointOffset = self.LastLineBoundary() if self.UsesIncrementalCheckpoint() and endOffset is None else -1
+        self.checkpointState = None
+        # Names found by ScanLineName
+        senderNames = {}
+        # The timestamp of a line only depends on the start of the line, which is the same for messages sent in the same minute by the same sender
+        previousLineHead = None
+
+        for (lineOffset, lineEnd, lineBreakLength, lineHead) in self.ScanLines(inputBytes, startOffset, endOffset):
+            if lineOffset == checkpointOffset:
+                self.TakeCheckpoint(lineOffset, contacts, store, (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName,
+                                                                  startTimeStampHasBeenFound, startTimeStamp, endTimeStamp))
             totalMsg += 1
-            (isDateValid, currentMsgDateTime, timestamplength) = self.ValidateLineDate(line)
-            (isNameValid, name, message) = self.ValidateLineName(line, timestamplength)
+            if lineHead != previousLineHead:
+                previousLineHead = lineHead
+                (isDateValid, currentMsgDateTime, timestamplength) = self.ParseLineDate(lineHead)
             # First checks if the message starts with a timestamp
             if (isDateValid):
                 if not startTimeStampHasBeenFound:
                     startTimeStampHasBeenFound = True
                     startTimeStamp = currentMsgDateTime
                 validDates += 1
+                (isNameValid, name, message, messageOffset) = self.ScanLineName(inputBytes, lineOffset, lineEnd, lineBreakLength, lineHead, timestamplength,
+                                                                                senderNames)
                 # Then checks if it has a valid name of sender
                 if (isNameValid):
                     isContinuation = True
@@ -390,24 +1393,41 @@ class GlobalStats(CommonValidationMethods):
 
                     # In that case, write the message into the corresponding text file of that sender
                     # If such a text file doesn't exist, initialise the name into the dictionaries and create text file
-                    if name not in splitmsgfout:
-                        # initialise splitmsg output file
-                        splitmsgfout[name] = open('{}/{}.txt'.format(self.splitMessageOutputFolderPath, name), mode='w',
-                                                  encoding='utf8')
-                        # initialse timestamp output file
-                        timestampfout[name] = open('{}/{}.txt'.format(self.timestampOutputFolderPath, name), mode='w',
-                                                   encoding='utf8')
+                    if name not in contacts:
                         # initialise contact class object
                         contacts[name] = IndivStats(name, 0, 0, 0)
+                        if writeFiles:
+                            # initialise splitmsg output file
+                            splitmsgfout[name] = writers.Create('{}/{}.txt'.format(self.splitMessageOutputFolderPath, name))
+                            # initialse timestamp output file
+                            timestampfout[name] = writers.Create('{}/{}.txt'.format(self.timestampOutputFolderPath, name))
+                        if streamToContacts:
+                            contacts[name].SetFilePaths(*self.ContactFilePaths(name))
+                            contacts[name].StartStreaming(writers if writeFiles else None)
+
+                    # The message starts right after the sender name, and can span continuation lines that are added to it later
+                    if message:
+                        messageFlags = 0
+                    else:
+                        # Nothing was written after the sender name, so only the continuation lines are left
+                        messageOffset = lineEnd
+                        messageFlags = STOREMESSAGEEMPTY
 
                     # This is the final check that determines if the message is a valid message, sent by a contact. Deleted messages and invites are ignored here.
                     if (not (self.IsIgnorableMsg(message))):
                         validMsg += 1
-                        # Message contents are added to splitmsg file
-                        splitmsgfout[name].write(message)
-                        # Timestamp is added to timestamp file
-                        timestampfout[name].write(currentMsgDateTime.strftime(TIMESTAMPFORMAT))
-                        timestampfout[name].write('\n')
+                        messageFlags |= STOREMESSAGECOUNTED
+                        if writeFiles:
+                            # Message contents are added to splitmsg file
+                            writers.Write(splitmsgfout[name], message)
+                            # Timestamp is added to timestamp file. Consecutive messages are often sent in the same minute, so the formatted timestamp is reused
+                            if currentMsgDateTime != lastFormattedDateTime:
+                                lastFormattedDateTime = currentMsgDateTime
+                                lastFormattedTimestamp = currentMsgDateTime.strftime(TIMESTAMPFORMAT) + '\n'
+                            writers.Write(timestampfout[name], lastFormattedTimestamp)
+                        if streamToContacts:
+                            contacts[name].AddMessage(currentMsgDateTime, message)
+                    store.AddMessage(name, currentMsgDateTime, messageOffset, lineEnd, messageFlags)
 
 
                 # If a valid timestamp exist but a valid name does not, then whatever message comes next cannot be a continuation
@@ -415,29 +1435,49 @@ class GlobalStats(CommonValidationMethods):
                     isContinuation = False
             # If a valid timestamp doesn't exist, it means that the message is a continuation line of previously sent message
             else:
+                # Only continuation lines are decoded in full
                 if isContinuation:
-                    splitmsgfout[lastMsgSenderName].write(line)
+                    line = self.LineText(inputBytes, lineOffset, lineEnd, lineBreakLength) if lineBreakLength else inputBytes[lineOffset:lineEnd].decode('utf8')
+                    if writeFiles:
+                        writers.Write(splitmsgfout[lastMsgSenderName], line)
+                    if streamToContacts:
+                        contacts[lastMsgSenderName].AddMessageLine(line)
+                    store.ExtendLastMessage(lineEnd)
             endTimeStamp = currentMsgDateTime
-            line = f.readline()
-        print('Processing finished. {} lines parsed. {} valid timestamps discovered. {} valid messages found.'.format(
-            totalMsg, validDates, validMsg))
+        if printProgress:
+            print('Processing finished. {} lines parsed. {} valid timestamps discovered. {} valid messages found.'.format(
+                totalMsg, validDates, validMsg))
+        runReport.Count(bytesProcessed=(len(inputBytes) if endOffset is None else endOffset) - startOffset, linesProcessed=totalMsg - linesBefore,
+                        messagesProcessed=validMsg - messagesBefore, filesWritten=list(splitmsgfout.values()) + list(timestampfout.values()))
+        if inputBytes:
+            inputBytes.close()
         f.close()
+        if checkpointOffset != -1 and self.checkpointState is None:
+            # The file ends with a \n, so the checkpoint is taken at its end
+            self.TakeCheckpoint(checkpointOffset, contacts, store, (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName,
+                                                                    startTimeStampHasBeenFound, startTimeStamp, endTimeStamp))
         noOfDaysOfChat = (endTimeStamp - startTimeStamp).days + 1
-        for name in splitmsgfout:
-            splitmsgfout[name].close()
-            timestampfout[name].close()
+        writers.Close()
+        if streamToContacts:
+            for name in contacts:
+                contacts[name].FinishStreaming()
+        store.SetChatTotals(totalMsg, validDates, validMsg, startTimeStamp, endTimeStamp)
+        self.messageStore = store
+        self.parserState = (totalMsg, validDates, validMsg, isContinuation, lastMsgSenderName, startTimeStampHasBeenFound, startTimeStamp, endTimeStamp)
         return contacts, noOfDaysOfChat
 
+    @InstrumentedStage
     def WriteOverallGroupChatOutput(self):
         
-        fout = open(self.globalAnalysisOutputFilePath,mode = "w",encoding="utf8")
+        fout = resultStore.Open(self.globalAnalysisOutputFilePath)
         
         # Initialising data variables
         totalMessagesSum = 0
         namesAndMsgs = {}
         avgWords = {}
-        totalChatWordsCounter = Counter()
-        groupFreqDistTableYearly = np.zeros(366, int)
+        totalChatWordsCounter = NewWordCounter()
+        totalChatNgramCounts = NewNgramCounters()
+        groupFreqDistTableYearly = self.activityCube.Histogram('dayofyear')[1]
 
 
         print("Performing overall analysis on group chat: {}".format(self.name))
@@ -446,8 +1486,10 @@ class GlobalStats(CommonValidationMethods):
             fout.write("\n{} ".format(name))
             namesAndMsgs[name] = self.contacts[name].totalMessages
             avgWords[name] = self.contacts[name].avgWords
-            groupFreqDistTableYearly = np.add(groupFreqDistTableYearly,self.contacts[name].freqDistTableYearly)
-            totalChatWordsCounter += self.contacts[name].allWordCounts
+            # Counter += goes through the whole group counter again for every contact to drop counts below 1, update only adds to it
+            totalChatWordsCounter.update(self.contacts[name].allWordCounts)
+            for (n, counter) in self.contacts[name].ngramCounts.items():
+                totalChatNgramCounts[n].update(counter)
         # namesAndMsgs will contain a dict of contact names mapped to total messages sent by them. This function will find top 5 of those names based on messages sent
         topNamesAndMsgs = dict(sorted(namesAndMsgs.items(), key=operator.itemgetter(1), reverse=True)[:5])
         # avgWords will contain a dict of contact names mapped to average words per message. This function will find top 5 f those names based on average words per message.
@@ -467,39 +1509,141 @@ class GlobalStats(CommonValidationMethods):
             fout.write("\n{} : {}".format(key,value))
         fout.write("\n\nThe average number of messages sent per day over chat's lifetime {}".format(groupAverageMessages))
         fout.write("\n\nThe top 5 most used words in the chat are:")
-        for word, count in totalChatWordsCounter.most_common(5):
+        # Kept for Statistics
+        self.topWords = totalChatWordsCounter.most_common(5)
+        self.topWordsError = totalChatWordsCounter.error if wordCountEngine == 'heavyhitters' else 0
+        for word, count in self.topWords:
                 fout.write('\n%s : %d' % (word, count))
+        if wordCountEngine == 'heavyhitters':
+            fout.write('\n(estimated counts, each at most {} higher than the true count)'.format(totalChatWordsCounter.error))
+        # Kept for Statistics
+        self.topPhrases = {n: counter.most_common(5) for (n, counter) in totalChatNgramCounts.items()}
+        for (n, counter) in totalChatNgramCounts.items():
+            fout.write("\n\nThe top 5 most used phrases of {} words in the chat are:".format(n))
+            for phrase, count in self.topPhrases[n]:
+                fout.write('\n%s : %d' % (phrase, count))
+            fout.write('\n(estimated counts, each at most {} higher than the true count)'.format(counter.error))
+        if self.mediaStatistics is not None:
+            fout.write("\n\nThe media sent by each person in this chat are :")
+            for name, media in sorted(self.mediaStatistics['senders'].items(), key=lambda item: (item[1]['files'], item[1]['omitted']), reverse=True):
+                fout.write("\n{} : {} files, {} MB, {} omitted".format(name, media['files'], round(media['bytes'] / (1024 * 1024), floatDigitsAfterDecimal),
+                                                                      media['omitted']))
+            fout.write("\n\nMedia files in the export that no message refers to : {} files, {} MB".format(
+                self.mediaStatistics['unattributedFiles'], round(self.mediaStatistics['unattributedBytes'] / (1024 * 1024), floatDigitsAfterDecimal)))
+        if self.interactions is not None:
+            self.WriteInteractions(fout)
         fout.close()
 
         # this is for plotting purpose
-        index = np.arange(1, 367)
-        plt.bar(index, groupFreqDistTableYearly)
-        plt.xlabel('Day of Year', fontsize=5)
-        plt.ylabel('No of Messages', fontsize=5)
-        # plt.xticks(index, index, fontsize=5, rotation=30)
-        plt.title('Yearly frequency of messaging')
-        plt.savefig(self.globalFrequencyPlotOutputFilePath, dpi=200)
-        plt.close()
+        frequencyPlotRenderer.Plot(groupFreqDistTableYearly, self.globalFrequencyPlotOutputFilePath)
+        filesWritten = [self.globalAnalysisOutputFilePath] + ([self.globalFrequencyPlotOutputFilePath] if drawPlots else [])
+        if self.interactions is not None and drawPlots:
+            self.interactions.DrawHeatmap(self.interactionHeatmapOutputFilePath, self.name)
+            filesWritten.append(self.interactionHeatmapOutputFilePath)
 
+        runReport.Count(messagesProcessed=totalMessagesSum, filesWritten=filesWritten)
         print("Overall Analysis complete.")
 
+    # Writes the replies and reply times of every person who replied to someone, most replies first, and those of the whole chat
+    def WriteInteractions(self, fout):
+        (replies, replyTimes) = self.interactions.ReplyTimePercentiles(REPLYTIMEPERCENTILES)
+        fout.write("\n\nThe replies sent by each person in this chat, counting a message as a reply to the message before it if someone else sent that "
+                   "at most {} minutes earlier, are :".format(replyWindowMinutes))
+        for senderId in sorted(np.flatnonzero(replies[:-1]).tolist(), key=lambda senderId: replies[senderId], reverse=True):
+            fout.write("\n{} : {} replies, reply time {}. Most replies to {}".format(
+                self.interactions.senderNames[senderId], replies[senderId], self.FormatReplyTimes(replyTimes[senderId]),
+                ', '.join('{} ({})'.format(name, count) for (name, count) in self.interactions.TopRepliedTo(senderId, 3))))
+        fout.write("\n\nThe whole chat : {} replies, reply time {}".format(replies[-1], self.FormatReplyTimes(replyTimes[-1]) if replies[-1] else 'none'))
+
+    # Returns reply times found by InteractionMatrix.ReplyTimePercentiles as text
+    def FormatReplyTimes(self, replyTimes):
+        return ', '.join('{}th percentile {} min'.format(percentile, replyTime) for (percentile, replyTime) in zip(REPLYTIMEPERCENTILES, replyTimes))
+
+    # Returns the statistics of the analysed chat and of each of its contacts, and where their output files are, as plain Python objects that can be sent as JSON
+    def Statistics(self):
+        contacts = {}
+        for name, contact in self.contacts.items():
+            contacts[name] = {'totalMessages': int(contact.totalMessages), 'wordCount': int(contact.wordCount), 'averageWordsPerMessage': contact.avgWords,
+                              'topWords': [[word, int(count)] for word, count in contact.allWordCounts.most_common(5)],
+                              'topPhrases': {n: [[phrase, count] for phrase, count in counter.most_common(5)] for (n, counter) in contact.ngramCounts.items()},
+                              'activity': self.ActivityStatistics(name),
+                              'individualAnalysisOutputFilePath': contact.individualAnalysisOutputFilePath,
+                              'frequencyPlotOutputFilePath': contact.frequencyPlotOutputFilePath if drawPlots else None}
+        totalMessagesSum = sum(contact['totalMessages'] for contact in contacts.values())
+        return {'chat': self.name, 'inputFilePath': self.inputFilePath, 'outputFolderPath': self.outputFolderPath, 'chatAge': self.chatAge,
+                'totalMessages': totalMessagesSum, 'averageMessagesPerDay': round(totalMessagesSum / self.chatAge, floatDigitsAfterDecimal),
+                'topWords': [[word, int(count)] for word, count in self.topWords], 'topWordsError': self.topWordsError,
+                'topPhrases': {n: [[phrase, count] for phrase, count in topPhrases] for (n, topPhrases) in self.topPhrases.items()},
+                'activity': self.ActivityStatistics(),
+                'globalAnalysisOutputFilePath': self.globalAnalysisOutputFilePath,
+                'globalFrequencyPlotOutputFilePath': self.globalFrequencyPlotOutputFilePath if drawPlots else None,
+                'runReportFilePath': '{}/{}'.format(self.outputFolderPath, runReportFileName) if writeRunReport else None, 'mergeTotals': self.mergeTotals,
+                'media': self.mediaStatistics, 'interactions': self.interactions.Statistics() if self.interactions is not None else None,
+                'interactionHeatmapOutputFilePath': self.interactionHeatmapOutputFilePath if self.interactions is not None and drawPlots else None,
+                'contacts': contacts}
+
+    # Returns the messages sent in each hour of the day, on each weekday and in each month by a contact, or by everyone if senderName is None, from the activity cube
+    def ActivityStatistics(self, senderName = None):
+        (months, monthCounts) = self.activityCube.Histogram('month', senderName)
+        return {'hours': self.activityCube.Histogram('hour', senderName)[1].tolist(),
+                'weekdays': dict(zip(WEEKDAYNAMES, self.activityCube.Histogram('weekday', senderName)[1].tolist())),
+                'months': dict(zip(np.datetime_as_string(months).tolist(), monthCounts.tolist()))}
+
+    # Writes the run report of the chat next to its overall statistics, with the records of its stages, the totals of the whole analysis and the
+    # settings it ran with. The profile of profileStage is saved next to it
+    def WriteRunReport(self, records, profile, wallSeconds, cpuSeconds):
+        report = {'version': RUNREPORTVERSION, 'chat': self.name, 'inputFilePath': self.inputFilePath, 'inputBytes': os.path.getsize(self.inputFilePath),
+                  'wallSeconds': round(wallSeconds, 6), 'cpuSeconds': round(cpuSeconds, 6), 'peakMemoryMB': PeakMemoryMB(),
+                  'contacts': len(self.contacts), 'settings': CurrentSettings(), 'stages': records, 'profile': None}
+        if self.parserState is not None:
+            (report['linesParsed'], report['validTimestamps'], report['validMessages']) = self.parserState[:3]
+        if self.mergeTotals is not None:
+            report['mergeTotals'] = self.mergeTotals
+        if self.messageStore is not None:
+            report['messageStoreBytes'] = self.messageStore.MemoryBytes()
+            report['messageStoreBytesPerMessage'] = round(report['messageStoreBytes'] / len(self.messageStore), floatDigitsAfterDecimal) if len(self.messageStore) else 0
+        if profile is not None:
+            import pstats
+            report['profile'] = '{}/{}'.format(self.outputFolderPath, profileFileName.format(profileStage))
+            resultStore.SaveProfile(profile, report['profile'])
+            with resultStore.Open('{}/{}'.format(self.outputFolderPath, profileSummaryFileName.format(profileStage))) as fout:
+                pstats.Stats(profile, stream=fout).sort_stats('cumulative').print_stats(40)
+        with resultStore.Open('{}/{}'.format(self.outputFolderPath, runReportFileName)) as fout:
+            json.dump(report, fout, indent=2, ensure_ascii=False)
+            fout.write('\n')
+
 # Class used for storing and maintaining data of individual contact members in a particular group chat.
 # IndivStats inherits all the methods from CommonValidationMethods class.
 class IndivStats(CommonValidationMethods):
 
+    # Stop words and tokenizer shared by all contacts. They are loaded the first time a contact needs them
+    stopWords = None
+    tokenizer = None
+    contractionTokenizer = None
+    # WordsDecision of every distinct piece of a line seen by the fast tokenizer engine
+    pieceDecisions = {}
+
+    # A chat can have thousands of contacts, so their attributes are kept in slots instead of a dictionary per contact
+    __slots__ = ('name', 'avgWords', 'totalMessages', 'wordCount', 'allWordCounts', 'ngramCounts', 'freqDistTableYearly', 'splitMessageOutputFilePath', 'timestampOutputFilePath',
+                 'withoutStopWordsOutputFilePath', 'individualAnalysisOutputFilePath', 'frequencyPlotOutputFilePath', 'withoutStopWordsWriters')
+
     # Setting up the class variables
     def __init__(self,name = 'null',avgWords = 0,totalMessages = 0,wordCount = 0):
         self.avgWords = avgWords
         self.totalMessages = totalMessages
         self.wordCount = wordCount
         self.name = name
-        self.allWordCounts = Counter()
+        self.allWordCounts = NewWordCounter()
+        # HeavyHitterCounter of the phrases of every size in ngramSizes
+        self.ngramCounts = NewNgramCounters()
         self.freqDistTableYearly = np.zeros(366, int)
         self.splitMessageOutputFilePath = 'null'
         self.timestampOutputFilePath = 'null'
         self.withoutStopWordsOutputFilePath = 'null'
         self.individualAnalysisOutputFilePath = 'null'
         self.frequencyPlotOutputFilePath = 'null'
+        # Writers of the without stop words output file, only set while messages are streamed in memory mode with intermediate files
+        self.withoutStopWordsWriters = None
         
         
     # Setting the output file paths, so the object can access its respective output files easily
@@ -511,19 +1655,29 @@ class IndivStats(CommonValidationMethods):
         self.frequencyPlotOutputFilePath = frequencyPlotOutputFilePath
 
 
+    @InstrumentedStage
     def IndividualCalculations(self):
-        # Input Folder ---> Output Folder
+        if pipelineMode == 'files':
+            # Input Folder ---> Output Folder
 
-        # Split Messages ---> Without Stop Words
-        # This function is also used to calculate total number of words, as it handles all words sent by the contact
-        self.wordCount = self.RemoveStopWords()
+            # Split Messages ---> Without Stop Words
+            # This function is also used to calculate total number of words, as it handles all words sent by the contact
+            self.wordCount = self.RemoveStopWords()
 
-        # Without Stop Words ---> Individual Analysis
-        self.FindWordCountFromFile()
+            # Without Stop Words ---> Individual Analysis
+            self.FindWordCountFromFile()
 
-        # Timestamps ---> Frequency Plots
-        # This function is also used to calculate total number of messages, as it handles all timestamps of messages sent by the contact
-        self.totalMessages = self.FrequencyPlotFromFile()
+            # Timestamps ---> Frequency Plots
+            # This function is also used to calculate total number of messages, as it handles all timestamps of messages sent by the contact
+            self.totalMessages = self.FrequencyPlotFromFile()
+        else:
+            # In memory mode, the word counts, total messages and frequencies were already found while the chat was parsed
+            print('Analysing contact: {}'.format(self.name))
+            if not resultStore.Captures() and not self.ValidateIOf(self.individualAnalysisOutputFilePath, os.path.split(self.frequencyPlotOutputFilePath)[0]):
+                return
+            self.WriteTopWords()
+            self.PlotFrequency()
+            print('Analysis complete. Output stored in {}'.format(self.individualAnalysisOutputFilePath))
         # To avoid division by zero
         if self.totalMessages == 0:
             self.avgWords = 0
@@ -531,11 +1685,25 @@ class IndivStats(CommonValidationMethods):
             self.avgWords = round((self.wordCount / self.totalMessages), floatDigitsAfterDecimal)
 
         # Adding the rest of the data to the Individual Analysis file
-        fout = open(self.individualAnalysisOutputFilePath, mode = 'a',encoding = "utf8")
+        fout = resultStore.Open(self.individualAnalysisOutputFilePath, mode = 'a')
         fout.write("\n\nThe Total number of words sent by {} is {}".format(self.name,self.wordCount))
         fout.write("\n\nThe Total number of messages sent by {} is {}".format(self.name, self.totalMessages))
         fout.write("\n\nThe Average number of words sent by {} per message is {}".format(self.name, self.avgWords))
         fout.close()
+        runReport.Count(messagesProcessed=self.totalMessages, filesWritten=[self.individualAnalysisOutputFilePath] + ([self.frequencyPlotOutputFilePath] if drawPlots else []))
+
+    # Returns the statistics of the contact that are needed by the overall analysis of the group chat, so they can be sent back from a worker process
+    def Results(self):
+        return (self.wordCount, self.totalMessages, self.avgWords, self.allWordCounts, self.freqDistTableYearly, self.ngramCounts)
+
+    # Stores the statistics returned by Results
+    def SetResults(self, wordCount, totalMessages, avgWords, allWordCounts, freqDistTableYearly, ngramCounts):
+        self.wordCount = wordCount
+        self.totalMessages = totalMessages
+        self.avgWords = avgWords
+        self.allWordCounts = allWordCounts
+        self.freqDistTableYearly = freqDistTableYearly
+        self.ngramCounts = ngramCounts
 
     # ===============================
     # Utility functions
@@ -543,35 +1711,145 @@ class IndivStats(CommonValidationMethods):
 
     # Function returns day of year as int. The day of year is always found for a leap year.
     def DayOfYear(self, timeStamp):
-        timeStamp = datetime.datetime(2000, timeStamp.month, timeStamp.day)
-        yDay = (timeStamp - datetime.datetime(timeStamp.year, 1, 1)).days + 1
-        return yDay
+        return LEAPYEARMONTHSTARTS[timeStamp.month - 1] + timeStamp.day
+
+    # Does the same as DayOfYear for a whole array of datetime64 timestamps at once
+    def DaysOfYear(self, timeStamps):
+        months = timeStamps.astype('datetime64[M]')
+        days = (timeStamps.astype('datetime64[D]') - months).astype(int) + 1
+        return LEAPYEARMONTHSTARTS[months.astype(int) % 12] + days
+
+    # Counts the timestamps sent on each day of the year. Returns a table like freqDistTableYearly
+    def YearlyFrequencies(self, timeStamps):
+        return np.bincount(self.DaysOfYear(timeStamps) - 1, minlength=366)
 
     # Function should print the top 5 word count
+    @InstrumentedStage
     def FindWordCountFromFile(self):
         print('Analysing file: {}'.format(self.withoutStopWordsOutputFilePath))
 
-        if not self.ValidateIO(self.withoutStopWordsOutputFilePath, self.individualAnalysisOutputFilePath):
+        if not self.ValidateResultIO(self.withoutStopWordsOutputFilePath, self.individualAnalysisOutputFilePath):
             return
 
-        # Input from fin, output in fout
-        fout = open(self.individualAnalysisOutputFilePath, mode='w', encoding='utf8')
-        fout.write("The top 5 words used by the user are :\n\n")
+        # The file is read one line at a time, so only the counts are ever held in memory
+        self.allWordCounts = NewWordCounter()
+        self.ngramCounts = NewNgramCounters()
+        lineCount = 0
         with open(self.withoutStopWordsOutputFilePath, 'r', encoding='utf8') as fin:
-            self.allWordCounts = Counter(fin.read().split())
-            for word, count in self.allWordCounts.most_common(5):
-                fout.write('%s : %d\n' % (word, count))
-        fout.close()
+            for line in fin:
+                words = line.split()
+                self.allWordCounts.update(words)
+                if self.ngramCounts:
+                    self.CountPhrases(words)
+                lineCount += 1
+        self.WriteTopWords()
+        runReport.Count(inputFilePath=self.withoutStopWordsOutputFilePath, linesProcessed=lineCount, messagesProcessed=lineCount,
+                        filesWritten=[self.individualAnalysisOutputFilePath])
         print('Analysis complete. Output stored in {}'.format(self.individualAnalysisOutputFilePath))
 
- 
+    # Starts the Individual Analysis file with the top 5 words used by the contact
+    def WriteTopWords(self):
+        fout = resultStore.Open(self.individualAnalysisOutputFilePath)
+        fout.write("The top 5 words used by the user are :\n\n")
+        for word, count in self.allWordCounts.most_common(5):
+            fout.write('%s : %d\n' % (word, count))
+        if wordCountEngine == 'heavyhitters':
+            fout.write('(estimated counts, each at most {} higher than the true count)\n'.format(self.allWordCounts.error))
+        for (n, counter) in self.ngramCounts.items():
+            fout.write("\nThe top 5 phrases of {} words used by the user are :\n\n".format(n))
+            for phrase, count in counter.most_common(5):
+                fout.write('%s : %d\n' % (phrase, count))
+            fout.write('(estimated counts, each at most {} higher than the true count)\n'.format(counter.error))
+        fout.close()
+
+    # Counts the phrases of every size in ngramSizes in a line of words without stop words. Phrases never run from one line to the next
+    def CountPhrases(self, words):
+        for (n, counter) in self.ngramCounts.items():
+            if len(words) >= n:
+                counter.update(map(' '.join, zip(*[words[i:] for i in range(n)])))
+
+    # Loads the stop words and tokenizers shared by all contacts, if they haven't been loaded yet.
+    # Only data that is already on this machine is used, nothing is downloaded
+    def LoadTokenizer(self):
+        if IndivStats.stopWords is None:
+            import nltk
+            from nltk.tokenize import TweetTokenizer, NLTKWordTokenizer
+            # Stop Words: commonly used words like for, is, and that need to be filtered out
+            try:
+                IndivStats.stopWords = set(nltk.corpus.stopwords.words('english'))
+            except LookupError:
+                with open(bundledStopWordsFilePath, mode='r', encoding='utf8') as fin:
+                    IndivStats.stopWords = set(fin.read().split())
+            # TweetTokenizer tokenizes string but preserves ' and - in words
+            IndivStats.tokenizer = TweetTokenizer()
+            # nltk.word_tokenize splits contractions, but first splits the text into sentences with the punkt model.
+            # Without the model, the words are split the same way, just without looking for sentences first.
+            # That only makes a difference for words that contain . ? or !, like links
+            try:
+                nltk.data.find('tokenizers/punkt_tab/english/')
+                IndivStats.contractionTokenizer = nltk.word_tokenize
+            except LookupError:
+                IndivStats.contractionTokenizer = NLTKWordTokenizer().tokenize
+
+    # Tokenizes one line of a message and removes the stop words from it
+    # Returns the words that are left, and the number of words in the line
+    def RemoveStopWordsFromLine(self, line):
+        if tokenizerEngine == 'fast':
+            return self.FastRemoveStopWordsFromLine(line)
+        return self.WordsDecision(line)
+
+    # Does the same as RemoveStopWordsFromLine with the 'nltk' engine. The line is split on whitespace, and every distinct piece is only
+    # tokenized once. Words repeat a lot in a chat, so most pieces are found in pieceDecisions
+    def FastRemoveStopWordsFromLine(self, line):
+        if WHOLELINETOKENIZATIONREGEX.search(line):
+            return self.WordsDecision(line)
+        pieceDecisions = self.pieceDecisions
+        wordsLeft = []
+        lineWordCount = 0
+        for piece in line.split():
+            decision = pieceDecisions.get(piece)
+            if decision is None:
+                if len(pieceDecisions) >= PIECEDECISIONCACHESIZE:
+                    pieceDecisions.clear()
+                decision = pieceDecisions[piece] = self.WordsDecision(piece)
+            lineWordCount += decision[1]
+            wordsLeft.extend(decision[0])
+        return wordsLeft, lineWordCount
+
+    # Tokenizes text with the TweetTokenizer. Returns the words that are left after removing stop words, and the number of words
+    def WordsDecision(self, text):
+        wordsLeft = []
+        wordCount = 0
+        for token in self.tokenizer.tokenize(text):
+            (counted, word) = self.WordDecision(token)
+            wordCount += counted
+            if word is not None:
+                wordsLeft.append(word)
+        return wordsLeft, wordCount
+
+    # Decides what happens to one token of the TweetTokenizer. Returns 1 if it is counted as a word and 0 otherwise,
+    # and the word that is left after removing stop words, or None if nothing is left
+    def WordDecision(self, token):
+        word = token.lower()
+        # If the word contains an apostrophe, it is a contraction. The first word in the contraction is only considered
+        # Any words following the apostrophe are always stop words. So we can ignore them
+        if ("'" in word):
+            word = IndivStats.contractionTokenizer(word)[0]
+        # A word is recognised. Now we must find whether it is a stop word
+        if word in self.stopWords:
+            return 1, None
+        for letter in word:
+            # The word is counted as a valid word if and only if it has at least one alphanum in it
+            if letter in (ALPHANUM):
+                return 1, word
+        # Otherwise, it is not a word at all
+        return 0, None
+
     # Function should remove all stopwords that are present in the list of stopwords
     # Function also calculates the word count and returns it
+    @InstrumentedStage
     def RemoveStopWords(self):
-        # Stop Words: commonly used words like for, is, and that need to be filtered out
-        stop_Words = set(stopwords.words('english'))
-        # TweetTokenizer tokenizes string but preserves ' and - in words
-        tknr = TweetTokenizer()
+        self.LoadTokenizer()
 
         if not self.ValidateIO(self.splitMessageOutputFilePath, self.withoutStopWordsOutputFilePath):
             return -1
@@ -580,73 +1858,982 @@ class IndivStats(CommonValidationMethods):
         fout = open(self.withoutStopWordsOutputFilePath, mode='w', encoding="utf8")
 
         totalWordCount = 0
+        lineCount = 0
 
         line = fin.readline()
         while line:
-            wordlist = tknr.tokenize(line)
-            for word in wordlist:
-                word = word.lower()
-                # If the word contains an apostrophe, it is a contraction. The first word in the contraction is only considered
-                # Any words following the apostrophe are always stop words. So we can ignore them
-                if ("'" in word):
-                    word = nltk.word_tokenize(word)[0]
-                # A word is recognised. Now we must find whether it is a stop word
-                totalWordCount += 1
-                if not word in stop_Words:
-                    wordHasAnAlphaNumFlag = False
-                    for letter in word:
-                        # The word is counted as a valid word if and only if it has at least one alphanum in it
-                        if letter in (ALPHANUM):
-                            wordHasAnAlphaNumFlag = True
-                            break
-                    if wordHasAnAlphaNumFlag == True:
-                        fout.write(" " + word)
-                    # Otherwise, we have incorrectly added it to the word count. So we decrement word count
-                    else:
-                        totalWordCount -= 1
+            (wordsLeft, lineWordCount) = self.RemoveStopWordsFromLine(line)
+            totalWordCount += lineWordCount
+            for word in wordsLeft:
+                fout.write(" " + word)
             fout.write('\n')
+            lineCount += 1
             line = fin.readline()
 
         fin.close()
         fout.close()
+        runReport.Count(inputFilePath=self.splitMessageOutputFilePath, linesProcessed=lineCount, filesWritten=[self.withoutStopWordsOutputFilePath])
         return totalWordCount
 
         # Reads a text file containing timestamps, and plots a bar graph based on frequency of occurence of timestamps
         # Output is saved to an image file
         # NOTE: currently the function counts frequency on a per day basis. TODO: Add more frequency options
 
+    @InstrumentedStage
     def FrequencyPlotFromFile(self, frequency='day'):
         # File validation
-        if not self.ValidateIO(self.timestampOutputFilePath, self.frequencyPlotOutputFilePath):
+        if not self.ValidateResultIO(self.timestampOutputFilePath, self.frequencyPlotOutputFilePath):
             return -1
 
-        # Frequencies of messages sent on a per day basis
-        self.freqDistTableYearly = np.zeros(366, int)
-
         # Counting frequencies
+        # The timestamps were written in TIMESTAMPFORMAT, which NumPy parses straight into an array of datetime64 values
         with open(self.timestampOutputFilePath, 'r', encoding='utf8') as fin:
-            totalMessages = 0
-            line = fin.readline()
-            while line:
-                totalMessages += 1
-                # Timestamps are correctly parsed if they are in the standard format for timestamps
-                currentTimeStamp = dateutil.parser.parse(line)
-                # Converted timestamp to an integer value from 1 to 366 depending on day of year, useful for plotting
-                yDay = self.DayOfYear(currentTimeStamp)
-                self.freqDistTableYearly[yDay - 1] += 1
-                line = fin.readline()
+            timeStamps = np.array(fin.read().splitlines(), dtype='datetime64[m]')
+        totalMessages = len(timeStamps)
+        # Frequencies of messages sent on a per day basis
+        self.freqDistTableYearly = self.YearlyFrequencies(timeStamps)
 
-        # this is for plotting purpose
-        index = np.arange(1, 367)
-        plt.bar(index, self.freqDistTableYearly)
-        plt.xlabel('Day of Year', fontsize=5)
-        plt.ylabel('No of Messages', fontsize=5)
-        # plt.xticks(index, index, fontsize=5, rotation=30)
-        plt.title('Yearly frequency of messaging')
-        plt.savefig(self.frequencyPlotOutputFilePath, dpi=200)
-        plt.close()
+        self.PlotFrequency()
+        runReport.Count(inputFilePath=self.timestampOutputFilePath, linesProcessed=totalMessages, messagesProcessed=totalMessages,
+                        filesWritten=[self.frequencyPlotOutputFilePath] if drawPlots else [])
         return totalMessages
 
+    # Plots the bar graph of messages sent on each day of the year, and saves it to the frequency plot file
+    def PlotFrequency(self):
+        # this is for plotting purpose
+        frequencyPlotRenderer.Plot(self.freqDistTableYearly, self.frequencyPlotOutputFilePath)
+
+    # ===============================
+    # Memory mode
+    # ===============================
+
+    # Prepares the contact to receive its messages straight from the parser. When the intermediate files are written, the parser passes the OutputFileWriters
+    # that the without stop words file is written with
+    def StartStreaming(self, writers = None):
+        self.LoadTokenizer()
+        if writeIntermediateFiles and writers is not None:
+            self.withoutStopWordsWriters = writers
+            writers.Create(self.withoutStopWordsOutputFilePath)
+
+    # Adds a message sent by the contact at the given timestamp. Continuation lines of the message are added with AddMessageLine
+    def AddMessage(self, timeStamp, message):
+        self.totalMessages += 1
+        self.freqDistTableYearly[self.DayOfYear(timeStamp) - 1] += 1
+        return self.AddMessageLine(message)
+
+    # Adds one line of text sent by the contact to its word counts, the same way RemoveStopWords and FindWordCountFromFile count it
+    # Returns the number of words in the line
+    def AddMessageLine(self, line):
+        (wordsLeft, lineWordCount) = self.RemoveStopWordsFromLine(line)
+        self.wordCount += lineWordCount
+        # The words are split on whitespace again, just like when they are read back from the without stop words file
+        withoutStopWordsLine = ''.join(' ' + word for word in wordsLeft)
+        words = withoutStopWordsLine.split()
+        self.allWordCounts.update(words)
+        if self.ngramCounts:
+            self.CountPhrases(words)
+        # An empty message never made it into the split messages file, so it has no line in the without stop words file either
+        if self.withoutStopWordsWriters is not None and line:
+            self.withoutStopWordsWriters.Write(self.withoutStopWordsOutputFilePath, withoutStopWordsLine + '\n')
+        return lineWordCount
+
+    # Adds statistics that were counted separately, for example by a worker process, to those of the contact
+    def MergeStatistics(self, wordCount, totalMessages, allWordCounts, freqDistTableYearly, ngramCounts):
+        self.wordCount += wordCount
+        self.totalMessages += totalMessages
+        self.allWordCounts.update(allWordCounts)
+        self.freqDistTableYearly += freqDistTableYearly
+        for (n, counter) in ngramCounts.items():
+            self.ngramCounts[n].update(counter)
+
+    # Called once the whole chat has been parsed
+    def FinishStreaming(self):
+        self.withoutStopWordsWriters = None
+
+ 
+
+
+
+# Writes many text files at once, like the intermediate files of every sender of a chat, while keeping at most maximumOpenFiles of them open.
+# Text is buffered per file and written in large blocks, once a file has OUTPUTFILEBUFFERLINES lines waiting or all files together have bufferLines.
+# The files that were written least recently are closed when another one has to be opened, and are opened again for appending, so the files come out
+# exactly as if each had been kept open and written one piece at a time
+class OutputFileWriters:
+    def __init__(self, maximumOpenFiles, bufferLines):
+        self.maximumOpenFiles = max(1, min(maximumOpenFiles, self.OpenFileLimit() // 4))
+        self.bufferLines = bufferLines
+        # Lines waiting to be written for every file created, and their number over all files
+        self.buffers = {}
+        self.bufferedLines = 0
+        # Open files, the least recently written first
+        self.openFiles = OrderedDict()
+
+    # Returns the most files this process may have open. At most a quarter of them are used by the writers, leaving the rest to everything else
+    def OpenFileLimit(self):
+        try:
+            import resource
+        except ImportError:
+            return 512
+        softLimit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        return softLimit if softLimit != resource.RLIM_INFINITY else 1 << 20
+
+    # Creates an empty file, replacing any file at the path, and returns the path
+    def Create(self, path):
+        self.buffers[path] = []
+        self.Open(path, 'w')
+        return path
+
+    # Opens a file and makes it the most recently written one, closing the least recently written file if too many are open
+    def Open(self, path, mode):
+        if len(self.openFiles) >= self.maximumOpenFiles:
+            self.openFiles.popitem(last=False)[1].close()
+        fout = self.openFiles[path] = open(path, mode=mode, encoding='utf8')
+        return fout
+
+    def Write(self, path, text):
+        buffer = self.buffers[path]
+        buffer.append(text)
+        self.bufferedLines += 1
+        if len(buffer) >= OUTPUTFILEBUFFERLINES:
+            self.Flush(path)
+        elif self.bufferedLines >= self.bufferLines:
+            self.FlushAll()
+
+    # Writes the text waiting for a file to it
+    def Flush(self, path):
+        buffer = self.buffers[path]
+        if not buffer:
+            return
+        fout = self.openFiles.get(path)
+        if fout is None:
+            fout = self.Open(path, 'a')
+        else:
+            self.openFiles.move_to_end(path)
+        fout.write(''.join(buffer))
+        self.bufferedLines -= len(buffer)
+        buffer.clear()
+
+    def FlushAll(self):
+        for path in self.buffers:
+            self.Flush(path)
+
+    # Writes all text that is still waiting and closes the files
+    def Close(self):
+        self.FlushAll()
+        for fout in self.openFiles.values():
+            fout.close()
+        self.openFiles.clear()
+
+
+# Compact columnar representation of a parsed chat. Every message sent by a contact is stored as its timestamp, sender id,
+# the byte offset and length of its text in the input file (continuation lines included) and its flags.
+# Sender ids index into the senderNames table. The store is saved in the output folder of the chat and is only reused
+# if the hash of the input file still matches, so unchanged chats do not have to be parsed again
+class MessageStore:
+    def __init__(self, inputHash = 'null'):
+        self.inputHash = inputHash
+        self.senderNames = []
+        self.senderIds = {}
+        # Columns are built with arrays while the chat is parsed, and are converted to NumPy arrays when saved or loaded.
+        # Every message takes 21 bytes: minutes since the epoch, sender id and message length are 32 bit, and only byte offsets need 64 bits
+        # Timestamps are stored as minutes since the epoch
+        self.timestamps = array.array('i')
+        self.senders = array.array('I')
+        self.offsets = array.array('q')
+        self.lengths = array.array('i')
+        self.flags = array.array('B')
+        # Chat totals, as found by SplitMessageNametagTimestamp
+        self.totalLines = 0
+        self.validDates = 0
+        self.validMessages = 0
+        self.startTimeStamp = NULLDATETIME
+        self.endTimeStamp = NULLDATETIME
+
+    # Returns the sender id of a name, adding the name to the sender table if it is new
+    def SenderId(self, name):
+        senderId = self.senderIds.get(name)
+        if senderId is None:
+            senderId = len(self.senderNames)
+            self.senderIds[name] = senderId
+            self.senderNames.append(name)
+        return senderId
+
+    # Adds a message whose text starts at the byte offset and ends at the byte offset messageEnd
+    def AddMessage(self, name, timeStamp, offset, messageEnd, flags):
+        self.timestamps.append((timeStamp - EPOCHDATETIME) // ONEMINUTE)
+        self.senders.append(self.SenderId(name))
+        self.offsets.append(offset)
+        self.lengths.append(messageEnd - offset)
+        self.flags.append(flags)
+
+    # Adds a continuation line ending at the byte offset messageEnd to the last message
+    def ExtendLastMessage(self, messageEnd):
+        self.lengths[-1] = messageEnd - self.offsets[-1]
+
+    # Returns the contents of the store as plain Python objects, so they can be pickled into a checkpoint
+    def GetState(self):
+        return (self.senderNames, self.timestamps, self.senders, self.offsets, self.lengths, self.flags)
+
+    # Restores contents returned by GetState. Messages can be added to the store afterwards
+    def SetState(self, state):
+        (self.senderNames, self.timestamps, self.senders, self.offsets, self.lengths, self.flags) = state
+        self.senderIds = {name: senderId for senderId, name in enumerate(self.senderNames)}
+
+    # Appends the messages of another store, starting from its message at index firstMessage. Sender ids are translated to the sender table of this store
+    def AppendStore(self, other, firstMessage = 0):
+        senderIds = {}
+        for senderId in other.senders[firstMessage:]:
+            if senderId not in senderIds:
+                senderIds[senderId] = self.SenderId(other.senderNames[senderId])
+            self.senders.append(senderIds[senderId])
+        self.timestamps.extend(other.timestamps[firstMessage:])
+        self.offsets.extend(other.offsets[firstMessage:])
+        self.lengths.extend(other.lengths[firstMessage:])
+        self.flags.extend(other.flags[firstMessage:])
+
+    def SetChatTotals(self, totalLines, validDates, validMessages, startTimeStamp, endTimeStamp):
+        self.totalLines = totalLines
+        self.validDates = validDates
+        self.validMessages = validMessages
+        self.startTimeStamp = startTimeStamp
+        self.endTimeStamp = endTimeStamp
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Returns the memory taken by the columns of the store in bytes
+    def MemoryBytes(self):
+        return sum(column.itemsize * len(column) for column in (self.timestamps, self.senders, self.offsets, self.lengths, self.flags))
+
+    # Converts stored minutes since the epoch back to a datetime
+    def DateTime(self, minutes):
+        return EPOCHDATETIME + int(minutes) * ONEMINUTE
+
+    # Saves the store as an uncompressed .npz file. The file is replaced in one step, so an interrupted save never leaves a broken store behind
+    def Save(self, path):
+        senderDataType = np.uint16 if len(self.senderNames) <= np.iinfo(np.uint16).max + 1 else np.uint32
+        temporaryPath = path + '.tmp.npz'
+        np.savez(temporaryPath,
+                 version = np.array(STOREVERSION),
+                 inputHash = np.array(self.inputHash),
+                 senderNames = np.array(self.senderNames, dtype = str),
+                 timestamps = np.asarray(self.timestamps, dtype = np.int32),
+                 senders = np.asarray(self.senders, dtype = senderDataType),
+                 offsets = np.asarray(self.offsets, dtype = np.int64),
+                 lengths = np.asarray(self.lengths, dtype = np.int32),
+                 flags = np.asarray(self.flags, dtype = np.uint8),
+                 totals = np.array([self.totalLines, self.validDates, self.validMessages,
+                                    (self.startTimeStamp - EPOCHDATETIME) // ONEMINUTE, (self.endTimeStamp - EPOCHDATETIME) // ONEMINUTE], dtype = np.int64))
+        os.replace(temporaryPath, path)
+
+    # Loads a store saved by Save. Returns None if there is no usable store at the path
+    def Load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != STOREVERSION:
+                    return None
+                self.inputHash = str(data['inputHash'])
+                self.senderNames = [str(name) for name in data['senderNames']]
+                self.senderIds = {name: senderId for senderId, name in enumerate(self.senderNames)}
+                self.timestamps = data['timestamps']
+                self.senders = data['senders']
+                self.offsets = data['offsets']
+                self.lengths = data['lengths']
+                self.flags = data['flags']
+                (self.totalLines, self.validDates, self.validMessages, startMinutes, endMinutes) = (int(total) for total in data['totals'])
+        except (OSError, ValueError, KeyError):
+            print('Message store {} could not be read. The chat will be parsed again'.format(path))
+            return None
+        self.startTimeStamp = self.DateTime(startMinutes)
+        self.endTimeStamp = self.DateTime(endMinutes)
+        return self
+
+
+# Full-text search index of the messages of all analysed chats, kept in one SQLite database. Every message is a row of the messages table with
+# its chat, sender, timestamp (in TIMESTAMPFORMAT, so timestamps sort as text) and text, and the words of the text are indexed by an FTS5 table
+# that reads the text from the messages table. Senders and timestamps have their own index, so the words, sender and dates of a query narrow each other down
+class SearchIndex:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    # Opens the index, creating it if it does not exist yet, and returns it. An index made with another SEARCHINDEXVERSION is emptied first
+    def Open(self):
+        # Transactions are started and committed explicitly, so every chat is indexed in a single transaction
+        self.connection = sqlite3.connect(self.path, timeout=SQLITEBUSYSECONDS, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != SEARCHINDEXVERSION:
+                for table in ('messages_fts', 'messages', 'chats'):
+                    self.connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+                self.connection.execute('CREATE TABLE chats (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, inputHash TEXT NOT NULL, messages INTEGER NOT NULL)')
+                self.connection.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, chat INTEGER NOT NULL, sender TEXT NOT NULL, timestamp TEXT NOT NULL, text TEXT NOT NULL)')
+                self.connection.execute('CREATE INDEX messages_chat ON messages (chat)')
+                self.connection.execute('CREATE INDEX messages_sender_timestamp ON messages (sender, timestamp)')
+                self.connection.execute('CREATE INDEX messages_timestamp ON messages (timestamp)')
+                self.connection.execute("CREATE VIRTUAL TABLE messages_fts USING fts5(text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+                self.connection.execute('PRAGMA user_version = {}'.format(SEARCHINDEXVERSION))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            self.Close()
+            raise
+        return self
+
+    def Close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # Replaces the messages of a chat with the given (sender, timestamp, text) messages, in one transaction. The words of all of them are indexed at once
+    # after they are inserted. Returns the number of messages indexed, or None if the chat was already indexed from an input file with the same hash
+    def IndexChat(self, chatName, inputHash, messages):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute('SELECT id, inputHash FROM chats WHERE name = ?', (chatName,)).fetchone()
+            if row is not None and row[1] == inputHash:
+                self.connection.execute('ROLLBACK')
+                return None
+            if row is None:
+                chatId = self.connection.execute('INSERT INTO chats (name, inputHash, messages) VALUES (?, ?, 0)', (chatName, inputHash)).lastrowid
+            else:
+                chatId = row[0]
+                # The words of the old messages have to be removed from the FTS5 table while their text is still in the messages table
+                self.connection.execute("INSERT INTO messages_fts (messages_fts, rowid, text) SELECT 'delete', id, text FROM messages WHERE chat = ?", (chatId,))
+                self.connection.execute('DELETE FROM messages WHERE chat = ?', (chatId,))
+            indexedMessages = self.connection.executemany('INSERT INTO messages (chat, sender, timestamp, text) VALUES (?, ?, ?, ?)',
+                                                          ((chatId, sender, timestamp, text) for (sender, timestamp, text) in messages)).rowcount
+            self.connection.execute('INSERT INTO messages_fts (rowid, text) SELECT id, text FROM messages WHERE chat = ?', (chatId,))
+            self.connection.execute('UPDATE chats SET inputHash = ?, messages = ? WHERE id = ?', (inputHash, indexedMessages, chatId))
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return indexedMessages
+
+    # Turns the words of a query into an FTS5 query that matches messages containing all of them. Every word is quoted,
+    # so punctuation like the apostrophe in "don't" is left to the tokenizer instead of being read as FTS5 syntax
+    def MatchExpression(self, query):
+        return ' '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+    # Returns the (timestamp, chat, sender, text) of the messages that contain all the words of the query, oldest first. Any of the query, sender name and
+    # chat name can be left out. Only messages from the start date up to, but not including, the end date are returned, where dates are any start of a
+    # timestamp, like '2023' or '2023-06-01'
+    def Search(self, query = None, senderName = None, chatName = None, startDate = None, endDate = None, limit = 20):
+        conditions = []
+        parameters = []
+        tables = 'messages JOIN chats ON chats.id = messages.chat'
+        if query and query.split():
+            tables += ' JOIN messages_fts ON messages_fts.rowid = messages.id'
+            conditions.append('messages_fts MATCH ?')
+            parameters.append(self.MatchExpression(query))
+        if senderName is not None:
+            conditions.append('messages.sender = ?')
+            parameters.append(senderName)
+        if chatName is not None:
+            conditions.append('chats.name = ?')
+            parameters.append(chatName)
+        if startDate is not None:
+            conditions.append('messages.timestamp >= ?')
+            parameters.append(startDate)
+        if endDate is not None:
+            conditions.append('messages.timestamp < ?')
+            parameters.append(endDate)
+        statement = 'SELECT messages.timestamp, chats.name, messages.sender, messages.text FROM {}{} ORDER BY messages.timestamp, messages.id LIMIT ?'.format(
+            tables, ' WHERE ' + ' AND '.join(conditions) if conditions else '')
+        return self.connection.execute(statement, parameters + [limit]).fetchall()
+
+
+# Merges several exports of the same chat into one export, leaving out the messages that more than one of them has. Exports are in timestamp order,
+# so their messages are merged in timestamp order in one pass, and a message can only be a duplicate of one with the same timestamp.
+# So only the timestamps, senders and normalized texts of the messages of the current minute are kept, which bounds the memory used by the number of messages sent in one minute.
+# A message sent several times in the same minute by the same sender is kept as often as the export that has it most often has it.
+# Messages are written with their timestamp in the DD/MM/YYYY layout, and lines without a sender name are written as they were, because some of them
+# only have a timestamp because a continuation line was read as one, like a phone number
+class ExportMerger:
+    def __init__(self):
+        self.exports = 0
+        self.messagesRead = 0
+        self.messagesDropped = 0
+        self.messagesMerged = 0
+
+    # Writes the messages of the exports at inputFilePaths to mergedFilePath, without duplicates, and returns the totals of the merge, see Totals.
+    # Messages of the first export come first among messages sent in the same minute. The merged file is replaced in one step once it is written
+    def Merge(self, inputFilePaths, mergedFilePath):
+        self.exports = len(inputFilePaths)
+        streams = [self.ExportMessages(exportIndex, inputFilePath) for exportIndex, inputFilePath in enumerate(inputFilePaths)]
+        currentTimeStamp = None
+        formattedDateTime = None
+        formattedTimeStamp = ''
+        # Number of times each message of the current minute was written, and was read from each export. Messages are compared by their timestamp,
+        # sender name and normalized text themselves, so different messages are never taken for duplicates
+        writtenMessages = {}
+        readMessages = {}
+        temporaryPath = mergedFilePath + '.tmp'
+        with open(temporaryPath, mode='w', encoding='utf8', newline='') as fout:
+            for (mergeTimeStamp, exportIndex, timeStamp, name, text) in heapq.merge(*streams, key=operator.itemgetter(0)):
+                self.messagesRead += 1
+                if mergeTimeStamp != currentTimeStamp:
+                    currentTimeStamp = mergeTimeStamp
+                    writtenMessages.clear()
+                    readMessages.clear()
+                messageKey = (timeStamp, name, self.NormalizedText(text))
+                timesRead = readMessages.get((messageKey, exportIndex), 0) + 1
+                readMessages[(messageKey, exportIndex)] = timesRead
+                if timesRead <= writtenMessages.get(messageKey, 0):
+                    self.messagesDropped += 1
+                    continue
+                writtenMessages[messageKey] = timesRead
+                self.messagesMerged += 1
+                # The last message of an export may not end with a line break
+                if not text.endswith('\n'):
+                    text += '\n'
+                if name is None:
+                    fout.write(text)
+                else:
+                    if timeStamp != formattedDateTime:
+                        formattedDateTime = timeStamp
+                        formattedTimeStamp = timeStamp.strftime(MERGEDEXPORTTIMESTAMPFORMAT)
+                    fout.write('{}{}: {}'.format(formattedTimeStamp, name, text))
+        os.replace(temporaryPath, mergedFilePath)
+        return self.Totals()
+
+    # Yields the timestamp the messages of an export are merged by, the export index, and the timestamp, sender name and text of every message of the export,
+    # see GlobalStats.ParsedMessages. Messages and lines without a sender name, like the system lines, are merged by their own timestamp, unless it is earlier
+    # than that of the message before them. So the messages of every export are merged in the order of the export. Continuation lines are part of the text
+    # of their message, so they always stay after it
+    def ExportMessages(self, exportIndex, inputFilePath):
+        export = GlobalStats(os.path.splitext(os.path.basename(inputFilePath))[0])
+        export.inputFilePath = inputFilePath
+        mergeTimeStamp = NULLDATETIME
+        for (timeStamp, name, text) in export.ParsedMessages():
+            if timeStamp > mergeTimeStamp:
+                mergeTimeStamp = timeStamp
+            yield (mergeTimeStamp, exportIndex, timeStamp, name, text)
+
+    # Returns the text of a message the way it is compared with the messages of the other exports. Exports made on different phones can differ
+    # in their line endings, invisible characters and Unicode normalization
+    def NormalizedText(self, text):
+        return ' '.join(unicodedata.normalize('NFC', text.translate(INVISIBLEMESSAGECHARACTERS)).split())
+
+    # Returns the number of exports merged, of messages read from all of them, of duplicates dropped and of messages written to the merged export
+    def Totals(self):
+        return {'exports': self.exports, 'messagesRead': self.messagesRead, 'messagesDropped': self.messagesDropped, 'messagesMerged': self.messagesMerged}
+
+
+# Number of messages sent by every contact in every hour of the chat. Only the hours in which a contact sent messages are stored, as sorted keys
+# (sender id, day since the first day of the chat, hour of day) with their message counts. Counts by hour of day, weekday, ISO week, month,
+# calendar date or day of year are derived from these hours for any contact or the whole group, and any range of dates, without the timestamps
+class ActivityCube:
+    def __init__(self):
+        self.senderNames = []
+        self.senderIds = {}
+        self.firstDay = np.datetime64(EPOCHDATETIME, 'D')
+        self.numberOfDays = 0
+        self.keys = np.zeros(0, np.int64)
+        self.counts = np.zeros(0, np.int64)
+
+    # Counts the messages of every contact in every hour in one pass. senders are indexes into senderNames, and timeStamps are datetime64 values
+    def Build(self, senderNames, senders, timeStamps):
+        self.senderNames = list(senderNames)
+        self.senderIds = {name: senderId for senderId, name in enumerate(self.senderNames)}
+        if len(timeStamps):
+            days = timeStamps.astype('datetime64[D]')
+            firstDay = days.min()
+            dayIndexes = (days - firstDay).astype(np.int64)
+            hours = (timeStamps - days).astype('timedelta64[h]').astype(np.int64)
+            self.firstDay = firstDay
+            self.numberOfDays = int(dayIndexes.max()) + 1
+            keys = (np.asarray(senders, np.int64) * self.numberOfDays + dayIndexes) * 24 + hours
+            (self.keys, self.counts) = np.unique(keys, return_counts=True)
+        return self
+
+    # Builds the cube from the messages of a MessageStore that were counted as sent by a contact
+    def BuildFromMessageStore(self, store):
+        counted = (np.asarray(store.flags) & STOREMESSAGECOUNTED) != 0
+        return self.Build(store.senderNames, np.asarray(store.senders)[counted], np.asarray(store.timestamps)[counted].astype('datetime64[m]'))
+
+    # Returns the days since the first day of the chat, hours of day and message counts of the hours sent by a contact, or by everyone if senderName is None.
+    # Only the hours from the start date up to, but not including, the end date are returned. Dates can be anything np.datetime64 understands, like '2024-03'
+    def Hours(self, senderName = None, startDate = None, endDate = None):
+        startDay = 0 if startDate is None else min(max(int((np.datetime64(startDate, 'D') - self.firstDay).astype(np.int64)), 0), self.numberOfDays)
+        endDay = self.numberOfDays if endDate is None else min(max(int((np.datetime64(endDate, 'D') - self.firstDay).astype(np.int64)), startDay), self.numberOfDays)
+        if senderName is None:
+            dayIndexes = self.keys // 24 % max(self.numberOfDays, 1)
+            inRange = (dayIndexes >= startDay) & (dayIndexes < endDay)
+            (keys, counts) = (self.keys[inRange], self.counts[inRange])
+        else:
+            # The hours of one contact in a range of dates are next to each other in the sorted keys
+            senderStart = self.senderIds[senderName] * self.numberOfDays * 24
+            (first, last) = np.searchsorted(self.keys, [senderStart + startDay * 24, senderStart + endDay * 24])
+            (keys, counts) = (self.keys[first:last], self.counts[first:last])
+        return keys // 24 % max(self.numberOfDays, 1), keys % 24, counts
+
+    # Returns labels and message counts at a resolution: 'hour' (of day), 'weekday' (0 is Monday), 'week' (labelled by the Monday of each ISO week),
+    # 'month', 'date' or 'dayofyear' (1 to 366, counted on a leap year like IndivStats.DayOfYear). Dates without messages are left out of
+    # 'week', 'month' and 'date'. See Hours for senderName, startDate and endDate
+    def Histogram(self, resolution, senderName = None, startDate = None, endDate = None):
+        (dayIndexes, hours, counts) = self.Hours(senderName, startDate, endDate)
+        if resolution == 'hour':
+            return np.arange(24), np.bincount(hours, counts, minlength=24).astype(np.int64)
+        dates = self.firstDay + dayIndexes.astype('timedelta64[D]')
+        # 1970-01-05 was a Monday
+        weekdays = (dates - np.datetime64('1970-01-05')).astype(np.int64) % 7
+        if resolution == 'weekday':
+            return np.arange(7), np.bincount(weekdays, counts, minlength=7).astype(np.int64)
+        if resolution == 'dayofyear':
+            months = dates.astype('datetime64[M]')
+            daysOfYear = LEAPYEARMONTHSTARTS[months.astype(np.int64) % 12] + (dates - months).astype(np.int64) + 1
+            return np.arange(1, 367), np.bincount(daysOfYear - 1, counts, minlength=366).astype(np.int64)
+        if resolution == 'week':
+            buckets = dates - weekdays.astype('timedelta64[D]')
+        elif resolution == 'month':
+            buckets = dates.astype('datetime64[M]')
+        elif resolution == 'date':
+            buckets = dates
+        else:
+            raise ValueError('Unknown resolution {}'.format(resolution))
+        (labels, bucketIndexes) = np.unique(buckets, return_inverse=True)
+        return labels, np.bincount(bucketIndexes, counts, minlength=len(labels)).astype(np.int64)
+
+
+# Who replies to whom in a chat, and how fast. A message is a reply to the message before it if someone else sent that one, at most replyWindowMinutes
+# earlier. The replies are found by shifting the sender and timestamp columns of the chat by one message. Only the pairs of people that replied to each
+# other are counted, with np.unique, and the reply times are kept sorted by sender, so memory grows with the number of replies and never with the square
+# of the number of people, however large the chat is
+class InteractionMatrix:
+    def __init__(self):
+        self.senderNames = []
+        # Pairs of a sender and the sender they replied to, sorted by sender, with the number of replies sent to them
+        self.repliers = np.zeros(0, np.int64)
+        self.repliedTo = np.zeros(0, np.int64)
+        self.replyCounts = np.zeros(0, np.int64)
+        # Reply times in minutes of all replies, sorted by sender and then by time. The reply times of sender i are replyTimes[replyTimeStarts[i]:replyTimeStarts[i + 1]]
+        self.replyTimes = np.zeros(0, np.int64)
+        self.replyTimeStarts = np.zeros(1, np.int64)
+
+    # Finds the replies between messages sent in the given order. senders are indexes into senderNames, and timeStamps are minutes since the epoch
+    def Build(self, senderNames, senders, timeStamps):
+        self.senderNames = list(senderNames)
+        numberOfSenders = len(self.senderNames)
+        senders = np.asarray(senders, np.int64)
+        replyTimes = np.diff(np.asarray(timeStamps, np.int64))
+        # Timestamps going back in time, which exports have now and then, never make a reply
+        isReply = (senders[1:] != senders[:-1]) & (replyTimes >= 0) & (replyTimes <= replyWindowMinutes)
+        repliers = senders[1:][isReply]
+        replyTimes = replyTimes[isReply]
+        (pairs, self.replyCounts) = np.unique(repliers * numberOfSenders + senders[:-1][isReply], return_counts=True)
+        (self.repliers, self.repliedTo) = np.divmod(pairs, max(numberOfSenders, 1))
+        order = np.lexsort((replyTimes, repliers))
+        self.replyTimes = replyTimes[order]
+        self.replyTimeStarts = np.searchsorted(repliers[order], np.arange(numberOfSenders + 1))
+        return self
+
+    # Finds the replies between all messages of a MessageStore, including media and deleted messages
+    def BuildFromMessageStore(self, store):
+        return self.Build(store.senderNames, np.asarray(store.senders), np.asarray(store.timestamps))
+
+    # Returns the number of replies sent by every sender, followed by the number of replies of the whole chat, and for each of them the reply times in minutes
+    # at the given percentiles. A percentile p is the shortest time within which at least p percent of the replies were sent, like np.percentile with
+    # method='inverted_cdf', and 0 when there were no replies. The reply times of every sender are sorted already, so their percentiles are read straight from them
+    def ReplyTimePercentiles(self, percentiles):
+        replies = np.diff(self.replyTimeStarts)
+        ranks = np.maximum((replies[:, None] * np.array(percentiles, np.int64) + 99) // 100, 1)
+        replyTimes = np.zeros((len(replies), len(percentiles)), np.int64)
+        hasReplies = replies > 0
+        replyTimes[hasReplies] = self.replyTimes[self.replyTimeStarts[:-1][hasReplies][:, None] + ranks[hasReplies] - 1]
+        chatReplyTimes = np.percentile(self.replyTimes, percentiles, method='inverted_cdf').astype(np.int64) if len(self.replyTimes) else np.zeros(len(percentiles), np.int64)
+        return replies.tolist() + [len(self.replyTimes)], replyTimes.tolist() + [chatReplyTimes.tolist()]
+
+    # Returns the names of the n senders who got the most replies from a sender, with the number of replies
+    def TopRepliedTo(self, senderId, n):
+        (first, last) = np.searchsorted(self.repliers, [senderId, senderId + 1])
+        replyCounts = self.replyCounts[first:last]
+        return [(self.senderNames[self.repliedTo[first + pair]], int(replyCounts[pair])) for pair in np.argsort(-replyCounts, kind='stable')[:n]]
+
+    # Returns the replies between every two people who replied to each other, and the number of replies and reply time percentiles of every person
+    # who replied to someone, as plain Python objects that can be sent as JSON
+    def Statistics(self):
+        (replies, replyTimes) = self.ReplyTimePercentiles(REPLYTIMEPERCENTILES)
+        replyCounts = {}
+        for (replier, repliedTo, count) in zip(self.repliers.tolist(), self.repliedTo.tolist(), self.replyCounts.tolist()):
+            replyCounts.setdefault(self.senderNames[replier], {})[self.senderNames[repliedTo]] = count
+        replyTimePercentiles = {self.senderNames[senderId]: dict(zip(map(str, REPLYTIMEPERCENTILES), replyTimes[senderId]))
+                                for senderId in range(len(self.senderNames)) if replies[senderId]}
+        return {'replyWindowMinutes': replyWindowMinutes, 'totalReplies': replies[-1], 'replyTimePercentiles': dict(zip(map(str, REPLYTIMEPERCENTILES), replyTimes[-1])),
+                'replyCounts': replyCounts, 'senderReplyTimePercentiles': replyTimePercentiles}
+
+    # Draws a heatmap of the number of replies each person sent to each other person, with at most INTERACTIONHEATMAPSENDERS people, in plotFormat.
+    # Only the matrix of the people shown is ever made
+    def DrawHeatmap(self, outputFilePath, chatName):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        numberOfSenders = len(self.senderNames)
+        replies = (np.bincount(self.repliers, self.replyCounts, minlength=numberOfSenders) +
+                   np.bincount(self.repliedTo, self.replyCounts, minlength=numberOfSenders))
+        senderIds = np.sort(np.argsort(-replies, kind='stable')[:INTERACTIONHEATMAPSENDERS])
+        heatmapIndexes = np.full(numberOfSenders, -1, np.int64)
+        heatmapIndexes[senderIds] = np.arange(len(senderIds))
+        (rows, columns) = (heatmapIndexes[self.repliers], heatmapIndexes[self.repliedTo])
+        shown = (rows >= 0) & (columns >= 0)
+        heatmap = np.zeros((len(senderIds), len(senderIds)), np.int64)
+        heatmap[rows[shown], columns[shown]] = self.replyCounts[shown]
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        image = axes.imshow(heatmap, cmap='viridis', interpolation='nearest')
+        figure.colorbar(image, ax=axes).ax.tick_params(labelsize=5)
+        names = [self.senderNames[senderId] for senderId in senderIds]
+        axes.set_xticks(np.arange(len(names)))
+        axes.set_xticklabels(names, fontsize=5, rotation=90)
+        axes.set_yticks(np.arange(len(names)))
+        axes.set_yticklabels(names, fontsize=5)
+        axes.set_xlabel('Replied to', fontsize=5)
+        axes.set_ylabel('Reply sent by', fontsize=5)
+        axes.set_title('Replies in {}'.format(chatName) if len(senderIds) == numberOfSenders else
+                       'Replies in {} ({} most active of {} people)'.format(chatName, len(senderIds), numberOfSenders))
+        figure.tight_layout()
+        resultStore.SaveFigure(figure, outputFilePath)
+
+
+# Word counter of the heavyhitters engine, with the same update and most_common methods as Counter. Only the counts of at most 2 * capacity words are kept.
+# Once there are more, every count is lowered by the (capacity + 1)th highest count, and the words whose count drops to 0 are dropped (Misra-Gries).
+# Each lowering takes at least capacity + 1 times its size off the total of the counts, so the total lowering, error, is at most the number of
+# words counted divided by capacity + 1. most_common adds error back to the kept counts, which gives the same estimates as the Space-Saving algorithm:
+# never lower than the true count, and at most error higher. Counters of parts of a chat or of several contacts are merged with update, adding their errors
+class HeavyHitterCounter:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    # Counts an iterable of words, or adds the counts of another HeavyHitterCounter or of a Counter
+    def update(self, words):
+        counts = self.counts
+        if isinstance(words, HeavyHitterCounter):
+            self.error += words.error
+            words = words.counts
+        if isinstance(words, dict):
+            for (word, count) in words.items():
+                counts[word] = counts.get(word, 0) + count
+        else:
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        if len(counts) > 2 * self.capacity:
+            self.Prune()
+
+    def Prune(self):
+        lowering = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {word: count - lowering for (word, count) in self.counts.items() if count > lowering}
+        self.error += lowering
+
+    # Returns the n words with the highest estimated counts, with their estimates, like Counter.most_common
+    def most_common(self, n):
+        return [(word, count + self.error) for (word, count) in heapq.nlargest(n, self.counts.items(), key=operator.itemgetter(1))]
+
+
+# Returns an empty word counter of the wordCountEngine
+def NewWordCounter():
+    if wordCountEngine == 'heavyhitters':
+        return HeavyHitterCounter(heavyHitterCapacity)
+    return Counter()
+
+
+# Returns empty phrase counters for every size in ngramSizes. The phrases of a long chat are far too many to count exactly, so they are always counted
+# with a HeavyHitterCounter of ngramCapacity
+def NewNgramCounters():
+    return {n: HeavyHitterCounter(ngramCapacity) for n in ngramSizes}
+
+
+# Draws the yearly frequency bar graphs of the contacts and of the group chat. Setting up a figure with 366 bars takes most of the time
+# of a plot, so one figure is kept for the whole process and only the heights of its bars and the limits of its axes are changed for the next plot.
+# The plots come out exactly like those of a new pyplot figure. matplotlib is imported when the first plot is drawn, and only the Agg canvas is used,
+# so no GUI backend is ever loaded
+class FrequencyPlotRenderer:
+    def __init__(self):
+        self.figure = None
+        self.axes = None
+        self.bars = None
+        # Plots queued between StartBatch and FinishBatch, as (freqDistTableYearly, outputFilePath)
+        self.batch = None
+
+    # Draws a plot, or queues it if a batch has been started
+    def Plot(self, freqDistTableYearly, outputFilePath):
+        if not drawPlots:
+            return
+        if self.batch is not None:
+            self.batch.append((np.array(freqDistTableYearly), outputFilePath))
+            return
+        self.Draw(freqDistTableYearly, outputFilePath)
+
+    def Draw(self, freqDistTableYearly, outputFilePath):
+        if self.figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.figure = Figure()
+            FigureCanvasAgg(self.figure)
+            self.axes = self.figure.add_subplot()
+            self.bars = self.axes.bar(np.arange(1, 367), freqDistTableYearly)
+            self.axes.set_xlabel('Day of Year', fontsize=5)
+            self.axes.set_ylabel('No of Messages', fontsize=5)
+            self.axes.set_title('Yearly frequency of messaging')
+        else:
+            self.SetHeights(freqDistTableYearly)
+        resultStore.SaveFigure(self.figure, outputFilePath)
+
+    # Changes the heights of the bars, and sets the limits of the axes to those a new bar graph would get. All bars start at 0,
+    # so the data limits only depend on the first, the last and the highest bar
+    def SetHeights(self, freqDistTableYearly):
+        from matplotlib.transforms import Bbox
+        for (bar, height) in zip(self.bars, freqDistTableYearly):
+            bar.set_height(height)
+        self.axes.dataLim.set_points(Bbox.null().get_points())
+        self.axes.ignore_existing_data_limits = True
+        for bar in (self.bars[0], self.bars[-1], self.bars[int(np.argmax(freqDistTableYearly))]):
+            self.axes.update_datalim(bar.get_patch_transform().transform(bar.get_path().vertices))
+        self.axes.autoscale_view()
+
+    # Plots made from now on are queued instead of drawn, until FinishBatch is called
+    def StartBatch(self):
+        self.batch = []
+
+    # Draws the queued plots, split up between plotJobs worker processes. Every worker sets up its figure once and draws its share of the plots with it
+    def FinishBatch(self):
+        (batch, self.batch) = (self.batch, None)
+        if not batch:
+            return
+        # DrawFrequencyPlots takes the results of the process it runs in, so in this process they are added back
+        if plotJobs == 1 or len(batch) == 1:
+            resultStore.AddResults(DrawFrequencyPlots(batch))
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=plotJobs, initializer=ApplySettings, initargs=(CurrentSettings(),)) as executor:
+            futures = [executor.submit(DrawFrequencyPlots, batch[part::plotJobs]) for part in range(min(plotJobs, len(batch)))]
+            for future in futures:
+                resultStore.AddResults(future.result())
+
+
+# Renderer used for every plot drawn by this process
+frequencyPlotRenderer = FrequencyPlotRenderer()
+
+
+# Records the stages of the analysis of a chat for its run report. Every call of a stage marked with InstrumentedStage gets a record with its wall and CPU time,
+# the peak memory of the process once it is done, and the bytes, lines and messages it processed and the files it wrote, as counted by the stage with Count.
+# Stages called by another stage get their own record as well. The stage named by profileStage is run under cProfile
+class RunReport:
+    def __init__(self):
+        # Records of the stages in the order they started, None while no report is being made
+        self.records = None
+        # Records of the stages that are running, the innermost last
+        self.openRecords = []
+        self.profile = None
+
+    # Starts recording stages
+    def Start(self):
+        self.records = []
+        self.openRecords = []
+        self.profile = None
+
+    # Stops recording stages, and returns the records and the profile of profileStage, if it ran
+    def Finish(self):
+        (records, profile) = (self.records, self.profile)
+        (self.records, self.openRecords, self.profile) = (None, [], None)
+        return records, profile
+
+    # Adds records made by a worker process
+    def AddRecords(self, records):
+        if self.records is not None:
+            self.records.extend(records)
+
+    def RunStage(self, stageName, instance, method, args, kwargs):
+        record = {'stage': stageName, 'contact': instance.name if isinstance(instance, IndivStats) else None,
+                  'bytesProcessed': 0, 'linesProcessed': 0, 'messagesProcessed': 0, 'filesWritten': []}
+        self.records.append(record)
+        self.openRecords.append(record)
+        profiling = stageName == profileStage
+        if profiling and self.profile is None:
+            import cProfile
+            self.profile = cProfile.Profile()
+        startWallTime = time.perf_counter()
+        startCpuTime = time.process_time()
+        try:
+            if profiling:
+                self.profile.enable()
+            try:
+                return method(instance, *args, **kwargs)
+            finally:
+                if profiling:
+                    self.profile.disable()
+        finally:
+            record['wallSeconds'] = round(time.perf_counter() - startWallTime, 6)
+            record['cpuSeconds'] = round(time.process_time() - startCpuTime, 6)
+            record['messagesPerSecond'] = round(record['messagesProcessed'] / record['wallSeconds'], floatDigitsAfterDecimal) if record['wallSeconds'] > 0 else None
+            record['peakMemoryMB'] = PeakMemoryMB()
+            self.openRecords.pop()
+
+    # Adds the work done by the running stage to its record. The size of inputFilePath, if given, is added to the bytes processed.
+    # Does nothing while no report is being made
+    def Count(self, bytesProcessed = 0, linesProcessed = 0, messagesProcessed = 0, inputFilePath = None, filesWritten = ()):
+        if not self.openRecords:
+            return
+        record = self.openRecords[-1]
+        if inputFilePath is not None:
+            bytesProcessed += os.path.getsize(inputFilePath)
+        record['bytesProcessed'] += bytesProcessed
+        record['linesProcessed'] += linesProcessed
+        record['messagesProcessed'] += messagesProcessed
+        record['filesWritten'].extend(filesWritten)
+
+
+# Run report of the chat analysed by this process
+runReport = RunReport()
+
+
+# Text output file of the result store. Works like a file opened for writing, and hands its contents to the store when it is closed
+class ResultFile(io.StringIO):
+    def __init__(self, store, path, append):
+        super().__init__()
+        self.store = store
+        self.path = path
+        self.append = append
+
+    def close(self):
+        if not self.closed:
+            self.store.AddResult(self.path, self.getvalue().encode('utf8'), self.append)
+        super().close()
+
+
+# Keeps the output files of a chat with results, like the individual analysis of every contact, the overall statistics, the frequency plots and the run report,
+# when outputBackend is 'sqlite'. They are collected in memory by their path relative to the output folder while the chat is analysed, and SaveChat writes all
+# of them to one SQLite database in one transaction, with the statistics of the chat and of its contacts. Exporting the database gives the same folders the
+# 'folders' backend writes. With the 'folders' backend, the output files are written straight away
+class ResultStore:
+    def __init__(self):
+        # Contents of the output files of the chat that is being analysed, by their path relative to the output folder
+        self.results = {}
+
+    # Returns whether output files with results are kept in the result store instead of being written
+    def Captures(self):
+        return outputBackend == 'sqlite'
+
+    # Opens an output text file with results for writing, or for appending with mode 'a'
+    def Open(self, path, mode = 'w'):
+        if not self.Captures():
+            return open(path, mode=mode, encoding='utf8')
+        return ResultFile(self, path, mode == 'a')
+
+    # Saves a matplotlib figure as an output file, in plotFormat
+    def SaveFigure(self, figure, path):
+        if not self.Captures():
+            figure.savefig(path, format=plotFormat, dpi=plotDpi)
+            return
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format=plotFormat, dpi=plotDpi)
+        self.AddResult(path, buffer.getvalue())
+
+    # Saves a cProfile profile as an output file, in the format python -m pstats reads, like Profile.dump_stats does
+    def SaveProfile(self, profile, path):
+        if not self.Captures():
+            profile.dump_stats(path)
+            return
+        import marshal
+        profile.create_stats()
+        self.AddResult(path, marshal.dumps(profile.stats))
+
+    # Keeps the contents of an output file, or adds them to the end of what it already holds when appending
+    def AddResult(self, path, data, append = False):
+        key = os.path.relpath(path, outputDir).replace(os.sep, '/')
+        if append and key in self.results:
+            data = self.results[key] + data
+        self.results[key] = data
+
+    # Returns the output files collected so far and forgets them, so a worker process can send them to the process analysing the chat
+    def TakeResults(self):
+        (results, self.results) = (self.results, {})
+        return results
+
+    # Adds output files returned by TakeResults
+    def AddResults(self, results):
+        self.results.update(results)
+
+    # Forgets the output files of a chat whose analysis did not finish
+    def StartChat(self):
+        self.results = {}
+
+    # Opens the result store database, creating it if it does not exist yet. A database made with another RESULTSTOREVERSION is emptied first
+    def Connect(self):
+        # Transactions are started and committed explicitly, so every chat is saved in a single transaction
+        connection = sqlite3.connect('{}/{}'.format(outputDir, resultStoreFileName), timeout=SQLITEBUSYSECONDS, isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('PRAGMA user_version').fetchone()[0] != RESULTSTOREVERSION:
+                for table in ('results', 'contacts', 'chats'):
+                    connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+                connection.execute('CREATE TABLE chats (name TEXT PRIMARY KEY, totalMessages INTEGER NOT NULL, chatAge INTEGER NOT NULL, statistics TEXT NOT NULL)')
+                connection.execute('CREATE TABLE contacts (chat TEXT NOT NULL, name TEXT NOT NULL, totalMessages INTEGER NOT NULL, wordCount INTEGER NOT NULL, '
+                                   'averageWordsPerMessage REAL NOT NULL, topWords TEXT NOT NULL, PRIMARY KEY (chat, name))')
+                connection.execute('CREATE TABLE results (path TEXT PRIMARY KEY, chat TEXT NOT NULL, data BLOB NOT NULL)')
+                connection.execute('CREATE INDEX results_chat ON results (chat)')
+                connection.execute('PRAGMA user_version = {}'.format(RESULTSTOREVERSION))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            connection.close()
+            raise
+        return connection
+
+    # Replaces everything stored for the chat with its collected output files and its statistics, see GlobalStats.Statistics, in one transaction
+    def SaveChat(self, chatName, statistics):
+        if not self.Captures():
+            return
+        results = self.TakeResults()
+        connection = self.Connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for table in ('results', 'contacts'):
+                    connection.execute('DELETE FROM {} WHERE chat = ?'.format(table), (chatName,))
+                connection.execute('INSERT OR REPLACE INTO chats (name, totalMessages, chatAge, statistics) VALUES (?, ?, ?, ?)',
+                                   (chatName, statistics['totalMessages'], statistics['chatAge'], json.dumps(statistics, ensure_ascii=False)))
+                connection.executemany('INSERT INTO contacts (chat, name, totalMessages, wordCount, averageWordsPerMessage, topWords) VALUES (?, ?, ?, ?, ?, ?)',
+                                       ((chatName, name, contact['totalMessages'], contact['wordCount'], contact['averageWordsPerMessage'],
+                                         json.dumps(contact['topWords'], ensure_ascii=False)) for (name, contact) in statistics['contacts'].items()))
+                connection.executemany('INSERT OR REPLACE INTO results (path, chat, data) VALUES (?, ?, ?)',
+                                       ((path, chatName, data) for (path, data) in sorted(results.items())))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        finally:
+            connection.close()
+        print('{} output files of {} saved to {}/{}'.format(len(results), chatName, outputDir, resultStoreFileName))
+
+    # Writes the output files of every chat in the result store to exportDir, in the folders the 'folders' backend writes them to. Returns the number of files written
+    def ExportFolders(self, exportDir):
+        resultStoreFilePath = '{}/{}'.format(outputDir, resultStoreFileName)
+        if not os.path.exists(resultStoreFilePath):
+            raise FileNotFoundError('There is no result store at {}. Analyse the chats with --output-backend sqlite first'.format(resultStoreFilePath))
+        connection = self.Connect()
+        try:
+            exportedFiles = 0
+            for (path, data) in connection.execute('SELECT path, data FROM results ORDER BY path'):
+                exportFilePath = '{}/{}'.format(exportDir, path)
+                os.makedirs(os.path.dirname(exportFilePath), exist_ok=True)
+                with open(exportFilePath, mode='wb') as fout:
+                    fout.write(data)
+                exportedFiles += 1
+        finally:
+            connection.close()
+        return exportedFiles
+
+
+# Result store of the chat analysed by this process
+resultStore = ResultStore()
 
 
 # ===============================
@@ -654,22 +2841,610 @@ class IndivStats(CommonValidationMethods):
 # ===============================
 
 
-for inputFileName in os.listdir(inputDir):
-    # groupChats is a dictionary with Group chat names mapped to their respective GroupStat class objects
-    groupChats = {}
-    if inputFileName.endswith('.txt'):
-        # This means we have detected an input file. We will assume all input files are group chat files that are stored in txt format.
-        # Input file variable names for easy access
-        # The file name is treated as the group chat's name. So "WhatsApp Chat with xxx" will end up being the group name
+# Reads the command line options into the script parameters. Returns where the analysis service should listen and the arguments of SearchMessages
+# if the search index is searched, each of them None if the input folder is analysed as usual
+def ParseArguments(arguments = None):
+    global jobs, parserJobs, contactJobs, contactWorkerMemoryLimitMB, drawPlots, plotFormat, plotDpi, plotJobs, writeRunReport, profileStage, serviceJobs, serviceQueueSize, ngramSizes, ngramCapacity
+    global buildSearchIndex, mergeExports, outputBackend, analyseInteractions, replyWindowMinutes
+    parser = argparse.ArgumentParser(description='Analyses the WhatsApp chats exported to the input folder.')
+    parser.add_argument('--jobs', type=int, default=jobs, metavar='N', help='number of input files analysed in parallel (default: {})'.format(jobs))
+    parser.add_argument('--parser-jobs', type=int, default=parserJobs, metavar='N',
+                        help='number of processes that parse one large input file in parallel, in memory mode (default: {})'.format(parserJobs))
+    parser.add_argument('--contact-jobs', type=int, default=contactJobs, metavar='N',
+                        help='number of contacts of a chat analysed in parallel (default: {})'.format(contactJobs))
+    parser.add_argument('--contact-memory-limit', type=int, default=contactWorkerMemoryLimitMB, metavar='MB',
+                        help='most memory each --contact-jobs worker process may use, 0 for no limit (default: {})'.format(contactWorkerMemoryLimitMB))
+    parser.add_argument('--plot-jobs', type=int, default=plotJobs, metavar='N',
+                        help='number of processes that draw the frequency plots of a chat (default: {})'.format(plotJobs))
+    parser.add_argument('--plot-format', choices=('png', 'svg'), default=plotFormat, help='file format of the frequency plots (default: {})'.format(plotFormat))
+    parser.add_argument('--plot-dpi', type=int, default=plotDpi, metavar='DPI', help='resolution of the PNG frequency plots (default: {})'.format(plotDpi))
+    parser.add_argument('--no-plots', action='store_true', help='do not draw the frequency plots')
+    parser.add_argument('--ngrams', default=','.join(str(n) for n in ngramSizes), metavar='N[,N...]',
+                        help='also find the top phrases of N words for every contact and for the group, like 2,3 for two and three word phrases')
+    parser.add_argument('--ngram-capacity', type=int, default=ngramCapacity, metavar='N',
+                        help='number of phrases of each size counted per contact and for the group (default: {})'.format(ngramCapacity))
+    parser.add_argument('--run-report', action='store_true', help='write the time, memory and work of every stage to {} in the output folder of each chat'.format(runReportFileName))
+    parser.add_argument('--profile-stage', choices=INSTRUMENTEDSTAGES, default=profileStage, metavar='STAGE',
+                        help='profile one stage with cProfile and save the profile next to the run report, implies --run-report (stages: {})'.format(', '.join(INSTRUMENTEDSTAGES)))
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='run as an analysis service over HTTP on this port, on localhost unless a host is given')
+    parser.add_argument('--serve-socket', metavar='PATH', help='run as an analysis service over HTTP on this Unix socket')
+    parser.add_argument('--service-jobs', type=int, default=serviceJobs, metavar='N',
+                        help='number of worker processes of the analysis service (default: {})'.format(serviceJobs))
+    parser.add_argument('--service-queue', type=int, default=serviceQueueSize, metavar='N',
+                        help='most chats the analysis service takes at once (default: {})'.format(serviceQueueSize))
+    parser.add_argument('--merge', action='store_true',
+                        help='merge input files whose names only differ by a copy number, like "Family.txt" and "Family (1).txt", into one chat without duplicate messages')
+    parser.add_argument('--interactions', action='store_true',
+                        help='find who replies to whom and how fast, and draw a heatmap of the replies between the people of every chat')
+    parser.add_argument('--reply-window', type=int, default=replyWindowMinutes, metavar='MINUTES',
+                        help='most minutes between a message and a reply to it, for --interactions (default: {})'.format(replyWindowMinutes))
+    parser.add_argument('--output-backend', choices=('folders', 'sqlite'), default=outputBackend,
+                        help='write the results of every chat to folders of files, or to the single database {} in the output folder (default: {})'.format(resultStoreFileName, outputBackend))
+    parser.add_argument('--export-folders', nargs='?', const=outputDir, metavar='DIR',
+                        help='write the results in {} to folders of files in DIR, the output folder by default, instead of analysing the input folder'.format(resultStoreFileName))
+    parser.add_argument('--search-index', action='store_true',
+                        help='add the messages of every analysed chat to the full-text search index {} in the output folder'.format(searchIndexFileName))
+    parser.add_argument('--search', nargs='?', const='', metavar='WORDS',
+                        help='print the indexed messages that contain all these words instead of analysing the input folder')
+    parser.add_argument('--search-sender', metavar='NAME', help='only search the messages of this sender')
+    parser.add_argument('--search-chat', metavar='NAME', help='only search the messages of this chat')
+    parser.add_argument('--search-from', metavar='DATE', help='only search messages sent from this date on, like 2023 or 2023-06-01')
+    parser.add_argument('--search-to', metavar='DATE', help='only search messages sent before this date, like 2024 or 2023-07')
+    parser.add_argument('--search-limit', type=int, default=20, metavar='N', help='most messages printed by --search (default: 20)')
+    options = parser.parse_args(arguments)
+    if options.jobs < 1:
+        parser.error('--jobs has to be at least 1')
+    if options.parser_jobs < 1:
+        parser.error('--parser-jobs has to be at least 1')
+    if options.contact_jobs < 1:
+        parser.error('--contact-jobs has to be at least 1')
+    if options.contact_memory_limit < 0:
+        parser.error('--contact-memory-limit cannot be negative')
+    if options.plot_jobs < 1:
+        parser.error('--plot-jobs has to be at least 1')
+    if options.plot_dpi < 1:
+        parser.error('--plot-dpi has to be at least 1')
+    jobs = options.jobs
+    parserJobs = options.parser_jobs
+    contactJobs = options.contact_jobs
+    contactWorkerMemoryLimitMB = options.contact_memory_limit
+    plotJobs = options.plot_jobs
+    plotFormat = options.plot_format
+    plotDpi = options.plot_dpi
+    drawPlots = drawPlots and not options.no_plots
+    try:
+        ngramSizes = tuple(sorted(set(int(n) for n in options.ngrams.split(',') if n.strip())))
+    except ValueError:
+        parser.error('--ngrams takes comma separated numbers of words, like 2,3')
+    if any(n < 2 for n in ngramSizes):
+        parser.error('--ngrams takes phrases of at least 2 words')
+    if options.ngram_capacity < 1:
+        parser.error('--ngram-capacity has to be at least 1')
+    ngramCapacity = options.ngram_capacity
+    profileStage = options.profile_stage
+    writeRunReport = writeRunReport or options.run_report or profileStage is not None
+    if options.service_jobs < 1:
+        parser.error('--service-jobs has to be at least 1')
+    if options.service_queue < 1:
+        parser.error('--service-queue has to be at least 1')
+    serviceJobs = options.service_jobs
+    serviceQueueSize = options.service_queue
+    buildSearchIndex = buildSearchIndex or options.search_index
+    mergeExports = mergeExports or options.merge
+    outputBackend = options.output_backend
+    if options.reply_window < 0:
+        parser.error('--reply-window cannot be negative')
+    analyseInteractions = analyseInteractions or options.interactions
+    replyWindowMinutes = options.reply_window
+    search = None
+    if options.search is not None:
+        if options.search_limit < 1:
+            parser.error('--search-limit has to be at least 1')
+        search = {'query': options.search, 'senderName': options.search_sender, 'chatName': options.search_chat,
+                  'startDate': options.search_from, 'endDate': options.search_to, 'limit': options.search_limit}
+    elif any(value is not None for value in (options.search_sender, options.search_chat, options.search_from, options.search_to)):
+        parser.error('--search-sender, --search-chat, --search-from and --search-to need --search')
+    if options.serve is not None and options.serve_socket is not None:
+        parser.error('--serve and --serve-socket cannot be used together')
+    if search is not None and (options.serve is not None or options.serve_socket is not None):
+        parser.error('--search cannot be used together with --serve or --serve-socket')
+    if options.export_folders is not None and (search is not None or options.serve is not None or options.serve_socket is not None):
+        parser.error('--export-folders cannot be used together with --search, --serve or --serve-socket')
+    if options.serve_socket is not None:
+        if not hasattr(socketserver, 'UnixStreamServer'):
+            parser.error('Unix sockets are not supported on this system')
+        return options.serve_socket, None, None
+    if options.serve is not None:
+        (host, separator, port) = options.serve.rpartition(':')
+        if not port.isdigit():
+            parser.error('--serve needs a port number')
+        return (host or '127.0.0.1', int(port)), None, None
+    return None, search, options.export_folders
+
+
+# Returns the current script parameters, see SETTINGNAMES
+def CurrentSettings():
+    return {name: globals()[name] for name in SETTINGNAMES}
+
+
+# Sets the script parameters. Used as the initializer of worker processes
+def ApplySettings(settings):
+    globals().update(settings)
+
+
+# Parses the part of an input file between two byte offsets. Used by the worker processes of GlobalStats.ParallelSplitMessageNametagTimestamp
+def ParseInputFileChunk(groupChatName, inputFilePath, timestampLayout, startOffset, endOffset):
+    groupChat = GlobalStats(groupChatName)
+    groupChat.SetFilePaths(inputFilePath)
+    groupChat.timestampLayout = timestampLayout
+    return groupChat.ParseChunk(startOffset, endOffset)
+
+
+# Initialiser of the worker processes of GlobalStats.ParallelIndividualCalculations. Applies the script parameters and the memory limit
+def InitialiseContactWorker(settings):
+    ApplySettings(settings)
+    if contactWorkerMemoryLimitMB > 0:
+        try:
+            import resource
+        except ImportError:
+            print('contactWorkerMemoryLimitMB is not supported on this system. Contact workers run without a memory limit')
+            return
+        memoryLimit = contactWorkerMemoryLimitMB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+# Draws the plots queued by FrequencyPlotRenderer, and returns the output files taken from the result store of this process, see ResultStore.TakeResults.
+# Used by the worker processes of FrequencyPlotRenderer.FinishBatch
+def DrawFrequencyPlots(plots):
+    for (freqDistTableYearly, outputFilePath) in plots:
+        frequencyPlotRenderer.Draw(freqDistTableYearly, outputFilePath)
+    return resultStore.TakeResults()
+
+
+# Performs the Individual Analysis of one contact in a worker process, and returns its results, the run report records of its stages
+# and the output files it made for the result store
+def AnalyseContact(contact):
+    if not writeRunReport:
+        contact.IndividualCalculations()
+        return contact.Results(), [], resultStore.TakeResults()
+    runReport.Start()
+    try:
+        contact.IndividualCalculations()
+    finally:
+        (records, profile) = runReport.Finish()
+    return contact.Results(), records, resultStore.TakeResults()
+
+
+# Returns whether an input file is a zipped export
+def IsZipExport(inputFilePath):
+    return inputFilePath.lower().endswith('.zip')
+
+
+# Streams the chat text of a zipped export to outputFolderPath, without extracting any media, so it can be parsed like a plain text export.
+# Returns the path of the chat text, and the size of every other file in the zip by file name, as read from the zip directory
+def ExtractZipExport(zipFilePath, outputFolderPath):
+    with zipfile.ZipFile(zipFilePath) as archive:
+        members = [member for member in archive.infolist() if not member.is_dir()]
+        textMembers = [member for member in members if member.filename.lower().endswith('.txt')]
+        chatMembers = [member for member in textMembers if os.path.basename(member.filename) == ZIPCHATMEMBERNAME] or textMembers
+        if not chatMembers:
+            raise ValueError('{} has no chat text file'.format(zipFilePath))
+        chatMember = max(chatMembers, key=lambda member: member.file_size)
+        if not os.path.exists(outputFolderPath):
+            os.makedirs(outputFolderPath)
+        textFilePath = outputFolderPath + '/' + zipExportTextFileName.format(os.path.splitext(os.path.basename(zipFilePath))[0])
+        temporaryPath = textFilePath + '.tmp'
+        with archive.open(chatMember) as fin, open(temporaryPath, mode='wb') as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+        os.replace(temporaryPath, textFilePath)
+        mediaFiles = {os.path.basename(member.filename): member.file_size for member in members if member is not chatMember}
+    print('Read chat text {} from {}, with {} media files'.format(chatMember.filename, zipFilePath, len(mediaFiles)))
+    return textFilePath, mediaFiles
+
+
+# Analyses one exported chat file and returns its statistics, see GlobalStats.Statistics. The output is written to outputDir/<groupChatName>,
+# and the chat is named after its file by default. This is what the script runs for every input file, and it can be called from other Python code as well
+def AnalyseChatFile(inputFilePath, groupChatName = None):
+    # The file name is treated as the group chat's name. So "WhatsApp Chat with xxx" will end up being the group name
+    if groupChatName is None:
+        groupChatName = os.path.splitext(os.path.basename(inputFilePath))[0]
+
+    # An object for the group chat is created. It is named after the file name
+    groupChat = GlobalStats(groupChatName)
+
+    # The chat text of a zipped export is analysed like a plain text export
+    if IsZipExport(inputFilePath):
+        (inputFilePath, groupChat.mediaFiles) = ExtractZipExport(inputFilePath, outputDir + '/{}'.format(groupChatName))
+
+    # Setting the input and output file paths, so the object can access its respective output files easily
+    groupChat.SetFilePaths(inputFilePath)
+
+    # The group chat object now has all the info it requires to begin analysing. This function will also call individual analysis of each contact
+    # name using the IndivStats class, whose object is an attribute of this class.
+    groupChat.Calculations()
+    return groupChat.Statistics()
+
+
+# Analyses one input file, and returns its name, the wall time taken and the error message if the analysis failed.
+# Errors are caught here, so one bad export does not stop the other files from being analysed
+def AnalyseInputFile(inputFileName):
+    startTime = time.perf_counter()
+    try:
         (groupChatName, inputFileExt) = os.path.splitext(inputFileName)
-        inputTextFilePath = inputDir + '/{}'.format(inputFileName)
+        AnalyseChatFile(inputDir + '/{}'.format(inputFileName), groupChatName)
+    except Exception:
+        print('Analysis of {} failed:\n{}'.format(inputFileName, traceback.format_exc()))
+        return (inputFileName, time.perf_counter() - startTime, traceback.format_exc(limit=0).strip())
+    return (inputFileName, time.perf_counter() - startTime, None)
+
+
+# Returns the (timestamp, chat, sender, text) of the indexed messages that contain all the words of the query, see SearchIndex.Search.
+# Chats are added to the search index when they are analysed with buildSearchIndex
+def SearchMessages(query = None, senderName = None, chatName = None, startDate = None, endDate = None, limit = 20):
+    searchIndexFilePath = '{}/{}'.format(outputDir, searchIndexFileName)
+    if not os.path.exists(searchIndexFilePath):
+        raise FileNotFoundError('There is no search index at {}. Analyse the chats with --search-index first'.format(searchIndexFilePath))
+    searchIndex = SearchIndex(searchIndexFilePath).Open()
+    try:
+        return searchIndex.Search(query, senderName, chatName, startDate, endDate, limit)
+    finally:
+        searchIndex.Close()
+
+
+# Prints the messages found by SearchMessages, one line each, with the time the search took
+def PrintSearchResults(search):
+    startTime = time.perf_counter()
+    try:
+        messages = SearchMessages(**search)
+    except FileNotFoundError as error:
+        print(error)
+        return 1
+    searchTime = time.perf_counter() - startTime
+    for (timestamp, chatName, senderName, text) in messages:
+        print('{} [{}] {}: {}'.format(timestamp, chatName, senderName, text.replace('\n', '\n    ')))
+    print('{} messages found in {:.1f} ms'.format(len(messages), searchTime * 1000))
+    return 0
+
+
+# Writes the results of every chat in the result store to folders of files in exportDir, like the 'folders' output backend does, see ResultStore
+def ExportResultStore(exportDir):
+    try:
+        exportedFiles = resultStore.ExportFolders(exportDir)
+    except FileNotFoundError as error:
+        print(error)
+        return 1
+    print('{} output files exported to {}'.format(exportedFiles, exportDir))
+    return 0
+
+
+# Merges several exports of the same chat with an ExportMerger, and analyses the merged export like AnalyseChatFile does. The merged export is written to
+# the output folder of the chat. Returns the statistics of the chat, with the totals of the merge
+def AnalyseMergedChatFiles(inputFilePaths, groupChatName):
+    groupChat = GlobalStats(groupChatName)
+    groupChat.ValidatePath(outputDir + '/{}'.format(groupChatName))
+    mergedFilePath = outputDir + '/{}/{}'.format(groupChatName, mergedExportFileName)
+    print('Merging {} exports of {}: {}'.format(len(inputFilePaths), groupChatName, ', '.join(inputFilePaths)))
+    # The chat texts of zipped exports are merged, and the media files of all of them are counted
+    textFilePaths = []
+    for inputFilePath in inputFilePaths:
+        if IsZipExport(inputFilePath):
+            (inputFilePath, mediaFiles) = ExtractZipExport(inputFilePath, outputDir + '/{}'.format(groupChatName))
+            groupChat.mediaFiles = {**(groupChat.mediaFiles or {}), **mediaFiles}
+        textFilePaths.append(inputFilePath)
+    groupChat.mergeTotals = ExportMerger().Merge(textFilePaths, mergedFilePath)
+    print('Merging finished. {messagesRead} messages read, {messagesDropped} duplicates dropped, {messagesMerged} messages merged.'.format(**groupChat.mergeTotals))
+    groupChat.SetFilePaths(mergedFilePath)
+    groupChat.Calculations()
+    return groupChat.Statistics()
+
+
+# Analyses the input files of one chat, like AnalyseInputFile does for a single input file, merging them first if there are several
+def AnalyseInputFiles(groupChatName, inputFileNames):
+    if len(inputFileNames) == 1:
+        return AnalyseInputFile(inputFileNames[0])
+    if not mergeExports:
+        error = 'the input files {} would all be analysed as the chat {}, in {}/{}. Rename all but one of them, or use --merge if they are exports of the same chat'.format(
+            ', '.join(inputFileNames), groupChatName, outputDir, groupChatName)
+        print('Analysis of {} failed: {}'.format(', '.join(inputFileNames), error))
+        return (', '.join(inputFileNames), 0.0, error)
+    startTime = time.perf_counter()
+    description = '{} ({} exports)'.format(groupChatName, len(inputFileNames))
+    try:
+        AnalyseMergedChatFiles([inputDir + '/{}'.format(inputFileName) for inputFileName in inputFileNames], groupChatName)
+    except Exception:
+        print('Analysis of {} failed:\n{}'.format(description, traceback.format_exc()))
+        return (description, time.perf_counter() - startTime, traceback.format_exc(limit=0).strip())
+    return (description, time.perf_counter() - startTime, None)
+
+
+# Groups the input files by chat. Without mergeExports every input file is a chat of its own, named after the file without its extension, so files
+# that only differ by their extension, like Family.txt and Family.zip, are grouped together and refused by AnalyseInputFiles, because they would be
+# written to the same output folder. With mergeExports, files whose names only differ by a copy number at the end or by their extension are exports
+# of the same chat, which is named after them without the copy number
+def GroupInputFilesByChat(inputFileNames):
+    chats = {}
+    for inputFileName in inputFileNames:
+        groupChatName = os.path.splitext(inputFileName)[0]
+        if mergeExports:
+            groupChatName = EXPORTCOPYNUMBERREGEX.sub('', groupChatName)
+        chats.setdefault(groupChatName, []).append(inputFileName)
+    return list(chats.items())
+
+
+# Prints the wall time taken by every input file, and which ones failed. Returns the number of failed files
+def PrintSummary(results, totalTime):
+    failedFiles = 0
+    print('\nSummary of {} input files:'.format(len(results)))
+    for (inputFileName, wallTime, error) in results:
+        if error is None:
+            print('{} : {:.2f} s'.format(inputFileName, wallTime))
+        else:
+            failedFiles += 1
+            print('{} : FAILED after {:.2f} s ({})'.format(inputFileName, wallTime, error))
+    print('{} analysed, {} failed. Total wall time {:.2f} s'.format(len(results) - failedFiles, failedFiles, totalTime))
+    return failedFiles
+
 
-        # An object for the group chat is created. It is named after the file name
-        groupChats[groupChatName] = GlobalStats(groupChatName)
+# ===============================
+# Service mode
+# ===============================
+
+# Initialiser of the worker processes of AnalysisService. Applies the script parameters and loads the stop words, the tokenizers and matplotlib,
+# so they are ready before the first chat arrives. Ctrl+C is left to the main process, which shuts the workers down
+def InitialiseServiceWorker(settings):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ApplySettings(settings)
+    IndivStats('null').LoadTokenizer()
+    if drawPlots:
+        import matplotlib.figure, matplotlib.backends.backend_agg
+
+
+# Submitted to every worker process of AnalysisService when it starts, so the workers are started and initialised before the first request
+def WarmUpServiceWorker():
+    return os.getpid()
+
+
+# Keeps a pool of warm worker processes that analyse the chats sent to the service with AnalyseChatFile. At most serviceQueueSize chats are taken at once,
+# and a chat that is already being analysed is not taken again until it is done, as both would write to the same output folder
+class AnalysisService:
+    def __init__(self, workers, queueSize):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.lock = threading.Lock()
+        # Names of the chats that are queued or being analysed
+        self.chatsInProgress = set()
+        self.analysedChats = 0
+        self.executor = None
+        self.StartWorkers()
+
+    def StartWorkers(self):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=InitialiseServiceWorker, initargs=(CurrentSettings(),))
+        for future in [self.executor.submit(WarmUpServiceWorker) for _ in range(self.workers)]:
+            future.result()
+
+    def Shutdown(self):
+        self.executor.shutdown()
+
+    def Status(self):
+        with self.lock:
+            return {'status': 'ok', 'workers': self.workers, 'queueSize': self.queueSize, 'chatsInProgress': sorted(self.chatsInProgress),
+                    'analysedChats': self.analysedChats}
+
+    # Analyses the export at inputFilePath, or the uploaded export, which is saved to the input folder as <groupChatName>.txt first.
+    # Returns the HTTP status and the body of the response
+    def Analyse(self, groupChatName, inputFilePath = None, upload = None, replace = False):
+        if not groupChatName or groupChatName.startswith('.') or any(character in FORBIDDENFILECHARACTERS for character in groupChatName):
+            return 400, {'error': 'invalid chat name {!r}'.format(groupChatName)}
+        with self.lock:
+            if groupChatName in self.chatsInProgress:
+                return 409, {'error': 'chat {} is already being analysed'.format(groupChatName)}
+            if len(self.chatsInProgress) >= self.queueSize:
+                return 503, {'error': 'the service is busy with {} chats, try again later'.format(len(self.chatsInProgress))}
+            self.chatsInProgress.add(groupChatName)
+        try:
+            if upload is not None:
+                inputFilePath = self.SaveUpload(groupChatName, upload, replace)
+            executor = self.executor
+            statistics = executor.submit(AnalyseChatFile, inputFilePath, groupChatName).result()
+        except concurrent.futures.process.BrokenProcessPool as error:
+            # A worker process died, for example because it ran out of memory. The pool cannot be used any more, so new workers are started,
+            # unless another request has done so already
+            with self.lock:
+                if self.executor is executor:
+                    print('A worker process of the analysis service failed ({!r}). Starting new workers'.format(error))
+                    executor.shutdown(wait=False)
+                    self.StartWorkers()
+            return 500, {'error': 'worker process failed: {!r}'.format(error)}
+        except FileExistsError as error:
+            return 409, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': 'analysis failed: {!r}'.format(error)}
+        finally:
+            with self.lock:
+                self.chatsInProgress.discard(groupChatName)
+        with self.lock:
+            self.analysedChats += 1
+        return 200, statistics
+
+    # Saves an uploaded export to the input folder. It is written to a temporary file first, so a half written export is never analysed.
+    # An export of the chat that is already in the input folder, as a text or a zipped export, is only replaced when replace is set, and is
+    # then removed, so the input folder never has two exports of the chat that a later analysis of the folder would take for the same chat
+    def SaveUpload(self, groupChatName, upload, replace = False):
+        if not os.path.exists(inputDir):
+            os.makedirs(inputDir)
+        existingFilePaths = [inputDir + '/{}.{}'.format(groupChatName, extension) for extension in ('txt', 'zip')]
+        existingFilePaths = [existingFilePath for existingFilePath in existingFilePaths if os.path.exists(existingFilePath)]
+        if existingFilePaths and not replace:
+            raise FileExistsError('{} is already in the input folder. Post the export with replace=1 to replace it'.format(' and '.join(existingFilePaths)))
+        (fd, temporaryFilePath) = tempfile.mkstemp(dir=inputDir, suffix='.part')
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(upload)
+        # Zipped exports are recognised by the signature at the start of every zip file
+        inputFilePath = inputDir + '/{}.{}'.format(groupChatName, 'zip' if upload[:4] == b'PK\x03\x04' else 'txt')
+        os.replace(temporaryFilePath, inputFilePath)
+        for existingFilePath in existingFilePaths:
+            if existingFilePath != inputFilePath:
+                os.remove(existingFilePath)
+        return inputFilePath
+
+
+# HTTP interface of the analysis service.
+# GET /health returns the status of the service.
+# POST /analyse analyses an export. With a JSON body {"path": ..., "name": ...} the export is read from that path, which has to be inside inputDir, and is named
+# after the file unless a name is given. Any other body is the export itself, named with the name query parameter (POST /analyse?name=Family). It is saved to
+# inputDir, where an export of the chat that is already there is only replaced with the replace query parameter (POST /analyse?name=Family&replace=1).
+# The response is the JSON of GlobalStats.Statistics, with the statistics of the chat and of its contacts and the paths of their output files
+class AnalysisRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != '/health':
+            self.SendJson(404, {'error': 'not found'})
+            return
+        self.SendJson(200, self.server.service.Status())
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/analyse':
+            self.SendJson(404, {'error': 'not found'})
+            return
+        try:
+            contentLength = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.SendJson(411, {'error': 'Content-Length is needed'})
+            return
+        if contentLength > serviceMaxUploadMB * 1024 * 1024:
+            self.SendJson(413, {'error': 'exports of more than {} MB are not taken'.format(serviceMaxUploadMB)})
+            return
+        body = self.rfile.read(contentLength)
+        query = urllib.parse.parse_qs(url.query)
+        groupChatName = query.get('name', [None])[0]
+
+        if self.headers.get_content_type() != 'application/json':
+            if groupChatName is None:
+                self.SendJson(400, {'error': 'uploaded exports need a name query parameter'})
+                return
+            if not self.IsFileName(groupChatName):
+                self.SendJson(400, {'error': 'the name {!r} is not a valid file name'.format(groupChatName)})
+                return
+            self.SendJson(*self.server.service.Analyse(groupChatName, upload=body, replace=query.get('replace', ['0'])[0] in ('1', 'true')))
+            return
+
+        try:
+            request = json.loads(body)
+            inputFilePath = request['path']
+            groupChatName = request.get('name', groupChatName)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.SendJson(400, {'error': 'the JSON body needs a path'})
+            return
+        if not isinstance(inputFilePath, str):
+            self.SendJson(400, {'error': 'the path has to be a string'})
+            return
+        # Only exports in the input folder are analysed, whatever links or .. the path goes through
+        inputFilePath = os.path.realpath(inputFilePath)
+        if os.path.commonpath([inputFilePath, os.path.realpath(inputDir)]) != os.path.realpath(inputDir):
+            self.SendJson(403, {'error': 'only exports in the input folder {!r} are analysed'.format(inputDir)})
+            return
+        if not os.path.isfile(inputFilePath):
+            self.SendJson(404, {'error': 'no export at {!r}'.format(inputFilePath)})
+            return
+        if groupChatName is None:
+            groupChatName = os.path.splitext(os.path.basename(inputFilePath))[0]
+        elif not self.IsFileName(groupChatName):
+            self.SendJson(400, {'error': 'the name {!r} is not a valid file name'.format(groupChatName)})
+            return
+        self.SendJson(*self.server.service.Analyse(groupChatName, inputFilePath=inputFilePath))
+
+    # The name of a chat becomes the name of its output folder, and of the file an uploaded export is saved to in inputDir, so it cannot be a path
+    def IsFileName(self, name):
+        return (isinstance(name, str) and name not in ('', '.', '..') and os.path.basename(name) == name
+                and not (os.altsep and os.altsep in name) and '\0' not in name)
+
+    def SendJson(self, status, body):
+        response = json.dumps(body, ensure_ascii=False).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    # Requests over a Unix socket have no client address
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix socket'
+
+
+# HTTP server listening on a Unix socket, handling every request in its own thread like http.server.ThreadingHTTPServer
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Stops the analysis service when it is terminated, the same way as Ctrl+C does
+def StopService(signalNumber, frame):
+    raise KeyboardInterrupt
+
+
+# Runs the analysis service until it is interrupted or terminated. address is a (host, port) tuple to listen on, or the path of a Unix socket
+def Serve(address):
+    signal.signal(signal.SIGTERM, StopService)
+    service = AnalysisService(serviceJobs, serviceQueueSize)
+    if isinstance(address, tuple):
+        server = http.server.ThreadingHTTPServer(address, AnalysisRequestHandler)
+        print('Analysis service listening on http://{}:{}'.format(*server.server_address[:2]))
+    else:
+        # A socket left behind by a service that did not shut down cleanly is replaced. Any other file is left alone
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.remove(address)
+        server = UnixHTTPServer(address, AnalysisRequestHandler)
+        print('Analysis service listening on {}'.format(address))
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.Shutdown()
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.remove(address)
+    return 0
+
+
+def Main(arguments = None):
+    (serviceAddress, search, exportDir) = ParseArguments(arguments)
+    if search is not None:
+        return PrintSearchResults(search)
+    if exportDir is not None:
+        return ExportResultStore(exportDir)
+
+    # Pre-processing
+    if not (os.path.exists(inputDir)):
+        os.makedirs(inputDir)
+    if not (os.path.exists(outputDir)):
+        os.makedirs(outputDir)
+    if serviceAddress is not None:
+        return Serve(serviceAddress)
+
+    # We will assume all input files are group chat files that are stored in txt format, or zipped exports with media. They are analysed in name order
+    inputFileNames = sorted(inputFileName for inputFileName in os.listdir(inputDir) if inputFileName.endswith('.txt') or IsZipExport(inputFileName))
+
+    chats = GroupInputFilesByChat(inputFileNames)
+
+    startTime = time.perf_counter()
+    results = []
+    if jobs == 1 or len(chats) <= 1:
+        for (groupChatName, chatInputFileNames) in chats:
+            results.append(AnalyseInputFiles(groupChatName, chatInputFileNames))
+    else:
+        # Every chat is analysed in a worker process. Results are collected in name order, so the summary does not depend on which worker finishes first
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=ApplySettings, initargs=(CurrentSettings(),)) as executor:
+            futures = [executor.submit(AnalyseInputFiles, groupChatName, chatInputFileNames) for (groupChatName, chatInputFileNames) in chats]
+            for ((groupChatName, chatInputFileNames), future) in zip(chats, futures):
+                try:
+                    results.append(future.result())
+                # The worker process itself died, for example because it ran out of memory
+                except Exception as error:
+                    results.append((', '.join(chatInputFileNames), time.perf_counter() - startTime, 'worker process failed: {!r}'.format(error)))
+    failedFiles = PrintSummary(results, time.perf_counter() - startTime)
+    return 1 if failedFiles else 0
 
-        # Setting the input and output file paths, so the object can access its respective output files easily
-        groupChats[groupChatName].SetFilePaths(inputTextFilePath)
 
-        # The group chat object now has all the info it requires to begin analysing. This function will also call individual analysis of each contact
-        # name using the IndivStats class, whose object is an attribute of this class.
-        groupChats[groupChatName].Calculations()
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,114 @@
+import sys
+import argparse
+import random
+import datetime
+from InputParsingScript import LAYOUTDAYFIRST, LAYOUTAMPM, LAYOUTMONTHFIRST
+
+# -------------------------------
+# Synthetic WhatsApp exports
+# -------------------------------
+
+# Writes made up group chat exports that look like the ones exported by WhatsApp, for BenchmarkScript.py and for trying out the analysis.
+# The same arguments always give exactly the same file
+
+# Sender names, some with spaces, digits and non-ASCII characters, like the names of a real phone book
+MEMBERNAMES = ['Alice', 'Bob Smith', 'mike', 'Mary Jane', '+91 98765 43210', 'Zoë', 'Chris-P', 'm', 'Ana María', 'Jürgen', 'Li Wei', 'Ola 😀',
+               'Dad', 'Team Lead', '+1 555 010 9999', 'Kim']
+# Words messages are made of. Stop words, contractions, links, numbers, emoji and punctuation are all treated differently by the tokenizer
+MESSAGEWORDS = ("hello there i'm don't can't it's we'll the a an and of to is in that for you it on with meeting tomorrow lol haha ok okay yes no "
+                "project deadline #tag @user http://example.com/x :) :-( 555-123-4567 rock-n-roll naïve café ... -- Monday mike's pizza 2019 "
+                "o'clock ’quote’ y'all e.g. U.S.A. <3 😀 ❤️ l33t x-ray dinner weekend photos train late home call later thanks").split()
+
+# Fraction of messages of each kind. The rest are normal text messages
+MEDIAMESSAGERATE = 0.05
+DELETEDMESSAGERATE = 0.02
+# Invite links, half of them with the hidden ‎ character WhatsApp writes in front of them
+JOINLINKMESSAGERATE = 0.01
+# Lines written by WhatsApp itself: members leaving and subject changes
+SYSTEMLINERATE = 0.02
+# Chance that a message gets another continuation line
+CONTINUATIONLINERATE = 0.1
+
+
+# Returns the timestamp written in front of a line, followed by ' - ', in the given date layout
+def FormatTimestamp(timeStamp, layout):
+    if layout == LAYOUTDAYFIRST:
+        return timeStamp.strftime('%d/%m/%Y, %H:%M') + ' - '
+    if layout == LAYOUTAMPM:
+        hour = timeStamp.hour % 12 or 12
+        return '{}/{}/{}, {}:{:02d} {}m - '.format(timeStamp.month, timeStamp.day, timeStamp.strftime('%y'), hour, timeStamp.minute,
+                                                   'a' if timeStamp.hour < 12 else 'p')
+    if layout == LAYOUTMONTHFIRST:
+        return '{}/{}/{}, {:02d}:{:02d} - '.format(timeStamp.month, timeStamp.day, timeStamp.strftime('%y'), timeStamp.hour, timeStamp.minute)
+    raise ValueError('Unknown date layout {}'.format(layout))
+
+
+# Returns a message of a few random words
+def RandomText(rnd, minimumWords, maximumWords):
+    return ' '.join(rnd.choice(MESSAGEWORDS) for _ in range(rnd.randint(minimumWords, maximumWords)))
+
+
+# Writes a synthetic export with the given number of members and messages to outputFilePath. Returns the number of lines and bytes written
+def GenerateExport(outputFilePath, members = 8, messages = 10000, layout = LAYOUTDAYFIRST, seed = 0):
+    if not 1 <= members <= len(MEMBERNAMES):
+        raise ValueError('members has to be between 1 and {}'.format(len(MEMBERNAMES)))
+    rnd = random.Random(seed)
+    names = MEMBERNAMES[:members]
+    timeStamp = datetime.datetime(2018, 12, 25, 8, 0)
+    lines = [FormatTimestamp(timeStamp, layout) + 'Messages to this group are now secured with end-to-end encryption. Tap for more info.\n',
+             FormatTimestamp(timeStamp, layout) + '{} created group "Synthetic"\n'.format(names[0])]
+    for _ in range(messages):
+        # Messages come in bursts, with the odd quiet day in between
+        timeStamp += datetime.timedelta(minutes=rnd.choice([0, 0, 1, 3, 17, 60, 600, 1440 * 3]))
+        timestamp = FormatTimestamp(timeStamp, layout)
+        name = rnd.choice(names)
+        kind = rnd.random()
+        if kind < MEDIAMESSAGERATE:
+            lines.append('{}{}: <Media omitted>\n'.format(timestamp, name))
+            continue
+        kind -= MEDIAMESSAGERATE
+        if kind < DELETEDMESSAGERATE:
+            lines.append('{}{}: This message was deleted\n'.format(timestamp, name))
+            continue
+        kind -= DELETEDMESSAGERATE
+        if kind < JOINLINKMESSAGERATE:
+            if rnd.random() < 0.5:
+                lines.append('{}{}: ‎Open this link to join my WhatsApp Group: https://chat.whatsapp.com/AbCdEf\n'.format(timestamp, name))
+            else:
+                lines.append('{}{}: Follow this link to join my WhatsApp group: https://chat.whatsapp.com/AbCdEf\n'.format(timestamp, name))
+            continue
+        kind -= JOINLINKMESSAGERATE
+        if kind < SYSTEMLINERATE:
+            if rnd.random() < 0.5:
+                lines.append('{}{} left\n'.format(timestamp, name))
+            else:
+                lines.append('{}{} changed the subject from "Plans: {}" to "Synthetic"\n'.format(timestamp, name, RandomText(rnd, 1, 3)))
+            continue
+        lines.append('{}{}: {}\n'.format(timestamp, name, RandomText(rnd, 1, 12)))
+        while rnd.random() < CONTINUATIONLINERATE:
+            lines.append(RandomText(rnd, 0, 6) + '\n')
+    text = ''.join(lines)
+    with open(outputFilePath, mode='w', encoding='utf8', newline='') as fout:
+        fout.write(text)
+    return len(lines), len(text.encode('utf8'))
+
+
+def Main(arguments = None):
+    parser = argparse.ArgumentParser(description='Writes a synthetic WhatsApp group chat export.')
+    parser.add_argument('outputFilePath', help='file the export is written to')
+    parser.add_argument('--members', type=int, default=8, help='number of people sending messages, at most {} (default: 8)'.format(len(MEMBERNAMES)))
+    parser.add_argument('--messages', type=int, default=10000, help='number of messages (default: 10000)')
+    parser.add_argument('--layout', choices=(LAYOUTDAYFIRST, LAYOUTAMPM, LAYOUTMONTHFIRST), default=LAYOUTDAYFIRST,
+                        help='date layout of the timestamps (default: {})'.format(LAYOUTDAYFIRST))
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random choices (default: 0)')
+    options = parser.parse_args(arguments)
+    try:
+        (lineCount, byteCount) = GenerateExport(options.outputFilePath, options.members, options.messages, options.layout, options.seed)
+    except ValueError as error:
+        parser.error(str(error))
+    print('{} lines, {} bytes written to {}'.format(lineCount, byteCount, options.outputFilePath))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main())
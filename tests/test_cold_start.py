@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+from SyntheticExportGenerator import GenerateExport
+
+REPOSITORYFOLDERPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Time from importing the script to the first parsed line of a chat
+COLDSTARTBUDGETSECONDS = 0.3
+# The best of a few runs is compared with the budget, so a busy machine does not fail the test
+COLDSTARTRUNS = 3
+HEAVYMODULES = ('nltk', 'matplotlib', 'dateutil')
+
+
+# Runs Python code in a fresh interpreter started in the repository folder, and returns what it printed as JSON
+def RunPython(code):
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPOSITORYFOLDERPATH, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_first_line_parsed_within_budget_without_heavy_modules(tmp_path):
+    exportFilePath = str(tmp_path / 'chat.txt')
+    GenerateExport(exportFilePath, messages=1000)
+    code = ('import time; startTime = time.perf_counter()\n'
+            'import sys, json, InputParsingScript\n'
+            'groupChat = InputParsingScript.GlobalStats("cold start")\n'
+            'groupChat.inputFilePath = {!r}\n'
+            'groupChat.timestampLayout = groupChat.DetectTimestampLayout()\n'
+            'with open(groupChat.inputFilePath, encoding="utf8") as fin:\n'
+            '    (valid, timeStamp, timestampLength) = groupChat.ParseLineDate(fin.readline())\n'
+            'seconds = time.perf_counter() - startTime\n'
+            'print(json.dumps({{"seconds": seconds, "valid": valid, "modules": [name for name in {!r} if name in sys.modules]}}))').format(exportFilePath, HEAVYMODULES)
+    results = [RunPython(code) for _ in range(COLDSTARTRUNS)]
+    for result in results:
+        assert result['valid']
+        assert result['modules'] == []
+    assert min(result['seconds'] for result in results) < COLDSTARTBUDGETSECONDS
+
+
+# A whole analysis without plots never downloads NLTK data, never opens a network connection and never imports matplotlib
+def test_analysis_is_offline(tmp_path):
+    exportFilePath = str(tmp_path / 'chat.txt')
+    GenerateExport(exportFilePath, messages=1000)
+    code = ('import sys, json, socket, nltk, nltk.downloader\n'
+            'downloads = []\n'
+            'def Download(*args, **kwargs):\n'
+            '    downloads.append(repr(args))\n'
+            '    raise RuntimeError("nltk.download called")\n'
+            'nltk.download = nltk.downloader.download = nltk.downloader.Downloader.download = Download\n'
+            'def Connect(self, address):\n'
+            '    raise RuntimeError("network connection to {{}}".format(address))\n'
+            'socket.socket.connect = Connect\n'
+            'import InputParsingScript\n'
+            'InputParsingScript.outputDir = {!r}\n'
+            'InputParsingScript.drawPlots = False\n'
+            'statistics = InputParsingScript.AnalyseChatFile({!r})\n'
+            'print(json.dumps({{"messages": statistics["totalMessages"], "downloads": downloads, "matplotlib": "matplotlib" in sys.modules}}))'
+            ).format(str(tmp_path / 'output'), exportFilePath)
+    result = RunPython(code)
+    assert result['messages'] > 0
+    assert result['downloads'] == []
+    assert not result['matplotlib']
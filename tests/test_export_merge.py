@@ -0,0 +1,47 @@
+import InputParsingScript
+from SyntheticExportGenerator import GenerateExport
+
+# A chat with a message over two lines, a system line in the middle and the same message sent twice in one minute
+CHATLINES = ['25/12/2018, 08:00 - Alice created group "Family"\n',
+             '25/12/2018, 08:01 - Alice: Merry Christmas\n',
+             '25/12/2018, 08:05 - Bob Smith: Merry Christmas to you too\n',
+             'with a second line\n',
+             '02/01/2019, 10:00 - Carol: Happy new year\n',
+             '19/06/2020, 09:00 - Bob Smith changed the subject from "Family" to "The Family"\n',
+             '19/06/2020, 09:02 - Alice: Nice name\n',
+             '19/06/2020, 09:02 - Alice: Nice name\n',
+             '20/06/2020, 11:30 - Carol: Agreed\n',
+             '21/06/2020, 12:00 - Bob Smith: See you all on Sunday\n']
+
+
+def WriteExport(filePath, lines):
+    with open(filePath, mode='w', encoding='utf8', newline='') as fout:
+        fout.writelines(lines)
+    return str(filePath)
+
+
+def MergedLines(tmp_path, exports):
+    inputFilePaths = [WriteExport(tmp_path / 'export{}.txt'.format(exportIndex), lines) for exportIndex, lines in enumerate(exports)]
+    mergedFilePath = str(tmp_path / 'merged.txt')
+    totals = InputParsingScript.ExportMerger().Merge(inputFilePaths, mergedFilePath)
+    with open(mergedFilePath, mode='r', encoding='utf8', newline='') as fin:
+        return fin.readlines(), totals
+
+
+# The second export starts with a system line that the first export has as well. It has to be merged at its own time, and only once
+def test_overlapping_exports_starting_with_system_line(tmp_path):
+    (mergedLines, totals) = MergedLines(tmp_path, [CHATLINES[:8], CHATLINES[5:]])
+    assert mergedLines == CHATLINES
+    assert totals['messagesDropped'] == 3
+
+
+def test_overlapping_synthetic_exports(tmp_path):
+    chatFilePath = str(tmp_path / 'chat.txt')
+    GenerateExport(chatFilePath, members=8, messages=4000, seed=3)
+    with open(chatFilePath, mode='r', encoding='utf8', newline='') as fin:
+        lines = fin.readlines()
+    systemLines = [lineIndex for lineIndex, line in enumerate(lines) if 'changed the subject' in line]
+    secondExportStart = systemLines[len(systemLines) // 2]
+    (mergedLines, totals) = MergedLines(tmp_path, [lines[:secondExportStart + 500], lines[secondExportStart:]])
+    assert totals['messagesMerged'] + totals['messagesDropped'] == totals['messagesRead']
+    assert mergedLines == lines
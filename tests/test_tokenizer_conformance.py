@@ -0,0 +1,73 @@
+import os
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('nltk')
+
+import InputParsingScript
+from SyntheticExportGenerator import GenerateExport
+
+# Lines picked to hit every case the fast tokenizer engine handles differently: contractions, ellipsis dots, phone numbers, HTML entities,
+# emoji joined by a zero width joiner, separator characters, links and non-ASCII words
+CORPUSFILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'tokenizer_corpus.txt')
+
+
+# Counts the lines with a tokenizer engine the way a contact does in memory mode. Returns the word count, the counts of the words left
+# after removing stop words, and what RemoveStopWordsFromLine returned for every line
+def CountWords(lines, engine, monkeypatch):
+    monkeypatch.setattr(InputParsingScript, 'tokenizerEngine', engine)
+    # Decisions remembered by the fast engine are shared by all contacts, so every count starts without them
+    InputParsingScript.IndivStats.pieceDecisions.clear()
+    contact = InputParsingScript.IndivStats(engine)
+    contact.StartStreaming()
+    lineResults = [contact.RemoveStopWordsFromLine(line) for line in lines]
+    for line in lines:
+        contact.AddMessageLine(line)
+    contact.FinishStreaming()
+    return contact.wordCount, Counter(contact.allWordCounts), lineResults
+
+
+def AssertEnginesAgree(lines, monkeypatch):
+    (nltkWordCount, nltkWordCounts, nltkLineResults) = CountWords(lines, 'nltk', monkeypatch)
+    (fastWordCount, fastWordCounts, fastLineResults) = CountWords(lines, 'fast', monkeypatch)
+    mismatches = [line for (line, nltkResult, fastResult) in zip(lines, nltkLineResults, fastLineResults) if nltkResult != fastResult]
+    assert mismatches == []
+    assert fastWordCount == nltkWordCount
+    assert fastWordCounts == nltkWordCounts
+
+
+def test_reference_corpus(monkeypatch):
+    with open(CORPUSFILEPATH, mode='r', encoding='utf8') as fin:
+        lines = fin.readlines()
+    AssertEnginesAgree(lines, monkeypatch)
+
+
+def test_synthetic_export(tmp_path, monkeypatch):
+    exportFilePath = str(tmp_path / 'chat.txt')
+    GenerateExport(exportFilePath, members=16, messages=3000, seed=8)
+    with open(exportFilePath, mode='r', encoding='utf8') as fin:
+        lines = fin.readlines()
+    AssertEnginesAgree(lines, monkeypatch)
+
+
+# In files mode the words are counted by RemoveStopWords, from the split messages file of the contact
+def test_remove_stop_words_stage(tmp_path, monkeypatch):
+    with open(CORPUSFILEPATH, mode='r', encoding='utf8') as fin:
+        corpus = fin.read()
+    totalWordCounts = {}
+    withoutStopWords = {}
+    for engine in ('nltk', 'fast'):
+        monkeypatch.setattr(InputParsingScript, 'tokenizerEngine', engine)
+        InputParsingScript.IndivStats.pieceDecisions.clear()
+        contact = InputParsingScript.IndivStats(engine)
+        contact.splitMessageOutputFilePath = str(tmp_path / 'split_msg.txt')
+        contact.withoutStopWordsOutputFilePath = str(tmp_path / 'without_stop_words_{}.txt'.format(engine))
+        with open(contact.splitMessageOutputFilePath, mode='w', encoding='utf8') as fout:
+            fout.write(corpus)
+        totalWordCounts[engine] = contact.RemoveStopWords()
+        with open(contact.withoutStopWordsOutputFilePath, mode='r', encoding='utf8') as fin:
+            withoutStopWords[engine] = fin.read()
+    assert totalWordCounts['fast'] == totalWordCounts['nltk']
+    assert withoutStopWords['fast'] == withoutStopWords['nltk']
+    assert Counter(withoutStopWords['fast'].split()) == Counter(withoutStopWords['nltk'].split())